@@ -1,4 +1,5 @@
 from PyInstaller.utils.hooks import collect_data_files
 
-# we have to include_py_files so that funcx can extract function source
+# we have to include_py_files so that funcx can extract function source and
+# the SSH runner can send the source of its remote agent
 datas = collect_data_files('rjm', include_py_files=True, excludes=['__pyinstaller', 'tests'])
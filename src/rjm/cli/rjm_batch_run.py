@@ -63,20 +63,23 @@ def batch_run():
     rjb = RemoteJobBatch()
     rjb.setup(args.localjobdirfile, force=args.force)
 
-    # upload files and start
-    rjb.upload_and_start()
-
-    # wait for jobs to complete and download files
     try:
-        rjb.wait_and_download(
-            polling_interval=args.pollingintervalsec,
-            warmup_polling_interval=args.warmuppollingintervalsec,
-            warmup_duration=args.warmupdurationsec,
-        )
-    except BaseException as exc:
-        # writing an stderr.txt file into the directory of unfinished jobs, for wfn
-        rjb.write_stderr_for_unfinshed_jobs(traceback.format_exc())
-        raise exc
+        # upload files and start
+        rjb.upload_and_start()
+
+        # wait for jobs to complete and download files
+        try:
+            rjb.wait_and_download(
+                polling_interval=args.pollingintervalsec,
+                warmup_polling_interval=args.warmuppollingintervalsec,
+                warmup_duration=args.warmupdurationsec,
+            )
+        except BaseException as exc:
+            # writing an stderr.txt file into the directory of unfinished jobs, for wfn
+            rjb.write_stderr_for_unfinshed_jobs(traceback.format_exc())
+            raise exc
+    finally:
+        rjb.close()
 
 
 if __name__ == "__main__":
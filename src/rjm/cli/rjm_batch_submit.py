@@ -67,7 +67,10 @@ def batch_submit():
     rjb.setup(args.localjobdirfile, force=args.force)
 
     # upload files and start
-    rjb.upload_and_start()
+    try:
+        rjb.upload_and_start()
+    finally:
+        rjb.close()
 
 
 if __name__ == "__main__":
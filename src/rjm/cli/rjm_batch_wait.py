@@ -79,6 +79,8 @@ def batch_wait(args=None):
         rjb.write_stderr_for_unfinshed_jobs(traceback.format_exc())
         logger.error("Exiting due to errors (check logs for details)")
         sys.exit(1)
+    finally:
+        rjb.close()
 
 
 if __name__ == "__main__":
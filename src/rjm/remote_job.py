@@ -10,13 +10,20 @@ from retry.api import retry_call
 from rjm import utils
 from rjm import config as config_helper
 from rjm.transferers import globus_https_transferer
+from rjm.transferers.globus_transfer_task_transferer import GlobusTransferTaskTransferer
+from rjm.transferers.transfer_planner import LANE_INLINE, LANE_BUNDLE
 from rjm.runners.globus_compute_slurm_runner import GlobusComputeSlurmRunner
-from rjm.errors import RemoteJobRunnerError, RemoteJobConfigError
+from rjm.errors import RemoteJobRunnerError, RemoteJobConfigError, RemoteJobTransfererError
 
 
+UPLOAD_VERIFY_ATTEMPTS = 3  # number of times to check uploads (re-uploading mismatched files in between)
+
 _PARAMIKO_INSTALL_HINT = (
     "paramiko is not installed; reinstall with 'pip install RemoteJobManager[ssh]'"
 )
+_ASYNC_INSTALL_HINT = (
+    "httpx is not installed; reinstall with 'pip install RemoteJobManager[async]'"
+)
 
 
 logger = logging.getLogger(__name__)
@@ -55,6 +62,10 @@ class RemoteJob:
         config = config_helper.load_config()
         self._uploads_file = config.get("FILES", "uploads_file")
         self._downloads_file = config.get("FILES", "downloads_file")
+        self._compress_downloads = config.getboolean("FILES", "compress_downloads", fallback=False)
+        self._verify_uploads = config.getboolean("FILES", "verify_uploads", fallback=True)
+        self._plan_transfers = config.getboolean("FILES", "plan_transfers", fallback=False)
+        self._pending_bundle = None  # uploaded archive of small files that still needs unpacking
         self._retry_tries, self._retry_backoff, self._retry_delay, self._retry_max_delay = utils.get_retry_values_from_config(config)
 
         # file transferer
@@ -65,6 +76,14 @@ class RemoteJob:
             except ImportError as exc:
                 raise RemoteJobConfigError(_PARAMIKO_INSTALL_HINT) from exc
             self._transfer = ParamikoSftpTransferer(config=config)
+        elif transferer_type == "globus_https_async_transferer":
+            try:
+                from rjm.transferers.globus_https_async_transferer import GlobusHttpsAsyncTransferer
+            except ImportError as exc:
+                raise RemoteJobConfigError(_ASYNC_INSTALL_HINT) from exc
+            self._transfer = GlobusHttpsAsyncTransferer(config=config)
+        elif transferer_type == "globus_transfer_task_transferer":
+            self._transfer = GlobusTransferTaskTransferer(config=config)
         else:
             self._transfer = globus_https_transferer.GlobusHttpsTransferer(config=config)
 
@@ -153,7 +172,7 @@ class RemoteJob:
             self._download_files = []
             self._log(logging.WARNING, f"Downloads file does not exist: {download_file_path}")
 
-    def setup(self, local_dir, force=False, runner=None, transfer=None):
+    def setup(self, local_dir, force=False, runner=None, transfer=None, auth=True):
         """
         Set up the remote job (authentication, remote directory...)
 
@@ -161,6 +180,8 @@ class RemoteJob:
         :param force: ignore saved progress and start again
         :param runner: runner instance to base this job's runner off
         :param transfer: transferer instance to base this job's transferer off
+        :param auth: whether to handle Globus auth now, otherwise the caller
+            must call `do_globus_auth` before using the job
 
         """
         # the local directory this job is based on
@@ -182,7 +203,8 @@ class RemoteJob:
         self._load_state(force)
 
         # handle Globus here
-        self.do_globus_auth(runner=runner, transfer=transfer)
+        if auth:
+            self.do_globus_auth(runner=runner, transfer=transfer)
 
     def get_remote_directory(self):
         """Return the remote directory"""
@@ -325,16 +347,140 @@ class RemoteJob:
             # read in the files to be uploaded
             self._read_uploads_file()
 
-            # do the upload
-            upload_time = time.perf_counter()
-            self._transfer.upload_files(self._upload_files)
-            upload_time = time.perf_counter() - upload_time
-            self._log(logging.INFO, f"Uploaded {len(self._upload_files)} files in {upload_time:.1f} seconds")
+            try:
+                # do the upload
+                upload_time = time.perf_counter()
+                if self._plan_transfers:
+                    upload_checksums = self._upload_files_planned()
+                else:
+                    upload_checksums = self._transfer.upload_files(self._upload_files)
+                upload_time = time.perf_counter() - upload_time
+                self._log(logging.INFO, f"Uploaded {len(self._upload_files)} files in {upload_time:.1f} seconds")
+
+                # check the files arrived intact before we try to run anything
+                if self._verify_uploads:
+                    self._verify_uploaded_files(upload_checksums)
+                else:
+                    self._finish_uploads()
+            except Exception:
+                self._discard_file_parts()
+                raise
+
             self._uploaded = True
             self._save_state()
 
-    def download_files(self):
-        """Download file from remote"""
+    def _upload_files_planned(self):
+        """
+        Upload small files together in one archive and the rest individually
+        (see :class:`TransferPlanner`)
+
+        :returns: dictionary with remote file names as keys and the checksums
+            of the uploaded data as values
+
+        """
+        plan = self._transfer.plan_uploads(self._upload_files)
+        self._log(logging.INFO, f"Upload plan: {plan.summary()}")
+
+        bundled = plan[LANE_BUNDLE]
+        individual = [fn for fn in self._upload_files if fn not in bundled]
+        upload_checksums = self._transfer.upload_files(individual) if individual else {}
+        if bundled:
+            bundle_name, bundle_checksums = self._transfer.upload_bundle(bundled)
+            self._pending_bundle = (bundle_name, list(bundle_checksums))
+            upload_checksums.update(bundle_checksums)
+
+        return upload_checksums
+
+    def _verify_uploaded_files(self, upload_checksums):
+        """
+        Compare checksums calculated on the remote with those calculated while
+        uploading, re-uploading any files that do not match.
+
+        :param upload_checksums: dictionary with remote file names as keys and
+            the checksums of the uploaded data as values
+
+        """
+        local_files = {os.path.basename(fn): fn for fn in self._upload_files}
+        for attempt in range(UPLOAD_VERIFY_ATTEMPTS):
+            # files uploaded in parts or in an archive are checksummed while they are written
+            remote_checksums = self._finish_uploads()
+
+            # all other checksums for this job are calculated in a single runner call
+            remaining = [fn for fn in upload_checksums if fn not in remote_checksums]
+            if remaining:
+                remote_checksums.update(self._runner.get_checksums(self._remote_full_path, remaining))
+            mismatched = [fn for fn in upload_checksums if remote_checksums.get(fn) != upload_checksums[fn]]
+            if not mismatched:
+                self._log(logging.DEBUG, f"Verified checksums of {len(upload_checksums)} uploaded files")
+                return
+
+            self._log(logging.WARNING, f"Checksums of uploaded files do not match: {', '.join(mismatched)}")
+            if attempt < UPLOAD_VERIFY_ATTEMPTS - 1:
+                # only re-upload (and then recheck) the files that did not match
+                self._log(logging.INFO, f"Re-uploading {len(mismatched)} files")
+                upload_checksums = self._transfer.upload_files([local_files[fn] for fn in mismatched])
+
+        raise RemoteJobTransfererError(f"{self._label}Uploaded files could not be verified: {', '.join(mismatched)}")
+
+    def _discard_file_parts(self):
+        """Remove any parts of files that were left on the remote by a failed upload"""
+        file_parts = self._transfer.pop_file_parts()
+        if file_parts:
+            self._log(logging.INFO, f"Removing parts of {len(file_parts)} files after failed upload")
+            try:
+                self._runner.join_file_parts(self._remote_full_path, {}, discard=file_parts)
+            except Exception as exc:
+                self._log(logging.WARNING, f"Could not remove parts of uploaded files: {exc}")
+
+    def _finish_uploads(self):
+        """
+        Join any files that the transferer uploaded in parts on the remote and
+        unpack the archive of small files, if one was uploaded.
+
+        :returns: dictionary with the names of the joined and unpacked files as
+            keys and their checksums as values
+
+        """
+        remote_checksums = {}
+
+        file_parts = self._transfer.pop_file_parts()
+        if file_parts:
+            self._log(logging.INFO, f"Joining {len(file_parts)} files that were uploaded in parts")
+            remote_checksums.update(self._runner.join_file_parts(self._remote_full_path, file_parts))
+
+        if self._pending_bundle is not None:
+            bundle_name, files = self._pending_bundle
+            self._log(logging.INFO, f"Unpacking {len(files)} files that were uploaded together")
+            remote_checksums.update(self._runner.unpack_bundle(self._remote_full_path, bundle_name, files))
+            self._pending_bundle = None
+
+        return remote_checksums
+
+    def get_upload_files(self):
+        """Return the list of files to be uploaded"""
+        self._read_uploads_file()
+
+        return self._upload_files
+
+    def get_download_files(self):
+        """Return the list of files to be downloaded"""
+        self._read_downloads_file()
+
+        return self._download_files
+
+    def bundles_downloads(self):
+        """Return whether downloads are bundled into an archive on the remote"""
+        return self._compress_downloads
+
+    def download_files(self, manifest=None):
+        """
+        Download file from remote
+
+        :param manifest: optional, dictionary with the size and checksum of each
+            file to be downloaded (see `get_manifests` on the runners), if it was
+            gathered already, otherwise the checksums are calculated here
+
+        """
         if self._downloaded:
             self._log(logging.INFO, "Already downloaded files")
         elif self._cancelled:
@@ -347,24 +493,104 @@ class RemoteJob:
             # read in files to be downloaded
             self._read_downloads_file()
 
-            # get checksums
+            if self._compress_downloads:
+                self._download_files_bundled()
+            elif self._plan_transfers:
+                self._download_files_planned(manifest=manifest)
+            else:
+                self._download_files_individually(manifest=manifest)
+
+            self._downloaded = True
+            self._save_state()
+
+    def _download_files_individually(self, manifest=None):
+        """Download each file separately, verifying checksums calculated on the remote"""
+        # get checksums
+        if manifest is None:
             downloads_checksums = self._runner.get_checksums(
                 self._remote_full_path,
                 self._download_files,
             )
-            no_checksum = [f for f in downloads_checksums if downloads_checksums[f] is None]
-            if len(no_checksum):
-                self._log(logging.ERROR,
-                          f"Could not calculate checksums for the following files, their downloads will not be verified: {', '.join(no_checksum)}")
-
-            # do the download
-            self._log(logging.INFO, "Downloading files...")
-            download_time = time.perf_counter()
-            self._transfer.download_files(self._download_files, downloads_checksums)
-            download_time = time.perf_counter() - download_time
-            self._log(logging.INFO, f"Downloaded {len(self._download_files)} files in {download_time:.1f} seconds")
-            self._downloaded = True
-            self._save_state()
+            remote_files = None
+        else:
+            self._log(logging.DEBUG, "Using checksums from manifest")
+            downloads_checksums = {fn: None if manifest.get(fn) is None else manifest[fn]["checksum"] for fn in self._download_files}
+            remote_files = {fn: manifest[fn] for fn in self._download_files if manifest.get(fn) is not None}
+        no_checksum = [f for f in downloads_checksums if downloads_checksums[f] is None]
+        if len(no_checksum):
+            self._log(logging.ERROR,
+                      f"Could not calculate checksums for the following files, their downloads will not be verified: {', '.join(no_checksum)}")
+
+        # do the download
+        self._log(logging.INFO, "Downloading files...")
+        download_time = time.perf_counter()
+        self._transfer.download_files(self._download_files, downloads_checksums, remote_files=remote_files)
+        download_time = time.perf_counter() - download_time
+        self._log(logging.INFO, f"Downloaded {len(self._download_files)} files in {download_time:.1f} seconds")
+
+    def _download_files_planned(self, manifest=None):
+        """
+        Write the files that were returned with the manifest, download other
+        small files in one archive and the rest individually (see
+        :class:`TransferPlanner`)
+
+        """
+        if manifest is None:
+            manifest = self._runner.get_manifests({self._remote_full_path: self._download_files})[self._remote_full_path]
+        remote_files = {fn: manifest[fn] for fn in self._download_files if manifest.get(fn) is not None}
+
+        plan = self._transfer.plan_downloads(remote_files)
+        self._log(logging.INFO, f"Download plan: {plan.summary()}")
+        download_time = time.perf_counter()
+
+        # carry on with the other lanes if one fails, so as much as possible is downloaded
+        errors = []
+        inline_files = plan[LANE_INLINE]
+        bundled = plan[LANE_BUNDLE]
+        if inline_files:
+            try:
+                self._transfer.write_inline_files({fn: remote_files[fn] for fn in inline_files})
+            except RemoteJobTransfererError as exc:
+                errors.append(exc)
+        if bundled:
+            try:
+                bundle_name, bundle_checksum, bundle_checksums = self._runner.bundle_files(self._remote_full_path, bundled)
+                self._transfer.download_bundle(bundle_name, bundle_checksum, bundle_checksums)
+            except RemoteJobTransfererError as exc:
+                errors.append(exc)
+
+        # missing files are passed on too, so the transferer reports them
+        individual = [fn for fn in self._download_files if fn not in inline_files and fn not in bundled]
+        if individual:
+            try:
+                self._transfer.download_files(
+                    individual,
+                    {fn: None if manifest.get(fn) is None else manifest[fn]["checksum"] for fn in individual},
+                    remote_files=remote_files,
+                )
+            except RemoteJobTransfererError as exc:
+                errors.append(exc)
+
+        if errors:
+            raise RemoteJobTransfererError(f"{self._label}Failed to download files: {'; '.join(str(e) for e in errors)}")
+
+        download_time = time.perf_counter() - download_time
+        self._log(logging.INFO, f"Downloaded {len(self._download_files)} files in {download_time:.1f} seconds")
+
+    def _download_files_bundled(self):
+        """Pack the files into a compressed archive on the remote and download that instead"""
+        # create the archive and manifest of checksums
+        bundle_name, bundle_checksum, downloads_checksums = self._runner.bundle_files(
+            self._remote_full_path,
+            self._download_files,
+        )
+
+        # download the archive and extract the files from it
+        self._log(logging.INFO, "Downloading files (compressed)...")
+        download_time = time.perf_counter()
+        self._transfer.download_bundle(bundle_name, bundle_checksum, downloads_checksums)
+        download_time = time.perf_counter() - download_time
+        self._log(logging.INFO, f"Downloaded {len(self._download_files)} files in {download_time:.1f} seconds")
 
     def run_start(self):
         """Start running the processing"""
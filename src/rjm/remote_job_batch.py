@@ -12,13 +12,18 @@ from rjm.errors import RemoteJobBatchError, RemoteJobConfigError
 from rjm.remote_job import RemoteJob
 from rjm.runners.globus_compute_slurm_runner import GlobusComputeSlurmRunner
 from rjm.transferers.globus_https_transferer import GlobusHttpsTransferer
+from rjm.transferers.globus_transfer_task_transferer import GlobusTransferTaskTransferer
 from rjm import config as config_helper
 
 
 _PARAMIKO_INSTALL_HINT = (
     "paramiko is not installed; reinstall with 'pip install RemoteJobManager[ssh]'"
 )
+_ASYNC_INSTALL_HINT = (
+    "httpx is not installed; reinstall with 'pip install RemoteJobManager[async]'"
+)
 
+START_WORKERS = 8  # jobs started at once, so their remote calls are in flight together
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +58,14 @@ class RemoteJobBatch:
             except ImportError as exc:
                 raise RemoteJobConfigError(_PARAMIKO_INSTALL_HINT) from exc
             self._transfer = ParamikoSftpTransferer(config=config)
+        elif transferer_type == "globus_https_async_transferer":
+            try:
+                from rjm.transferers.globus_https_async_transferer import GlobusHttpsAsyncTransferer
+            except ImportError as exc:
+                raise RemoteJobConfigError(_ASYNC_INSTALL_HINT) from exc
+            self._transfer = GlobusHttpsAsyncTransferer(config=config)
+        elif transferer_type == "globus_transfer_task_transferer":
+            self._transfer = GlobusTransferTaskTransferer(config=config)
         else:
             self._transfer = GlobusHttpsTransferer(config=config)
 
@@ -61,7 +74,30 @@ class RemoteJobBatch:
         # timestamp to use when creating remote directories
         self._timestamp = datetime.now().strftime("%Y%m%dT%H%M%S")
 
-        # Globus auth
+        # the auth may prompt the user, so it is done first, on this thread
+        globus_cli = self._globus_auth()
+
+        # the runner and transferer setup run in the background while the jobs are loaded
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as background:
+            setup_future = background.submit(self._setup_components, globus_cli)
+
+            # read the list of local directories and create RemoteJobs
+            local_dirs = self._read_jobs_file(remote_jobs_file)
+            logger.info(f"Loaded {len(local_dirs)} local directories from {remote_jobs_file}")
+            self._remote_jobs = []
+            for local_dir in local_dirs:
+                rj = RemoteJob(timestamp=self._timestamp)
+                self._remote_jobs.append(rj)
+                rj.setup(local_dir, force=force, runner=self._runner, transfer=self._transfer, auth=False)
+
+            setup_future.result()
+
+        # the jobs share the batch runner's and transferer's auth
+        for rj in self._remote_jobs:
+            rj.do_globus_auth(runner=self._runner, transfer=self._transfer)
+
+    def _globus_auth(self):
+        """Handle Globus auth for the scopes the runner and transferer require"""
         scopes = self._runner.get_globus_scopes()
         scopes.extend(self._transfer.get_globus_scopes())
         if len(scopes):
@@ -69,17 +105,15 @@ class RemoteJobBatch:
         else:
             globus_cli = None
 
+        return globus_cli
+
+    def _setup_components(self, globus_cli):
+        """Set up the runner and transferer, then warm up the runner"""
         self._runner.setup(globus_cli)
         self._transfer.setup(globus_cli)
 
-        # read the list of local directories and create RemoteJobs
-        local_dirs = self._read_jobs_file(remote_jobs_file)
-        logger.info(f"Loaded {len(local_dirs)} local directories from {remote_jobs_file}")
-        self._remote_jobs = []
-        for local_dir in local_dirs:
-            rj = RemoteJob(timestamp=self._timestamp)
-            self._remote_jobs.append(rj)
-            rj.setup(local_dir, force=force, runner=self._runner, transfer=self._transfer)
+        # so the first remote call does not have to wait, e.g. for an endpoint to start a worker
+        self._runner.warm_up()
 
     def make_directories(self):
         """Make directories for the remote jobs"""
@@ -132,18 +166,19 @@ class RemoteJobBatch:
 
         # executor for processing uploads
         future_to_rj = {}
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as uploader:  # separate thread for uploading
+        # transferers that move files in bulk start the uploads for all jobs at once
+        self._batch_upload(unuploaded_jobs)
+
+        start_futures = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as uploader, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=START_WORKERS) as starter:
             # upload files
             for rj in unuploaded_jobs:
                 future_to_rj[uploader.submit(rj.upload_files)] = rj
 
             # start jobs that were already uploaded but not started
             for rj in unstarted_jobs:
-                try:
-                    rj.run_start()
-                except Exception as exc:
-                    errors.append(repr(exc))
-                    logger.error(repr(exc))
+                start_futures.append(starter.submit(rj.run_start))
 
             # start jobs as their uploads complete
             if len(future_to_rj):
@@ -157,12 +192,16 @@ class RemoteJobBatch:
                         logger.error(repr(exc))
                     else:
                         # upload succeeded, now start the job
-                        try:
-                            logger.debug(f"Starting run for {rj}")
-                            rj.run_start()
-                        except Exception as exc:
-                            errors.append(repr(exc))
-                            logger.error(repr(exc))
+                        logger.debug(f"Starting run for {rj}")
+                        start_futures.append(starter.submit(rj.run_start))
+
+            # wait for the jobs to start
+            for future in start_futures:
+                try:
+                    future.result()
+                except Exception as exc:
+                    errors.append(repr(exc))
+                    logger.error(repr(exc))
 
         # handle errors
         logger.debug(f"{len(errors)} errors to report")
@@ -235,8 +274,10 @@ class RemoteJobBatch:
         future_to_rj = {}
         with concurrent.futures.ThreadPoolExecutor(max_workers=16) as downloader:  # separate thread for downloading
             # first download jobs that have finished but not downloaded already
+            manifests = self._get_manifests(undownloaded_jobs)
+            self._batch_download(undownloaded_jobs, manifests)
             for rj in undownloaded_jobs:
-                future_to_rj[downloader.submit(rj.download_files)] = rj
+                future_to_rj[downloader.submit(rj.download_files, manifest=manifests.get(rj))] = rj
 
             # loop until jobs have finished
             logger.info(f"Waiting for {len(unfinished_jobs)} Slurm jobs to finish")
@@ -252,24 +293,28 @@ class RemoteJobBatch:
                 count_failed += len(failed_jobs)
                 logger.info(f"{count_succeeded} succeeded; {count_failed} failed; {len(unfinished_jobs)} unfinished")
 
+                # one manifest for all the jobs that finished in this round
+                manifests = self._get_manifests(successful_jobs + failed_jobs)
+                self._batch_download(successful_jobs + failed_jobs, manifests)
+
                 # handle successful jobs
                 for rj in successful_jobs:
                     logger.info(f"{rj} run has finished successfully")
                     rj.set_run_completed()
-                    future_to_rj[downloader.submit(rj.download_files)] = rj
+                    future_to_rj[downloader.submit(rj.download_files, manifest=manifests.get(rj))] = rj
 
                 # handle unsuccessful jobs
                 for rj in failed_jobs:
                     logger.error(f"{rj} run has finished unsuccessfully")
                     rj.set_run_completed(success=False)
                     errors[repr(rj)].append("Run has finished unsuccessfully")
-                    future_to_rj[downloader.submit(rj.download_files)] = rj
+                    future_to_rj[downloader.submit(rj.download_files, manifest=manifests.get(rj))] = rj
 
                 # wait before checking for finished jobs again
                 if len(unfinished_jobs):
                     wait_time = _calc_wait_time(polling_interval, warmup_polling_interval, warmup_duration, wait_start_time)
                     logger.debug(f"Waiting for {wait_time} seconds before checking unfinished jobs: {unfinished_jobs}")
-                    time.sleep(wait_time)
+                    self._runner.wait_for_completion(unfinished_jobs, wait_time)
 
             # wait for downloads to complete
             if len(future_to_rj):
@@ -306,6 +351,82 @@ class RemoteJobBatch:
         if len(errors):
             raise RemoteJobBatchError(errors)
 
+    def _get_manifests(self, remote_jobs):
+        """
+        Gather the manifests (sizes and checksums of files to download) for
+        the given jobs in a single runner call, if the runner supports it
+        (otherwise each job calculates its own checksums in its download
+        thread).
+
+        :param remote_jobs: list of RemoteJobs that have finished running
+
+        :returns: dictionary with RemoteJobs as keys and manifests as values;
+            jobs without a manifest will calculate their own checksums
+
+        """
+        if not self._runner.BATCH_MANIFESTS:
+            return {}
+
+        # jobs that bundle their downloads get the manifest when creating the bundle
+        jobs_files = {}
+        for rj in remote_jobs:
+            if not rj.files_downloaded() and not rj.bundles_downloads():
+                jobs_files[rj] = rj.get_download_files()
+        if not len(jobs_files):
+            return {}
+
+        try:
+            manifests = self._runner.get_manifests({rj.get_remote_directory(): files for rj, files in jobs_files.items()})
+        except Exception as exc:
+            logger.warning(f"Failed to gather manifests for {len(jobs_files)} jobs, each job will calculate its own checksums: {exc!r}")
+            return {}
+        logger.debug(f"Gathered manifests for {len(jobs_files)} jobs")
+
+        return {rj: manifests.get(rj.get_remote_directory()) for rj in jobs_files}
+
+    def _batch_upload(self, remote_jobs):
+        """
+        If the transferer supports it, start the uploads for all the given
+        jobs at once; each job then waits for its own files.
+
+        """
+        if not self._transfer.BATCH_TRANSFERS or not len(remote_jobs):
+            return
+
+        try:
+            self._transfer.batch_upload([(rj.get_transferer(), rj.get_upload_files()) for rj in remote_jobs])
+        except Exception as exc:
+            logger.warning(f"Failed to start batch upload for {len(remote_jobs)} jobs, each job will upload its own files: {exc!r}")
+
+    def _batch_download(self, remote_jobs, manifests):
+        """
+        If the transferer supports it, start the downloads for all the given
+        jobs at once; each job then waits for its own files.
+
+        """
+        if not self._transfer.BATCH_TRANSFERS:
+            return
+
+        job_downloads = []
+        for rj in remote_jobs:
+            if not rj.files_downloaded() and not rj.bundles_downloads():
+                files = rj.get_download_files()
+                manifest = manifests.get(rj)
+                if manifest is not None:
+                    files = [fn for fn in files if manifest.get(fn) is not None]
+                job_downloads.append((rj.get_transferer(), files))
+        if not len(job_downloads):
+            return
+
+        try:
+            self._transfer.batch_download(job_downloads)
+        except Exception as exc:
+            logger.warning(f"Failed to start batch download for {len(job_downloads)} jobs, each job will download its own files: {exc!r}")
+
+    def close(self):
+        """Release the connections and threads held by the transferer"""
+        self._transfer.close()
+
     def write_stderr_for_unfinshed_jobs(self, msg):
         """
         Write stderr files for WFN compatibility for jobs that have not finished
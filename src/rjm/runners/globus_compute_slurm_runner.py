@@ -1,28 +1,43 @@
 
 import os
+import json
 import time
+import hashlib
+import inspect
 import logging
+import threading
 
+import globus_compute_sdk
 from globus_compute_sdk import Client
 from globus_compute_sdk import Executor
 from globus_compute_sdk.sdk.login_manager.manager import LoginManager
 from globus_compute_sdk.serialize import CombinedCode
 from retry.api import retry_call
 
-from rjm.runners.runner_base import RunnerBase
+from rjm.runners.runner_base import RunnerBase, DOWNLOAD_BUNDLE_NAME
 from rjm.errors import RemoteJobRunnerError
 
 
 GLOBUS_COMPUTE_TIMEOUT = 120  # default timeout for waiting for functions
+CHECKSUM_TIME_LIMIT = GLOBUS_COMPUTE_TIMEOUT // 2  # stop starting new checksums after this long and return partial results
 SLURM_UNFINISHED_STATUS = ['RUNNING', 'PENDING', 'NODE_FAIL', 'COMPLETING']
 SLURM_WARN_STATUS = ["NODE_FAIL"]
 SLURM_SUCCESSFUL_STATUS = ['COMPLETED']
+MANIFEST_DIRECTORIES_PER_CALL = 16  # directories per function call when gathering manifests
 MIN_POLLING_INTERVAL = 60
 MIN_WARMUP_POLLING_INTERVAL = 10
 MAX_WARMUP_DURATION = 300
+FUNCTION_CACHE_LOCATION = os.path.join(  # ids of the remote functions registered with Globus Compute
+    os.path.expanduser("~"),
+    ".rjm",
+    "globus_compute_functions.json"
+)
 
 logger = logging.getLogger(__name__)
 
+# serialises resets of the executor, which runners in a batch share and may reset from several threads
+_reset_lock = threading.RLock()
+
 
 class GlobusComputeSlurmRunner(RunnerBase):
     """
@@ -31,7 +46,13 @@ class GlobusComputeSlurmRunner(RunnerBase):
 
     The default Globus Compute endpoint running on the login node is sufficient.
 
+    The remote functions are registered with Globus Compute the first time
+    they are used and their ids are cached in ``~/.rjm``, so later calls (and
+    later runs of RJM) only send the function id and arguments.
+
     """
+    BATCH_MANIFESTS = True
+
     def __init__(self, config=None):
         super(GlobusComputeSlurmRunner, self).__init__(config=config)
 
@@ -56,6 +77,10 @@ class GlobusComputeSlurmRunner(RunnerBase):
         self._warmup_poll_interval = self._config.getint("POLLING", "warmup_poll_interval")
         self._warmup_duration = self._config.getint("POLLING", "warmup_duration")
 
+        # submit remote functions by id, registering them once
+        self._register_functions = self._config.getboolean("GLOBUS_COMPUTE", "register_functions", fallback=True)
+        self._registered_functions = registered_functions
+
         # Slurm job id
         self._jobid = None
 
@@ -138,17 +163,32 @@ class GlobusComputeSlurmRunner(RunnerBase):
 
         return executor
 
-    def reset_globus_compute_client(self, propagate=False):
+    def reset_globus_compute_client(self, propagate=False, stale_executor=None):
         """
         Force the runner to create a new Globus Compute client.
 
         If propagate is True and an external runner is being used, then call
         reset on the external runner too.
 
+        If `stale_executor` is given, the reset is skipped if that executor
+        has already been replaced (e.g. by another thread that saw the same
+        failure).
+
         """
         if not self._setup_done:
             raise RuntimeError("setup_globus_auth must be called before reset_globus_compute_client")
 
+        with _reset_lock:
+            if stale_executor is not None and self.get_executor() is not stale_executor:
+                self._log(logging.DEBUG, "Globus Compute executor has already been replaced")
+                self._client = self.get_client()
+                self._executor = self.get_executor()
+                return
+
+            self._reset_globus_compute_client(propagate, stale_executor)
+
+    def _reset_globus_compute_client(self, propagate, stale_executor):
+        """Create a new Globus Compute client, with the reset lock held"""
         if self._external_runner is None:
             if self._executor is not None:
                 self._log(logging.DEBUG, f"Shutting down old Globus Compute executor ({self._executor})")
@@ -166,7 +206,7 @@ class GlobusComputeSlurmRunner(RunnerBase):
             # if required, force the external runner to reset too
             if propagate:
                 self._log(logging.DEBUG, "Resetting Globus Compute client on passed in runner")
-                self._external_runner.reset_globus_compute_client(propagate=True)
+                self._external_runner.reset_globus_compute_client(propagate=True, stale_executor=stale_executor)
 
             # update references
             self._client = self._external_runner.get_client()
@@ -190,28 +230,51 @@ class GlobusComputeSlurmRunner(RunnerBase):
 
         return executor
 
-    def run_function(self, function, *args, **kwargs):
-        """Run the given function and pass back the return value"""
+    def submit_function(self, function, *args, **kwargs):
+        """
+        Submit the given function to the executor without waiting for it.
+
+        :returns: future for the return value of the function
+
+        """
         if self._external_runner is not None:
             # update reference to executor
             self._executor = self._external_runner.get_executor()
 
-        if self._executor is None:
+        # other threads may replace the executor, so keep using the one we started with
+        executor = self._executor
+        if executor is None:
             self._log(logging.ERROR, "Make sure you setup_globus_auth before trying to run something")
             raise RuntimeError("Make sure you setup_globus_auth before trying to run something")
 
         # see if we can detect in advance that the executor has been shutdown
         # somehow and start a new one before running the function
         # note: this is likely to break with upstream changes
-        if hasattr(self._executor, "_stopped"):
-            if self._executor._stopped:
+        if hasattr(executor, "_stopped"):
+            if executor._stopped:
                 self._log(logging.WARNING, "Globus Compute Executor detected as stopped - attempting to start a new one before running the function")
-                self.reset_globus_compute_client(propagate=True)
+                self.reset_globus_compute_client(propagate=True, stale_executor=executor)
+                executor = self._executor
+
+        # look up the id of the function, registering it if required
+        function_key = None
+        if self._register_functions:
+            try:
+                registered = self._registered_functions.get(self.get_client(), self._endpoint, function)
+            except Exception as exc:
+                self._log(logging.WARNING, f"Could not register function {function}, submitting it with its code: {exc}")
+            else:
+                if registered is not None:
+                    function_key, function_id = registered
 
         # start the function
-        self._log(logging.DEBUG, f"Submitting function to Globus Compute executor ({self._executor}): {function}")
+        self._log(logging.DEBUG, f"Submitting function to Globus Compute executor ({executor}): {function}")
         try:
-            future = self._executor.submit(function, *args, **kwargs)
+            if function_key is None:
+                future = executor.submit(function, *args, **kwargs)
+            else:
+                future = executor.submit_to_registered_function(function_id, args=args, kwargs=kwargs)
+                future.add_done_callback(lambda f: self._registered_functions.check_result(function_key, f))
         except RuntimeError as exc:
             # we are trying to catch the case where the executor has been shutdown somehow
             # in which we case we want to start a new executor and then reraise the error
@@ -219,18 +282,82 @@ class GlobusComputeSlurmRunner(RunnerBase):
             self._log(logging.WARNING, f"Failed to submit function to executor: {str(exc)}")
             if "is shutdown" in str(exc):
                 self._log(logging.WARNING, "Function submission failed due to executor being shutdown - attempting to start a new executor")
-                self.reset_globus_compute_client(propagate=True)
+                self.reset_globus_compute_client(propagate=True, stale_executor=executor)
 
             # always reraise at this point (run_function may be wrapped in a retry, let that
             # handle the retry in case we get into a loop of failures for some reason)
             raise exc
 
+        return future
+
+    def run_function(self, function, *args, **kwargs):
+        """Run the given function and pass back the return value"""
+        future = self.submit_function(function, *args, **kwargs)
+
         # wait for it to complete and get the result
         self._log(logging.DEBUG, "Waiting for Globus Compute function to complete")
         result = future.result(timeout=GLOBUS_COMPUTE_TIMEOUT)
 
         return result
 
+    def run_functions(self, calls, return_exceptions=False):
+        """
+        Submit several independent functions to the executor at once, so they
+        are sent together and can run concurrently on the endpoint, then
+        gather their return values.
+
+        :param calls: list of tuples of function, args and kwargs
+        :param return_exceptions: if True, an exception raised while
+            submitting or running a function is returned in place of its
+            return value, instead of being raised
+
+        :returns: list of the return values, in the same order as `calls`
+
+        """
+        futures = []
+        for function, args, kwargs in calls:
+            try:
+                futures.append(self.submit_function(function, *args, **kwargs))
+            except Exception as exc:
+                if not return_exceptions:
+                    raise
+                futures.append(exc)
+
+        self._log(logging.DEBUG, f"Waiting for {len(futures)} Globus Compute functions to complete")
+        # one timeout for the whole group, as they run concurrently
+        deadline = time.monotonic() + GLOBUS_COMPUTE_TIMEOUT
+        results = []
+        for future in futures:
+            if isinstance(future, Exception):
+                results.append(future)
+                continue
+            try:
+                results.append(future.result(timeout=max(0, deadline - time.monotonic())))
+            except Exception as exc:
+                if not return_exceptions:
+                    raise
+                results.append(exc)
+
+        return results
+
+    def warm_up(self):
+        """
+        Submit a function that does nothing, without waiting for it, so the
+        endpoint starts a worker while the jobs are being prepared locally.
+        The functions used by a batch are registered at the same time.
+
+        """
+        try:
+            if self._register_functions:
+                for function in (_make_remote_directories, submit_slurm_job, _check_slurm_job_statuses, _calculate_manifests):
+                    self._registered_functions.get(self.get_client(), self._endpoint, function)
+            future = self.submit_function(_warm_up)
+        except Exception as exc:
+            self._log(logging.DEBUG, f"Warming up the Globus Compute endpoint failed: {exc}")
+        else:
+            self._log(logging.DEBUG, "Submitted function to warm up the Globus Compute endpoint")
+            future.add_done_callback(lambda f: self._log(logging.DEBUG, "Globus Compute endpoint has warmed up"))
+
     def make_remote_directory(self, remote_base_path, prefix, retries=True):
         """
         Make one or more remote directories, using the given prefix(es).
@@ -488,34 +615,274 @@ class GlobusComputeSlurmRunner(RunnerBase):
         :returns: dictionary with file names as keys and checksums as values
 
         """
-        # remote function call with retries
-        self._log(logging.DEBUG, f"Calculating checksums for {len(files)} files")
-        checksums = retry_call(
-            self._get_checksums_wrapper,
+        self._log(logging.DEBUG, f"Calculating {self._checksum_algorithm} checksums for {len(files)} files")
+
+        # the remote function returns partial results if it runs out of time,
+        # so keep calling it for the remaining files (progress is kept between calls)
+        checksums = {}
+        remaining = list(files)
+        while len(remaining):
+            # remote function call with retries
+            partial_checksums = retry_call(
+                self._get_checksums_wrapper,
+                fargs=(remaining, working_directory),
+                tries=self._retry_tries,
+                backoff=self._retry_backoff,
+                delay=self._retry_delay,
+                max_delay=self._retry_max_delay,
+            )
+            checksums.update(partial_checksums)
+            num_remaining = len(remaining)
+            remaining = [fn for fn in remaining if fn not in partial_checksums]
+            if len(remaining) == num_remaining:
+                # calling again would not get any further, e.g. a file can't be read
+                self._log(logging.WARNING, f"No progress calculating checksums, giving up on {len(remaining)} files: {', '.join(remaining)}")
+                checksums.update({fn: None for fn in remaining})
+                break
+            if len(remaining):
+                self._log(logging.DEBUG, f"Calculated checksums for {len(checksums)} of {len(files)} files so far, continuing")
+
+        self._log(logging.DEBUG, f"Calculated checksums for {len([c for c in checksums.values() if c is not None])} of {len(files)} files")
+
+        return checksums
+
+    def _get_checksums_wrapper(self, files, working_directory):
+        """
+        Wrapper function that raises exception if returncode is nonzero.
+
+        """
+        returncode, checksums = self.run_function(_calculate_checksums, files, working_directory,
+                                                  algorithm=self._checksum_algorithm, time_limit=CHECKSUM_TIME_LIMIT)
+
+        if returncode != 0:
+            msg = f"Calculating checksums failed ({returncode}): {checksums}"
+            self._log(logging.ERROR, msg)
+            raise RemoteJobRunnerError(msg)
+
+        return checksums
+
+    def get_manifests(self, jobs_files):
+        """
+        Return manifests (size and checksum of each file) for the download
+        files of one or more jobs, using a single remote function call.
+
+        :param jobs_files: dictionary with remote working directories as keys
+            and lists of files (relative to the working directory) as values
+
+        :returns: dictionary with the working directories as keys and
+            dictionaries as values that map each file name to a dictionary
+            with "size" and "checksum" keys, or None if the file does not exist.
+            Small files also have their base64 encoded contents under "content"
+            if ``inline_max_kb`` is enabled.
+
+        """
+        num_files = sum(len(files) for files in jobs_files.values())
+        self._log(logging.DEBUG, f"Gathering manifests for {num_files} files in {len(jobs_files)} directories")
+
+        # keep calling the remote function until it has reached every file (see get_checksums)
+        manifests = {working_directory: {} for working_directory in jobs_files}
+        remaining = {working_directory: list(files) for working_directory, files in jobs_files.items() if len(files)}
+        while len(remaining):
+            for partial_manifests in self._get_manifests_fan_out(remaining):
+                for working_directory, manifest in partial_manifests.items():
+                    manifests[working_directory].update(manifest)
+            num_remaining = sum(len(files) for files in remaining.values())
+            remaining = {
+                working_directory: [fn for fn in files if fn not in manifests[working_directory]]
+                for working_directory, files in remaining.items()
+            }
+            remaining = {working_directory: files for working_directory, files in remaining.items() if len(files)}
+            if sum(len(files) for files in remaining.values()) == num_remaining:
+                # calling again would not get any further, so the files are treated as missing
+                self._log(logging.WARNING, f"No progress gathering manifests, giving up on {num_remaining} files in {len(remaining)} directories")
+                for working_directory, files in remaining.items():
+                    manifests[working_directory].update({fn: None for fn in files})
+                break
+            if len(remaining):
+                self._log(logging.DEBUG, f"Manifests incomplete for {len(remaining)} directories, continuing")
+
+        return manifests
+
+    def _get_manifests_fan_out(self, jobs_files):
+        """
+        Return partial manifests for the given files, splitting the
+        directories between several remote function calls that are submitted
+        at once. Calls that fail are run again individually, with retries.
+
+        """
+        working_directories = list(jobs_files)
+        groups = [
+            {working_directory: jobs_files[working_directory] for working_directory in working_directories[i:i + MANIFEST_DIRECTORIES_PER_CALL]}
+            for i in range(0, len(working_directories), MANIFEST_DIRECTORIES_PER_CALL)
+        ]
+        if len(groups) == 1:
+            results = [None]
+        else:
+            self._log(logging.DEBUG, f"Gathering manifests with {len(groups)} concurrent function calls")
+            results = self.run_functions([
+                (_calculate_manifests, (group,), {"algorithm": self._checksum_algorithm, "time_limit": CHECKSUM_TIME_LIMIT,
+                                                  "inline_max_size": self._inline_max_size})
+                for group in groups
+            ], return_exceptions=True)
+
+        partial_manifests = []
+        for group, result in zip(groups, results):
+            if isinstance(result, tuple) and result[0] == 0:
+                partial_manifests.append(result[1])
+            else:
+                if result is not None:
+                    self._log(logging.WARNING, f"Gathering manifests failed, trying again: {result}")
+                partial_manifests.append(retry_call(
+                    self._get_manifests_wrapper,
+                    fargs=(group,),
+                    tries=self._retry_tries,
+                    backoff=self._retry_backoff,
+                    delay=self._retry_delay,
+                    max_delay=self._retry_max_delay,
+                ))
+
+        return partial_manifests
+
+    def _get_manifests_wrapper(self, jobs_files):
+        """
+        Wrapper function that raises exception if returncode is nonzero.
+
+        """
+        returncode, manifests = self.run_function(_calculate_manifests, jobs_files,
+                                                  algorithm=self._checksum_algorithm, time_limit=CHECKSUM_TIME_LIMIT,
+                                                  inline_max_size=self._inline_max_size)
+
+        if returncode != 0:
+            msg = f"Gathering manifests failed ({returncode}): {manifests}"
+            self._log(logging.ERROR, msg)
+            raise RemoteJobRunnerError(msg)
+
+        return manifests
+
+    def bundle_files(self, working_directory, files):
+        """
+        Pack the given files into a single compressed archive on the remote
+
+        :param working_directory: directory containing the files
+        :param files: list of files, relative to `working_directory`, to
+            add to the archive
+
+        :returns: tuple containing the name of the archive (relative to
+            `working_directory`), the checksum of the archive and a manifest
+            dictionary with file names as keys and checksums as values (files
+            that do not exist on the remote have a value of None)
+
+        """
+        self._log(logging.DEBUG, f"Bundling {len(files)} files into: {DOWNLOAD_BUNDLE_NAME}")
+        archive_checksum, checksums = retry_call(
+            self._bundle_files_wrapper,
             fargs=(files, working_directory),
             tries=self._retry_tries,
             backoff=self._retry_backoff,
             delay=self._retry_delay,
             max_delay=self._retry_max_delay,
         )
-        self._log(logging.DEBUG, f"Calculated checksums for {len([c for c in checksums if c is not None])} of {len(files)} files")
+        self._log(logging.DEBUG, f"Bundled {len([c for c in checksums.values() if c is not None])} of {len(files)} files")
 
-        return checksums
+        return DOWNLOAD_BUNDLE_NAME, archive_checksum, checksums
 
-    def _get_checksums_wrapper(self, files, working_directory):
+    def _bundle_files_wrapper(self, files, working_directory):
         """
         Wrapper function that raises exception if returncode is nonzero.
 
         """
-        returncode, checksums = self.run_function(_calculate_checksums, files, working_directory)
+        returncode, result = self.run_function(_bundle_files, files, working_directory, DOWNLOAD_BUNDLE_NAME,
+                                               algorithm=self._checksum_algorithm)
 
         if returncode != 0:
-            msg = f"Calculating checksums failed ({returncode}): {checksums}"
+            msg = f"Bundling files failed ({returncode}): {result}"
             self._log(logging.ERROR, msg)
             raise RemoteJobRunnerError(msg)
 
+        return result
+
+    def join_file_parts(self, working_directory, file_parts, discard=None):
+        """
+        Join files that were uploaded in parts, calculating the checksums of
+        the joined files while they are written and removing the parts
+
+        :param working_directory: directory containing the parts
+        :param file_parts: dictionary with file names as keys and ordered lists
+            of the names of their parts as values
+        :param discard: optional, dictionary in the same form as `file_parts`
+            of files whose parts are removed without being joined
+
+        :returns: dictionary with file names as keys and checksums of the
+            joined files as values
+
+        """
+        self._log(logging.DEBUG, f"Joining {len(file_parts)} files that were uploaded in parts")
+        checksums = retry_call(
+            self._join_file_parts_wrapper,
+            fargs=(file_parts, working_directory, discard),
+            tries=self._retry_tries,
+            backoff=self._retry_backoff,
+            delay=self._retry_delay,
+            max_delay=self._retry_max_delay,
+        )
+
         return checksums
 
+    def unpack_bundle(self, working_directory, bundle_name, files):
+        """
+        Unpack an uploaded archive, calculating the checksums of the files
+        while they are written and removing the archive
+
+        :param working_directory: directory containing the archive
+        :param bundle_name: name of the archive, relative to `working_directory`
+        :param files: list of files expected in the archive
+
+        :returns: dictionary with file names as keys and checksums of the
+            unpacked files as values (None if the file was not in the archive)
+
+        """
+        self._log(logging.DEBUG, f"Unpacking {len(files)} files from: {bundle_name}")
+        checksums = retry_call(
+            self._unpack_bundle_wrapper,
+            fargs=(bundle_name, files, working_directory),
+            tries=self._retry_tries,
+            backoff=self._retry_backoff,
+            delay=self._retry_delay,
+            max_delay=self._retry_max_delay,
+        )
+
+        return checksums
+
+    def _unpack_bundle_wrapper(self, bundle_name, files, working_directory):
+        """
+        Wrapper function that raises exception if returncode is nonzero.
+
+        """
+        returncode, result = self.run_function(_unpack_bundle, bundle_name, files, working_directory,
+                                               algorithm=self._checksum_algorithm)
+
+        if returncode != 0:
+            msg = f"Unpacking uploaded files failed ({returncode}): {result}"
+            self._log(logging.ERROR, msg)
+            raise RemoteJobRunnerError(msg)
+
+        return result
+
+    def _join_file_parts_wrapper(self, file_parts, working_directory, discard=None):
+        """
+        Wrapper function that raises exception if returncode is nonzero.
+
+        """
+        returncode, result = self.run_function(_join_file_parts, file_parts, working_directory,
+                                               algorithm=self._checksum_algorithm, discard=discard)
+
+        if returncode != 0:
+            msg = f"Joining file parts failed ({returncode}): {result}"
+            self._log(logging.ERROR, msg)
+            raise RemoteJobRunnerError(msg)
+
+        return result
+
     def _check_slurm_jobs_wrapper(self, unfinished_jobids):
         """
         Wrapper function that raises exception if returncode is nonzero
@@ -538,33 +905,203 @@ class GlobusComputeSlurmRunner(RunnerBase):
 
 
 # function that calculates checksums for a list of files
-def _calculate_checksums(files, working_directory):
+def _calculate_checksums(files, working_directory, algorithm="sha256", time_limit=None, max_workers=8):
     # catch all errors due to problem with exceptions being wrapped in parsl class
     # and parsl may not be installed on host (particularly windows)
     try:
         import os.path
+        import time
         import hashlib
+        import concurrent.futures
+
+        start_time = time.monotonic()
+        file_chunk_size = 4 * 1024 * 1024
+
+        def new_checksum():
+            if algorithm == "xxh3":
+                import xxhash
+                return xxhash.xxh3_128()
+            return hashlib.new(algorithm)
+
+        def checksum_file(file_path):
+            # once the time limit is reached, don't start any more files
+            if time_limit is not None and time.monotonic() - start_time > time_limit:
+                return None
 
-        file_chunk_size = 8192
+            # read into a reusable buffer (hashlib releases the GIL for large updates)
+            checksum = new_checksum()
+            buf = bytearray(file_chunk_size)
+            view = memoryview(buf)
+            with open(file_path, 'rb', buffering=0) as fh:
+                while num_read := fh.readinto(buf):
+                    checksum.update(view[:num_read])
 
+            return checksum.hexdigest()
+
+        # files that do not exist have a checksum of None
         checksums = {}
+        existing_files = []
         for fn in files:
             file_path = os.path.join(working_directory, fn)
             if os.path.isfile(file_path):
-                with open(file_path, 'rb') as fh:
-                    checksum = hashlib.sha256()
-                    while chunk := fh.read(file_chunk_size):
-                        checksum.update(chunk)
-                checksums[fn] = checksum.hexdigest()
+                existing_files.append((os.path.getsize(file_path), fn, file_path))
             else:
                 checksums[fn] = None
 
+        # largest files first so they are not left until the end
+        existing_files.sort(reverse=True)
+        num_workers = max(1, min(max_workers, len(existing_files), os.cpu_count() or 1))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            future_to_fn = {executor.submit(checksum_file, file_path): fn for _, fn, file_path in existing_files}
+            for future in concurrent.futures.as_completed(future_to_fn):
+                checksum = future.result()
+                if checksum is not None:
+                    checksums[future_to_fn[future]] = checksum
+
+        # files that were not reached before the time limit are omitted
         return 0, checksums
 
     except Exception as exc:
         return 1, repr(exc)
 
 
+# function that gathers sizes and checksums of files across multiple directories
+def _calculate_manifests(jobs_files, algorithm="sha256", time_limit=None, max_workers=8, inline_max_size=0):
+    # catch all errors due to problem with exceptions being wrapped in parsl class
+    # and parsl may not be installed on host (particularly windows)
+    try:
+        import os.path
+        import time
+        import base64
+        import hashlib
+        import concurrent.futures
+
+        start_time = time.monotonic()
+        file_chunk_size = 4 * 1024 * 1024
+
+        def new_checksum():
+            if algorithm == "xxh3":
+                import xxhash
+                return xxhash.xxh3_128()
+            return hashlib.new(algorithm)
+
+        def checksum_file(file_path, size):
+            # once the time limit is reached, don't start any more files
+            if time_limit is not None and time.monotonic() - start_time > time_limit:
+                return None
+
+            # small files are returned inline, saving a separate download
+            if inline_max_size and size <= inline_max_size:
+                with open(file_path, 'rb') as fh:
+                    content = fh.read()
+                checksum = new_checksum()
+                checksum.update(content)
+                return checksum.hexdigest(), base64.b64encode(content).decode("ascii")
+
+            checksum = new_checksum()
+            buf = bytearray(file_chunk_size)
+            view = memoryview(buf)
+            with open(file_path, 'rb', buffering=0) as fh:
+                while num_read := fh.readinto(buf):
+                    checksum.update(view[:num_read])
+
+            return checksum.hexdigest(), None
+
+        # files that do not exist have a manifest entry of None
+        manifests = {}
+        existing_files = []
+        for working_directory, files in jobs_files.items():
+            manifests[working_directory] = {}
+            for fn in files:
+                file_path = os.path.join(working_directory, fn)
+                if os.path.isfile(file_path):
+                    existing_files.append((os.path.getsize(file_path), working_directory, fn, file_path))
+                else:
+                    manifests[working_directory][fn] = None
+
+        # files from all directories share one pool, largest first
+        existing_files.sort(reverse=True)
+        num_workers = max(1, min(max_workers, len(existing_files), os.cpu_count() or 1))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            future_to_file = {
+                executor.submit(checksum_file, file_path, size): (size, working_directory, fn)
+                for size, working_directory, fn, file_path in existing_files
+            }
+            for future in concurrent.futures.as_completed(future_to_file):
+                result = future.result()
+                if result is not None:
+                    size, working_directory, fn = future_to_file[future]
+                    manifests[working_directory][fn] = {"size": size, "checksum": result[0]}
+                    if result[1] is not None:
+                        manifests[working_directory][fn]["content"] = result[1]
+
+        # files that were not reached before the time limit are omitted
+        return 0, manifests
+
+    except Exception as exc:
+        return 1, repr(exc)
+
+
+# function that packs files into a compressed archive, calculating checksums as it goes
+def _bundle_files(files, working_directory, archive_name, algorithm="sha256"):
+    # catch all errors due to problem with exceptions being wrapped in parsl class
+    # and parsl may not be installed on host (particularly windows)
+    try:
+        import os.path
+        import hashlib
+        import tarfile
+
+        file_chunk_size = 4 * 1024 * 1024
+
+        def new_checksum():
+            if algorithm == "xxh3":
+                import xxhash
+                return xxhash.xxh3_128()
+            return hashlib.new(algorithm)
+
+        # file object that updates a checksum as the file is read
+        class HashingReader:
+            def __init__(self, fh):
+                self.fh = fh
+                self.checksum = new_checksum()
+
+            def read(self, size=-1):
+                chunk = self.fh.read(size)
+                self.checksum.update(chunk)
+                return chunk
+
+        # add existing files to the archive, each file is only read once
+        checksums = {}
+        archive_path = os.path.join(working_directory, archive_name)
+        with tarfile.open(archive_path, "w:gz", compresslevel=6) as tar:
+            for fn in files:
+                file_path = os.path.join(working_directory, fn)
+                if os.path.isfile(file_path):
+                    tarinfo = tar.gettarinfo(file_path, arcname=fn)
+                    with open(file_path, 'rb') as fh:
+                        reader = HashingReader(fh)
+                        tar.addfile(tarinfo, fileobj=reader)
+                    checksums[fn] = reader.checksum.hexdigest()
+                else:
+                    checksums[fn] = None
+
+        # checksum of the archive itself
+        with open(archive_path, 'rb') as fh:
+            archive_checksum = new_checksum()
+            while chunk := fh.read(file_chunk_size):
+                archive_checksum.update(chunk)
+
+        return 0, (archive_checksum.hexdigest(), checksums)
+
+    except Exception as exc:
+        return 1, repr(exc)
+
+
+# function that does nothing, for getting the endpoint ready
+def _warm_up():
+    return 0
+
+
 # function that submits a job to Slurm (assumes submit script and other required inputs were uploaded via Globus)
 def submit_slurm_job(submit_script, submit_dir=None):
     # catch all errors due to problem with exceptions being wrapped in parsl class
@@ -684,6 +1221,82 @@ def _make_remote_directories(base_path, prefixes):
     return remote_dirs
 
 
+class RegisteredFunctions:
+    """
+    Ids of the remote functions registered with Globus Compute, persisted
+    between runs of RJM.
+
+    Functions are keyed by endpoint, name, SDK version and a hash of their
+    source code, so changing a function registers it again. If a task fails
+    to run a registered function (e.g. the function was deleted) its id is
+    forgotten and it will be registered again next time.
+
+    """
+    def __init__(self, cache_file=FUNCTION_CACHE_LOCATION):
+        self._cache_file = cache_file
+        self._lock = threading.Lock()
+        self._function_ids = None  # loaded when first needed
+        self._no_source = set()  # functions whose source can't be read, e.g. in a frozen executable
+
+    def _key(self, endpoint, function):
+        code_hash = hashlib.sha256(inspect.getsource(function).encode()).hexdigest()
+
+        return f"{endpoint}:{function.__name__}:{globus_compute_sdk.__version__}:{code_hash}"
+
+    def _load(self):
+        try:
+            with open(self._cache_file) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+        tmp_file = self._cache_file + ".tmp"
+        with open(tmp_file, "w") as fh:
+            json.dump(self._function_ids, fh, indent=2)
+        os.replace(tmp_file, self._cache_file)
+
+    def get(self, client, endpoint, function):
+        """
+        Return the key and id of the function, registering it with the
+        client if it has not been registered before, or None if the function
+        can't be registered because its source is not available (it should
+        be submitted with its code instead)
+
+        """
+        if function in self._no_source:
+            return None
+        try:
+            key = self._key(endpoint, function)
+        except (OSError, TypeError) as exc:
+            logger.debug(f"Not registering {function.__name__}, its source is not available: {exc}")
+            self._no_source.add(function)
+            return None
+
+        with self._lock:
+            if self._function_ids is None:
+                self._function_ids = self._load()
+            if key not in self._function_ids:
+                logger.debug(f"Registering function with Globus Compute: {function.__name__}")
+                self._function_ids[key] = client.register_function(function)
+                self._save()
+
+            return key, self._function_ids[key]
+
+    def check_result(self, key, future):
+        """Forget the function id if the task failed, so it is registered again"""
+        if not future.cancelled() and future.exception() is not None:
+            with self._lock:
+                if self._function_ids is not None and self._function_ids.pop(key, None) is not None:
+                    logger.debug(f"Forgetting registered function after a failed task: {key}")
+                    self._save()
+
+
+# registered functions shared by all the runners
+registered_functions = RegisteredFunctions()
+
+
 class CustomLoginManager(LoginManager):
     """
     Custom login manager that uses RJM token storage
@@ -730,3 +1343,116 @@ class CustomLoginManager(LoginManager):
 def check_dir_exists(dirpath):
     import os
     return os.path.isdir(dirpath)
+
+
+# function that joins files that were uploaded in parts
+def _join_file_parts(file_parts, working_directory, algorithm="sha256", discard=None):
+    # catch all errors due to problem with exceptions being wrapped in parsl class
+    # and parsl may not be installed on host (particularly windows)
+    try:
+        import os
+        import hashlib
+
+        file_chunk_size = 4 * 1024 * 1024
+
+        def new_checksum():
+            if algorithm == "xxh3":
+                import xxhash
+                return xxhash.xxh3_128()
+            return hashlib.new(algorithm)
+
+        # parts of files that could not be uploaded completely
+        for parts in (discard or {}).values():
+            for part in parts:
+                path = os.path.join(working_directory, part)
+                if os.path.exists(path):
+                    os.remove(path)
+
+        checksums = {}
+        buffer = bytearray(file_chunk_size)
+        view = memoryview(buffer)
+        for fn, parts in file_parts.items():
+            part_paths = [os.path.join(working_directory, part) for part in parts]
+            file_path = os.path.join(working_directory, fn)
+            missing = [part for part, path in zip(parts, part_paths) if not os.path.isfile(path)]
+            checksum = new_checksum()
+            if missing and os.path.isfile(file_path):
+                # already joined (e.g. this is a retry), just checksum it
+                with open(file_path, 'rb') as fin:
+                    while nread := fin.readinto(buffer):
+                        checksum.update(view[:nread])
+            elif missing:
+                return 1, f"Missing parts of {fn}: {', '.join(missing)}"
+            else:
+                # join to a temporary file, hashing the data as it is written
+                tmp_path = file_path + ".rjm-join"
+                with open(tmp_path, 'wb') as fout:
+                    for path in part_paths:
+                        with open(path, 'rb') as fin:
+                            while nread := fin.readinto(buffer):
+                                checksum.update(view[:nread])
+                                fout.write(view[:nread])
+                os.replace(tmp_path, file_path)
+
+            for path in part_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            checksums[fn] = checksum.hexdigest()
+
+    except Exception as exc:
+        return 1, repr(exc)
+
+    return 0, checksums
+
+
+# function that unpacks an archive of uploaded files
+def _unpack_bundle(bundle_name, files, working_directory, algorithm="sha256"):
+    # catch all errors due to problem with exceptions being wrapped in parsl class
+    # and parsl may not be installed on host (particularly windows)
+    try:
+        import os
+        import hashlib
+        import tarfile
+
+        file_chunk_size = 4 * 1024 * 1024
+
+        def new_checksum():
+            if algorithm == "xxh3":
+                import xxhash
+                return xxhash.xxh3_128()
+            return hashlib.new(algorithm)
+
+        checksums = {fn: None for fn in files}
+        archive_path = os.path.join(working_directory, bundle_name)
+        if not os.path.isfile(archive_path):
+            # already unpacked (e.g. this is a retry), just checksum the files
+            for fn in files:
+                file_path = os.path.join(working_directory, fn)
+                if os.path.isfile(file_path):
+                    checksum = new_checksum()
+                    with open(file_path, 'rb') as fin:
+                        while chunk := fin.read(file_chunk_size):
+                            checksum.update(chunk)
+                    checksums[fn] = checksum.hexdigest()
+            return 0, checksums
+
+        # only extract the expected regular files, hashing them as they are written
+        with tarfile.open(archive_path, "r:gz") as tar:
+            for member in tar:
+                if member.name not in checksums or not member.isfile():
+                    continue
+                file_path = os.path.join(working_directory, member.name)
+                checksum = new_checksum()
+                fin = tar.extractfile(member)
+                with open(file_path + ".rjm-unpack", 'wb') as fout:
+                    while chunk := fin.read(file_chunk_size):
+                        checksum.update(chunk)
+                        fout.write(chunk)
+                os.replace(file_path + ".rjm-unpack", file_path)
+                checksums[member.name] = checksum.hexdigest()
+        os.remove(archive_path)
+
+    except Exception as exc:
+        return 1, repr(exc)
+
+    return 0, checksums
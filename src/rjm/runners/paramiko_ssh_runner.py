@@ -1,49 +1,104 @@
 
+import re
 import uuid
 import os
+import json
+import shlex
 import time
+import inspect
+import importlib.resources
 import logging
-import paramiko
+import posixpath
+import threading
+import concurrent.futures
 
 from retry.api import retry_call
 
-from rjm.runners.runner_base import RunnerBase
-from rjm.errors import RemoteJobRunnerError
+from rjm.runners import remote_agent
+from rjm.runners.runner_base import RunnerBase, DOWNLOAD_BUNDLE_NAME
+from rjm.ssh_connection import get_connection_manager, SSH_RECONNECT_EXCEPTIONS
+from rjm.errors import RemoteJobRunnerError, RemoteJobConfigError
 
 
 MIN_POLLING_INTERVAL = 60
 MIN_WARMUP_POLLING_INTERVAL = 10
 MAX_WARMUP_DURATION = 300
+JOB_SLOTS_DIRECTORY = "$HOME/.rjm-slots"  # lock files for the job slots on the remote
+JOB_SLOT_POLL_INTERVAL = 10
+EXIT_CODE_FILE = ".rjm-exitcode"  # written to the working directory when the job script exits
+WATCHER_SCAN_INTERVAL = 1  # seconds between scans when inotifywait is not available on the remote
+WATCHER_STARTUP_TIME = 10  # a watcher that exits sooner than this is treated as failed
+AGENT_START_TIMEOUT = 30
+CHECKSUM_COMMAND_MAX_LENGTH = 100000  # characters of file names per command (Linux limits one argument to 128 KiB)
+CHECKSUM_ESCAPES = {"n": "\n", "r": "\r", "\\": "\\"}  # escapes in file names output by the checksum commands
+CHECKSUM_BATCHES_PER_CORE = 4  # more, smaller batches balance the load when file sizes vary
+CHECKSUM_COMMANDS = {  # coreutils commands matching the supported checksum algorithms
+    "sha256": "sha256sum",
+    "blake2b": "b2sum",
+}
 
 logger = logging.getLogger(__name__)
 
+# remote agents shared by the runners using each connection, False if an agent could not be started
+_agents = {}
+_agents_lock = threading.Lock()
+
 
 class ParamikoSSHRunner(RunnerBase):
     """
     Runner that uses the Paramiko SSH client to execute a command in a tmux
     session on the remote machine and poll until the command completes.
 
-    It is up to the calling program to manage the amount of work submitted
-    concurrently.
+    The number of jobs running at once on the remote can be limited with
+    ``max_concurrent_jobs``. Jobs over the limit wait in their tmux session
+    for a slot (a lock file on the remote) to become free, so the queue lives
+    on the remote and survives restarting RJM.
+
+    When a job script exits, its exit code is written to a file in the
+    working directory. While waiting, a long-lived channel watches for these
+    files (with inotifywait, or a scan every second if that is not installed)
+    so jobs are checked as soon as they finish instead of at the next poll.
+
+    With ``use_agent``, a small Python agent (:mod:`rjm.runners.remote_agent`)
+    is started on the remote and the runner's commands are sent to it over
+    one channel, instead of opening a channel and starting a shell for each
+    one. Shell commands are used if the agent can't be started.
 
     """
     def __init__(self, config=None):
         super(ParamikoSSHRunner, self).__init__(config=config)
 
         self._setup_done = False
-        self._ssh_client = None
+        self._connection = None
 
         # config
-        self._ssh_private_key_file = self._config.get("PARAMIKO", "private_key_file")
         self._remote_address = self._config.get("PARAMIKO", "remote_address")
         self._remote_user = self._config.get("PARAMIKO", "remote_user")
         self._job_script = self._config.get("PARAMIKO", "job_script")
 
+        # limit on jobs running at once: 0 for no limit or "auto" for the remote core count
+        self._max_concurrent_jobs = self._config.get("PARAMIKO", "max_concurrent_jobs", fallback="0").strip().lower()
+        if self._max_concurrent_jobs != "auto" and not self._max_concurrent_jobs.isdigit():
+            raise RemoteJobConfigError(f"max_concurrent_jobs must be a number or 'auto': {self._max_concurrent_jobs}")
+
+        # command for calculating checksums on the remote
+        if self._checksum_algorithm not in CHECKSUM_COMMANDS:
+            raise RemoteJobConfigError(f"Checksum algorithm '{self._checksum_algorithm}' is not supported by the paramiko runner")
+        self._checksum_command = CHECKSUM_COMMANDS[self._checksum_algorithm]
+
         # how often to poll for job completion
         self._poll_interval = self._config.getint("POLLING", "poll_interval")
         self._warmup_poll_interval = self._config.getint("POLLING", "warmup_poll_interval")
         self._warmup_duration = self._config.getint("POLLING", "warmup_duration")
 
+        # whether to watch for finished jobs instead of only polling
+        self._watch_completion = self._config.getboolean("PARAMIKO", "watch_completion", fallback=True)
+        self._watcher = None
+
+        # whether to send commands to a helper agent on the remote
+        self._use_agent = self._config.getboolean("PARAMIKO", "use_agent", fallback=False)
+        self._agent_python = self._config.get("PARAMIKO", "agent_python", fallback="python3")
+
         # tmux session name
         self._tmux_session_name = None
         self._working_directory = None
@@ -65,10 +120,6 @@ class ParamikoSSHRunner(RunnerBase):
 
         return state_dict
 
-    def __del__(self):
-        if self._ssh_client is not None:
-            self._ssh_client.close()
-
     def load_state(self, state_dict):
         """Get saved state if required for restarting"""
         super(ParamikoSSHRunner, self).load_state(state_dict)
@@ -78,27 +129,20 @@ class ParamikoSSHRunner(RunnerBase):
             self._working_directory = state_dict["working_directory"]
 
     def setup(self, *args, **kwargs):
-        """Setup the SFTP client"""
+        """Connect to the remote, sharing the connection with other runners and the SFTP transferer"""
         self._log(logging.DEBUG, "Setting up ParamikoSSHRunner...")
-        self._ssh_client = paramiko.SSHClient()
-        self._ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        # load the private key
-        private_key = paramiko.RSAKey(filename=self._ssh_private_key_file)
-
-        # Connect to server
-        self._ssh_client.connect(
-            hostname=self._remote_address,
-            port=22,
-            username=self._remote_user,
-            pkey=private_key,
-            timeout=30,
-        )
-        self._log(logging.DEBUG, f"Connected to: {self._remote_user}@{self._remote_address} ({self._ssh_client})")
+        self._connection = get_connection_manager(self._config)
+        self._connection.ssh_client()
+        self._log(logging.DEBUG, f"Connected to: {self._remote_user}@{self._remote_address} ({self._connection})")
 
         self._setup_done = True
 
-    def run_command(self, command, background=False, retries=False):
+    def warm_up(self):
+        """Start the remote agent, if it is used, so it is ready for the first command"""
+        if self._use_agent:
+            get_remote_agent(self._connection, self._agent_python)
+
+    def run_command(self, command, background=False, retries=False, replay=None, input=None):
         """
         Run the given command on the remote machine.
 
@@ -111,10 +155,19 @@ class ParamikoSSHRunner(RunnerBase):
         :type background: bool
         :param retries: Whether to retry the command if it fails
         :type retries: bool
+        :param replay: Whether the command is safe to run again if the
+            connection is lost after it was sent (default: unless it runs in
+            the background)
+        :type replay: bool
+        :param input: Optional text to send to the command's stdin
+        :type input: str
 
         """
-        if self._ssh_client is None:
+        if self._connection is None:
             raise RuntimeError("Must call setup before run_command")
+        if replay is None:
+            # starting a tmux session twice would run the job twice
+            replay = not background
 
         if retries:
             self._log(logging.ERROR, "Retries are not implemented for the paramiko runner yet")
@@ -133,14 +186,17 @@ class ParamikoSSHRunner(RunnerBase):
             )
             self._log(logging.DEBUG, f"Full background command: {command}")
 
-        stdin, stdout, stderr = self._ssh_client.exec_command(command)
-
-        stdout_output = stdout.read().decode().strip()
-        stderr_output = stderr.read().decode().strip()
+        try:
+            exit_code, stdout_output, stderr_output = self._call_agent("run", command=command, input=input)
+        except AgentUnavailable as exc:
+            # the command may already have run, so it is only sent again if that is safe
+            if exc.sent and not replay:
+                raise RemoteJobRunnerError(f"Lost the remote agent while running a command, not retrying: {exc}") from exc
+            exit_code, stdout_output, stderr_output = self._connection.run(command, replay=replay, input=input)
+        stdout_output = stdout_output.strip()
+        stderr_output = stderr_output.strip()
         full_output_not_time_ordered = stdout_output + stderr_output
 
-        exit_code = stdout.channel.recv_exit_status()
-
         if exit_code:
             raise RemoteJobRunnerError(f"run_command failed (exit code {exit_code}): STDOUT: {stdout_output}; STDERR: {stderr_output}")
 
@@ -151,6 +207,20 @@ class ParamikoSSHRunner(RunnerBase):
 
         return retval
 
+    def _call_agent(self, method, **params):
+        """
+        Call a method of the remote agent.
+
+        :raises AgentUnavailable: if the agent is not enabled or can't be
+            reached, in which case the caller should run a shell command instead
+
+        """
+        agent = get_remote_agent(self._connection, self._agent_python) if self._use_agent else None
+        if agent is None:
+            raise AgentUnavailable("The remote agent is not in use")
+
+        return agent.call(method, **params)
+
     def make_remote_directory(self, remote_base_path, prefix, retries=True):
         """
         Make one or more remote directories, using the given prefix(es).
@@ -171,49 +241,77 @@ class ParamikoSSHRunner(RunnerBase):
             single = False
             prefix_list = prefix
 
-        # with or without retries
-        if retries:
-            self._log(logging.WARNING, "Retries not implemented yet (make_remote_directory)")
-
-        # run the remote function
+        # run the command, with or without retries
         self._log(logging.DEBUG, f"Creating remote directories for: {prefix_list}")
         self._log(logging.DEBUG, f"Creating remote directories in: {remote_base_path}")
+        created = {}
+        if retries:
+            retry_call(self._make_remote_directories, fargs=(remote_base_path, prefix_list, created),
+                       tries=self._retry_tries, backoff=self._retry_backoff,
+                       delay=self._retry_delay, max_delay=self._retry_max_delay)
+        else:
+            self._make_remote_directories(remote_base_path, prefix_list, created)
 
-        try:
-            remote_dirs = []
-            for p in prefix_list:
-                # Construct the mktemp command to create a directory in base_path with the given prefix
-                cmd = f"mktemp -d -p '{remote_base_path}' -t '{p}-XXXXXX'"
-
-                stdin, stdout, stderr = self._ssh_client.exec_command(cmd)
-
-                # Wait for command to complete
-                exit_status = stdout.channel.recv_exit_status()
+        # compute paths relative to the base path
+        base_path_clean = remote_base_path.rstrip('/')
+        remote_dirs = []
+        for index in range(len(prefix_list)):
+            remote_full_path = created[index]
+            if not remote_full_path.startswith(base_path_clean):
+                raise RemoteJobRunnerError(f"Created directory {remote_full_path} is not under base path {remote_base_path}")
+            remote_dirs.append((remote_full_path, os.path.relpath(remote_full_path, start=remote_base_path)))
 
-                if exit_status != 0:
-                    error_msg = stderr.read().decode().strip()
-                    raise RuntimeError(f"Failed to create temp directory with prefix '{p}': {error_msg}")
+        if single:
+            remote_dirs = remote_dirs[0]
 
-                # Read the stdout (the created directory path)
-                remote_full_path = stdout.read().decode().strip()
+        return remote_dirs
 
-                # Ensure base_path is normalized for relative path calculation
-                base_path_clean = remote_base_path.rstrip('/')
-                if not remote_full_path.startswith(base_path_clean):
-                    raise RuntimeError(f"Created directory {remote_full_path} is not under base path {remote_base_path}")
+    def _make_remote_directories(self, remote_base_path, prefix_list, created):
+        """
+        Create a directory for each prefix that is not in `created` yet, with
+        one remote command.
 
-                # Compute relative path
-                rel_path = os.path.relpath(remote_full_path, start=remote_base_path)
+        :param created: dictionary with prefix indices as keys and created
+            directories as values, updated as directories are created, so a
+            retry only creates the remaining directories
 
-                remote_dirs.append((remote_full_path, rel_path))
+        """
+        remaining = [(index, p) for index, p in enumerate(prefix_list) if index not in created]
+        if not remaining:
+            return
 
-        except Exception as exc:
-            raise RemoteJobRunnerError(f"Make remote directory failed: {exc}")
+        try:
+            result = self._call_agent("make_directories", base=remote_base_path, prefixes=[p for _, p in remaining])
+        except AgentUnavailable:
+            pass
+        else:
+            for (index, _), remote_full_path in zip(remaining, result["created"]):
+                created[index] = remote_full_path
+            if result["error"] is not None:
+                msg = f"Make remote directory failed after creating {len(created)} of {len(prefix_list)}: {result['error']}"
+                self._log(logging.ERROR, msg)
+                raise RemoteJobRunnerError(msg)
+            return
+
+        # the "index/prefix" pairs are sent on stdin, so the command stays short however many
+        # jobs there are (prefixes are directory names, so can't contain "/"); each line of
+        # output is the index of a prefix and its directory, stopping at the first failure
+        cmd = (
+            "while IFS=/ read -r i p; do "
+            f"d=$(mktemp -d -p {shlex.quote(remote_base_path)} -t \"$p-XXXXXX\") || exit 1; "
+            "printf '%s\\t%s\\n' \"$i\" \"$d\"; done"
+        )
+        exit_status, stdout, stderr = self._connection.run(cmd, input="".join(f"{index}/{p}\n" for index, p in remaining))
 
-        if single:
-            remote_dirs = remote_dirs[0]
+        for line in stdout.splitlines():
+            index, _, remote_full_path = line.partition("\t")
+            if remote_full_path:
+                created[int(index)] = remote_full_path
 
-        return remote_dirs
+        if exit_status != 0:
+            msg = f"Make remote directory failed after creating {len(created)} of {len(prefix_list)}: {stderr.strip()}"
+            self._log(logging.ERROR, msg)
+            raise RemoteJobRunnerError(msg)
 
     def check_directory_exists(self, directory_path):
         """
@@ -223,11 +321,14 @@ class ParamikoSSHRunner(RunnerBase):
         :raises RemoteJobRunnerError: if the directory does not exist
 
         """
-        # Use SSH to test if the directory exists
-        command = f"test -d '{directory_path}'"
-        stdin, stdout, stderr = self._ssh_client.exec_command(command)
-        exit_status = stdout.channel.recv_exit_status()
-        if exit_status != 0:
+        try:
+            exists = self._call_agent("is_directory", path=directory_path)
+        except AgentUnavailable:
+            # Use SSH to test if the directory exists
+            command = f"test -d '{directory_path}'"
+            exit_status, _, _ = self._connection.run(command)
+            exists = exit_status == 0
+        if not exists:
             raise RemoteJobRunnerError(f"Remote directory does not exist: {directory_path}")
         # Directory exists; nothing to return
 
@@ -241,7 +342,10 @@ class ParamikoSSHRunner(RunnerBase):
         self._log(logging.DEBUG, f"Starting job for: {working_directory}")
         try:
             self._tmux_session_name = self.run_command(
-                f'cd "{working_directory}" && bash {self._job_script} > stdout.txt 2> stderr.txt && touch "{working_directory}/.rjm-succeeded"',
+                self._wait_for_slot_command() +
+                f'cd "{working_directory}" && {{ bash {self._job_script} > stdout.txt 2> stderr.txt; rc=$?; '
+                f'if [ $rc -eq 0 ]; then touch .rjm-succeeded; fi; '
+                f'echo $rc > {EXIT_CODE_FILE}.tmp && mv {EXIT_CODE_FILE}.tmp {EXIT_CODE_FILE}; }}',
                 background=True
             )
 
@@ -257,6 +361,36 @@ class ParamikoSSHRunner(RunnerBase):
 
         return started
 
+    def _wait_for_slot_command(self):
+        """
+        Return a shell snippet that waits for a free job slot, or an empty
+        string if the number of concurrent jobs is not limited.
+
+        Each slot is a lock file on the remote. The job's shell holds the lock
+        on one of them (with flock) until it exits, so slots are freed even if
+        a job is killed.
+
+        """
+        if self._max_concurrent_jobs == "0":
+            return ""
+
+        slots = "$(nproc)" if self._max_concurrent_jobs == "auto" else self._max_concurrent_jobs
+
+        return (
+            f'mkdir -p "{JOB_SLOTS_DIRECTORY}" && slots={slots} && '
+            'while :; do i=1; while [ $i -le $slots ]; do '
+            f'exec 9>"{JOB_SLOTS_DIRECTORY}/slot-$i"; if flock -n 9; then break 2; fi; i=$((i+1)); '
+            f'done; sleep {JOB_SLOT_POLL_INTERVAL}; done; '
+        )
+
+    def get_tmux_session_name(self):
+        """Return the name of the tmux session the job is running in"""
+        return self._tmux_session_name
+
+    def get_working_directory(self):
+        """Return the directory the job is running in"""
+        return self._working_directory
+
     def check_job_status(self):
         """
         Check the status of the job (SUCCEEDED, FAILED, UNFINISHED)
@@ -266,36 +400,84 @@ class ParamikoSSHRunner(RunnerBase):
             raise ValueError("Must call 'run_start' before 'check_job_status'")
 
         self._log(logging.DEBUG, f"Checking job status: {self._tmux_session_name}")
+        state = self.get_job_statuses([(self._tmux_session_name, self._working_directory)])[self._tmux_session_name]
+        self._log(logging.DEBUG, f"Job status for {self._tmux_session_name}: {state}")
 
-        cmd = f"tmux has-session -t \"{self._tmux_session_name}\""
-        self._log(logging.DEBUG, f"Command: {cmd}")
-        stdin, stdout, stderr = self._ssh_client.exec_command(cmd)
+        return state
 
-        # Wait for command to complete
-        exit_status = stdout.channel.recv_exit_status()
-        stdout_output = stdout.read().decode().strip()
-        stderr_output = stderr.read().decode().strip()
-        self._log(logging.DEBUG, f'tmux has-session exit code: {exit_status}')
-        self._log(logging.DEBUG, f"STDOUT: {stdout_output}")
-        self._log(logging.DEBUG, f"STDERR: {stderr_output}")
+    def get_job_statuses(self, jobs):
+        """
+        Check the status of several jobs with a single remote command, which
+        lists the live tmux sessions and the exit code files and success
+        markers in the jobs' working directories.
 
-        if exit_status:
-            job_finished = True
+        :param jobs: list of tuples of tmux session name and working directory
 
-            # confirm whether or not it succeeded, i.e. does the file exist?
-            stdin, stdout, stderr = self._ssh_client.exec_command(f"test -f {self._working_directory}/.rjm-succeeded")
-            exit_status = stdout.channel.recv_exit_status()
-            if exit_status:
-                state = "FAILED"
-            else:
-                state = "SUCCEEDED"
+        :returns: dictionary with the session names as keys and the states
+            (SUCCEEDED, FAILED, UNFINISHED) as values
 
+        """
+        directories = [working_directory for _, working_directory in jobs]
+        try:
+            result = self._call_agent("job_statuses", directories=directories, exit_code_file=EXIT_CODE_FILE,
+                                      success_file=".rjm-succeeded")
+        except AgentUnavailable:
+            live_sessions, succeeded_dirs, exit_codes = self._get_job_markers(directories)
         else:
-            state = "UNFINISHED"
+            live_sessions = set(result["sessions"])
+            succeeded_dirs = set(result["succeeded"])
+            exit_codes = result["exit_codes"]
+
+        statuses = {}
+        for session_name, working_directory in jobs:
+            if working_directory in exit_codes:
+                # the job script has exited, even if the tmux session has not closed yet
+                self._log(logging.DEBUG, f"Job {session_name} exited with code {exit_codes[working_directory]}")
+                statuses[session_name] = "SUCCEEDED" if exit_codes[working_directory] == "0" else "FAILED"
+            elif session_name in live_sessions:
+                statuses[session_name] = "UNFINISHED"
+            elif working_directory in succeeded_dirs:
+                statuses[session_name] = "SUCCEEDED"
+            else:
+                statuses[session_name] = "FAILED"
 
-        self._log(logging.DEBUG, f"Job status for {self._tmux_session_name}: {state}")
+        return statuses
 
-        return state
+    def _get_job_markers(self, directories):
+        """
+        Return the live tmux sessions, the directories with success markers
+        and the exit codes written to the directories, with a shell command
+
+        """
+        # the directories are sent NUL-delimited on stdin, so the command stays
+        # short however many jobs there are (xargs splits them into batches)
+        check_dirs = shlex.quote(
+            f'for d; do if [ -f "$d/{EXIT_CODE_FILE}" ]; then printf \'E %s %s\\n\' "$(cat "$d/{EXIT_CODE_FILE}")" "$d"; fi; '
+            'if [ -f "$d/.rjm-succeeded" ]; then printf \'D %s\\n\' "$d"; fi; done'
+        )
+        cmd = (
+            "{ tmux list-sessions -F 'S #{session_name}' </dev/null 2>/dev/null || true; }; "
+            f"xargs -0 sh -c {check_dirs} sh"
+        )
+        exit_status, stdout_output, stderr_output = self._connection.run(
+            cmd, input="".join(f"{working_directory}\0" for working_directory in directories))
+        if exit_status:
+            raise RemoteJobRunnerError(f"Checking job statuses failed (exit code {exit_status}): {stderr_output.strip()}")
+
+        live_sessions = set()
+        succeeded_dirs = set()
+        exit_codes = {}
+        for line in stdout_output.splitlines():
+            kind, _, value = line.partition(" ")
+            if kind == "S":
+                live_sessions.add(value)
+            elif kind == "D":
+                succeeded_dirs.add(value)
+            elif kind == "E":
+                exit_code, _, working_directory = value.partition(" ")
+                exit_codes[working_directory] = exit_code
+
+        return live_sessions, succeeded_dirs, exit_codes
 
     def wait(self, polling_interval=None, warmup_polling_interval=None, warmup_duration=None):
         """
@@ -330,14 +512,59 @@ class ParamikoSSHRunner(RunnerBase):
 
             else:
                 self._log(logging.DEBUG, "Not finished yet")
-                time.sleep(polling_interval)
+                self._wait_for_directories([self._working_directory], polling_interval)
 
+        self._close_watcher()
         assert job_succeeded is not None, "Unexpected error during wait"
         if job_finished:
             self._log(logging.INFO, f"Remote job {self._tmux_session_name} has finished (success: {job_succeeded})")
 
         return job_succeeded
 
+    def wait_for_completion(self, remote_jobs, timeout):
+        """
+        Block for up to `timeout` seconds, returning early if one of the jobs
+        finishes.
+
+        """
+        directories = [rj.get_runner().get_working_directory() for rj in remote_jobs]
+        self._wait_for_directories(directories, timeout)
+
+    def _wait_for_directories(self, directories, timeout):
+        """Wait until a job running in one of the directories finishes, or for `timeout` seconds"""
+        watcher = self._get_watcher(directories) if self._watch_completion else None
+        if watcher is None:
+            time.sleep(timeout)
+        elif watcher.wait(directories, timeout):
+            self._log(logging.DEBUG, "Notified that a job has finished")
+
+    def _get_watcher(self, directories):
+        """Return a completion watcher covering the directories, starting a new one if required"""
+        if self._watcher is not None and not (self._watcher.is_alive() and self._watcher.covers(directories)):
+            if self._watcher.failed():
+                # starting another one would most likely fail the same way on every poll
+                self._log(logging.WARNING, "Job completion watcher failed, polling instead")
+                self._watch_completion = False
+            self._watcher.close()
+            self._watcher = None
+
+        if self._watcher is None and self._connection is not None and self._watch_completion:
+            watcher = CompletionWatcher(self._connection, directories)
+            try:
+                watcher.start()
+            except SSH_RECONNECT_EXCEPTIONS + (OSError, RemoteJobRunnerError) as exc:
+                self._log(logging.WARNING, f"Could not watch for finished jobs, polling instead: {exc}")
+            else:
+                self._watcher = watcher
+
+        return self._watcher
+
+    def _close_watcher(self):
+        """Stop watching for finished jobs"""
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+
     def cancel(self):
         """Cancel the remote job"""
         raise NotImplementedError()
@@ -401,9 +628,21 @@ class ParamikoSSHRunner(RunnerBase):
         successful_jobs = []
         failed_jobs = []
         unfinished_jobs = []
-        for rj in remote_jobs:
-            self._log(logging.DEBUG, f"Check job status for: {rj}")
-            status = rj.check_job_status()
+
+        # one remote command for all the jobs
+        jobs = [(rj.get_runner().get_tmux_session_name(), rj.get_runner().get_working_directory()) for rj in remote_jobs]
+        statuses = retry_call(
+            self.get_job_statuses,
+            fargs=(jobs,),
+            tries=self._retry_tries,
+            backoff=self._retry_backoff,
+            delay=self._retry_delay,
+            max_delay=self._retry_max_delay,
+        )
+
+        for rj, (session_name, _) in zip(remote_jobs, jobs):
+            status = statuses[session_name]
+            self._log(logging.DEBUG, f"Job status for {rj}: {status}")
 
             if status == "SUCCEEDED":
                 successful_jobs.append(rj)
@@ -420,11 +659,14 @@ class ParamikoSSHRunner(RunnerBase):
             else:
                 raise ValueError(f"Unrecognised job status: \"{status}\"")
 
+        if not unfinished_jobs:
+            self._close_watcher()
+
         return successful_jobs, failed_jobs, unfinished_jobs
 
     def get_checksums(self, working_directory, files):
         """
-        Return SHA256 checksums for the list of files
+        Return checksums for the list of files
 
         :param files: list of files to calculate checksums of
         :param working_directory: directory to switch to first
@@ -439,24 +681,444 @@ class ParamikoSSHRunner(RunnerBase):
         if not files:
             return checksums
 
-        quoted_files = " ".join(f"'{fn}'" for fn in files)
-        cmd = f"cd '{working_directory}' && sha256sum {quoted_files}"
+        try:
+            checksums = self._call_agent("checksums", directory=working_directory, files=files,
+                                         algorithm=self._checksum_algorithm)
+        except AgentUnavailable:
+            self._get_checksums_shell(working_directory, checksums)
+
+        num_calculated = len([c for c in checksums.values() if c is not None])
+        self._log(logging.DEBUG, f"Calculated checksums for {num_calculated} of {len(files)} files")
 
-        stdin, stdout, stderr = self._ssh_client.exec_command(cmd)
-        stdout_output = stdout.read().decode()
-        # exit status is ignored on purpose: sha256sum returns nonzero when any
-        # file is missing, but stdout still contains valid lines for the rest
+        return checksums
 
-        for line in stdout_output.splitlines():
-            parts = line.strip().split(None, 1)
-            if len(parts) != 2:
-                continue
-            checksum, fn = parts
-            fn = fn.lstrip("*")
+    def _get_checksums_shell(self, working_directory, checksums):
+        """
+        Fill in the checksums dictionary with shell commands.
+
+        The file names are passed NUL-delimited to xargs, which runs the
+        checksum command on batches of files in parallel, one process per
+        core on the remote. Each batch writes to its own temporary file so
+        output lines from different processes can't interleave.
+
+        """
+        # keep each command well below the limit on the length of a single argument
+        groups = [[]]
+        length = 0
+        for fn in checksums:
+            quoted = shlex.quote(fn)
+            if groups[-1] and length + len(quoted) > CHECKSUM_COMMAND_MAX_LENGTH:
+                groups.append([])
+                length = 0
+            groups[-1].append(quoted)
+            length += len(quoted) + 1
+
+        for quoted_files in groups:
+            cmd = (
+                f"cd -- {shlex.quote(working_directory)} && tmp=$(mktemp -d) && {{ "
+                "cores=$(nproc 2>/dev/null || echo 1); "
+                f"n=$(( ({len(quoted_files)} + {CHECKSUM_BATCHES_PER_CORE} * cores - 1) / ({CHECKSUM_BATCHES_PER_CORE} * cores) )); "
+                f"printf '%s\\0' {' '.join(quoted_files)} | "
+                f"xargs -0 -P \"$cores\" -n \"$n\" sh -c '{self._checksum_command} -- \"$@\" > \"$(mktemp \"$0/XXXXXX\")\"' \"$tmp\"; "
+                'cat "$tmp"/* 2>/dev/null; rm -rf "$tmp"; }'
+            )
+            _, stdout_output, _ = self._connection.run(cmd)
+            # exit status is ignored on purpose: the checksum command returns nonzero when any
+            # file is missing, but stdout still contains valid lines for the rest
+            for fn, checksum in _parse_checksum_lines(stdout_output):
+                if fn in checksums:
+                    checksums[fn] = checksum
+
+    def bundle_files(self, working_directory, files):
+        """
+        Pack the given files into a single compressed archive on the remote
+
+        :param working_directory: directory containing the files
+        :param files: list of files, relative to `working_directory`, to
+            add to the archive
+
+        :returns: tuple containing the name of the archive (relative to
+            `working_directory`), the checksum of the archive and a manifest
+            dictionary with file names as keys and checksums as values (files
+            that do not exist on the remote have a value of None)
+
+        """
+        self._log(logging.DEBUG, f"Bundling {len(files)} files into: {DOWNLOAD_BUNDLE_NAME}")
+
+        # the names are sent NUL-delimited on stdin, so there is no limit on
+        # their number; the files that exist are passed to tar and kept in a
+        # list that the manifest is then calculated from, all in one command
+        # (the final "." stops a trailing space in the last name being stripped)
+        filter_existing = shlex.quote('for f; do [ -f "$f" ] && [ -r "$f" ] && printf \'%s\\0\' "$f"; done')
+        cmd = (
+            f"cd -- {shlex.quote(working_directory)} && list=$(mktemp) && {{ "
+            f'xargs -0 sh -c {filter_existing} sh | tee "$list" | tar --null -czf {DOWNLOAD_BUNDLE_NAME} -T - && '
+            f"{self._checksum_command} {DOWNLOAD_BUNDLE_NAME} && "
+            f'xargs -0 -r {self._checksum_command} -- < "$list" && echo .; '
+            'status=$?; rm -f "$list"; exit $status; }'
+        )
+        output = self.run_command(cmd, input="".join(f"{fn}\0" for fn in files))
+        archive_checksum = output.split()[0]
+
+        checksums = {fn: None for fn in files}
+        for fn, checksum in _parse_checksum_lines(output):
             if fn in checksums:
                 checksums[fn] = checksum
+        num_bundled = len([c for c in checksums.values() if c is not None])
+        self._log(logging.DEBUG, f"Bundled {num_bundled} of {len(files)} files")
 
-        num_calculated = len([c for c in checksums.values() if c is not None])
-        self._log(logging.DEBUG, f"Calculated checksums for {num_calculated} of {len(files)} files")
+        return DOWNLOAD_BUNDLE_NAME, archive_checksum, checksums
 
-        return checksums
+    def join_file_parts(self, working_directory, file_parts, discard=None):
+        """
+        Join files that were uploaded in parts, removing the parts
+
+        :param working_directory: directory containing the parts
+        :param file_parts: dictionary with file names as keys and ordered lists
+            of the names of their parts as values
+        :param discard: optional, dictionary in the same form as `file_parts`
+            of files whose parts are removed without being joined
+
+        :returns: dictionary with file names as keys and checksums of the
+            joined files as values
+
+        """
+        self._log(logging.DEBUG, f"Joining {len(file_parts)} files that were uploaded in parts")
+
+        commands = [f"cd {shlex.quote(working_directory)}"]
+        for parts in (discard or {}).values():
+            commands.append(f"rm -f -- {' '.join(shlex.quote(part) for part in parts)}")
+        for fn, parts in file_parts.items():
+            quoted_parts = " ".join(shlex.quote(part) for part in parts)
+            commands.append(f"cat -- {quoted_parts} > {shlex.quote(fn)}")
+            commands.append(f"rm -f -- {quoted_parts}")
+        # not replayed, the parts are gone once the first run completes
+        self.run_command(" && ".join(commands), replay=False)
+
+        return self.get_checksums(working_directory, list(file_parts)) if file_parts else {}
+
+    def unpack_bundle(self, working_directory, bundle_name, files):
+        """
+        Unpack an uploaded archive, removing the archive
+
+        :param working_directory: directory containing the archive
+        :param bundle_name: name of the archive, relative to `working_directory`
+        :param files: list of files expected in the archive
+
+        :returns: dictionary with file names as keys and checksums of the
+            unpacked files as values (None if the file was not in the archive)
+
+        """
+        self._log(logging.DEBUG, f"Unpacking {len(files)} files from: {bundle_name}")
+
+        quoted_bundle = shlex.quote(bundle_name)
+        # not replayed, the bundle is gone once the first run completes
+        self.run_command(f"cd {shlex.quote(working_directory)} && tar -xzf {quoted_bundle} && rm -f -- {quoted_bundle}",
+                         replay=False)
+
+        return self.get_checksums(working_directory, files)
+
+
+def _parse_checksum_lines(output):
+    """
+    Yield the file names and checksums in the output of a coreutils checksum
+    command.
+
+    Names containing a backslash, newline or carriage return are escaped and
+    the line starts with a backslash.
+
+    """
+    for line in output.split("\n"):
+        escaped = line.startswith("\\")
+        if escaped:
+            line = line[1:]
+        checksum, _, fn = line.partition(" ")
+        if not fn:
+            continue
+        fn = fn[1:]  # " " for text mode, "*" for binary mode
+        if escaped:
+            fn = re.sub(r"\\(.)", lambda m: CHECKSUM_ESCAPES.get(m[1], m[0]), fn)
+
+        yield fn, checksum
+
+
+class CompletionWatcher:
+    """
+    Streams the exit code files written by finished jobs over one long-lived
+    channel, so waiting threads can be woken as soon as a job finishes.
+
+    Files that already exist when the watcher starts are reported too, and
+    events may be repeated, so each directory is only reported once.
+
+    """
+    def __init__(self, connection, directories):
+        self._connection = connection
+        self._directories = {posixpath.normpath(d) for d in directories}
+        self._channel = None
+        self._thread = None
+        self._condition = threading.Condition()
+        self._finished = set()
+        self._reported = set()
+        self._closed = False
+        self._closing = False
+        self._start_time = None
+        self._failed = False
+
+    def _write_directory_list(self):
+        """
+        Write the directories to a temporary file on the remote, one per line,
+        so the watch command stays short however many jobs there are
+
+        :returns: path to the file
+
+        """
+        exit_status, stdout, stderr = self._connection.run(
+            'f=$(mktemp) && cat > "$f" && printf \'%s\' "$f"',
+            input="".join(f"{d}\n" for d in sorted(self._directories)),
+        )
+        if exit_status:
+            raise RemoteJobRunnerError(f"Could not write the directories to watch (exit code {exit_status}): {stderr.strip()}")
+
+        return stdout.strip()
+
+    def _watch_command(self, list_file):
+        """Command that prints the path of each exit code file as it appears"""
+        quoted_list = shlex.quote(list_file)
+        # the list is removed when the command exits or is hung up
+        cleanup = f"trap 'rm -f {quoted_list}' EXIT; trap 'exit 1' HUP INT TERM; "
+        scan = (
+            f'scan() {{ while IFS= read -r d; do if [ -f "$d/{EXIT_CODE_FILE}" ]; then '
+            f'printf \'%s\\n\' "$d/{EXIT_CODE_FILE}"; fi; done < {quoted_list}; }}; '
+        )
+
+        # the exit code file is moved into place, so it is complete when the event arrives;
+        # scan once the watches are set up, to catch jobs that finished before
+        return (
+            f"{cleanup}{scan}"
+            "if command -v inotifywait >/dev/null 2>&1; then "
+            f"inotifywait -m -q -e moved_to --format '%w%f' --fromfile {quoted_list} & pid=$!; sleep 1; scan; wait $pid; "
+            f"else while :; do scan; sleep {WATCHER_SCAN_INTERVAL}; done; fi"
+        )
+
+    def start(self):
+        """Start the command on the remote and a thread reading its output"""
+        list_file = self._write_directory_list()
+        self._start_time = time.monotonic()
+        self._channel = self._connection.open_channel(self._watch_command(list_file), get_pty=True)
+        self._thread = threading.Thread(target=self._read_events, daemon=True)
+        self._thread.start()
+        logger.debug(f"Watching {len(self._directories)} directories for finished jobs")
+
+    def _read_events(self):
+        last_output = ""
+        try:
+            for line in self._channel.makefile("rb"):
+                path = line.decode(errors="replace").rstrip("\r\n")
+                if posixpath.basename(path) == EXIT_CODE_FILE:
+                    with self._condition:
+                        self._finished.add(posixpath.normpath(posixpath.dirname(path)))
+                        self._condition.notify_all()
+                elif path:
+                    last_output = path
+        except SSH_RECONNECT_EXCEPTIONS + (OSError,) as exc:
+            logger.debug(f"Job completion watcher stopped: {exc}")
+        finally:
+            with self._condition:
+                self._closed = True
+                if not self._closing and time.monotonic() - self._start_time < WATCHER_STARTUP_TIME:
+                    # e.g. the command could not be run on the remote
+                    self._failed = True
+                    logger.warning(f"Job completion watcher exited straight after starting: {last_output}")
+                self._condition.notify_all()
+
+    def failed(self):
+        """Return whether the watcher exited straight after it was started"""
+        with self._condition:
+            return self._failed
+
+    def is_alive(self):
+        """Return whether the watcher is still receiving events"""
+        with self._condition:
+            return not self._closed
+
+    def covers(self, directories):
+        """Return whether all the directories are being watched"""
+        return {posixpath.normpath(d) for d in directories} <= self._directories
+
+    def wait(self, directories, timeout):
+        """
+        Wait for up to `timeout` seconds for a job in one of the directories to
+        finish. If the watcher stops, the rest of the time is slept as when
+        polling.
+
+        :returns: True if a job finished that had not been reported before
+
+        """
+        directories = {posixpath.normpath(d) for d in directories}
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._condition.wait_for(lambda: self._closed or (self._finished & directories) - self._reported, timeout)
+            newly_finished = (self._finished & directories) - self._reported
+            self._reported |= newly_finished
+        if newly_finished:
+            return True
+
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+        return False
+
+    def close(self):
+        """Close the channel, which hangs up the command on the remote"""
+        with self._condition:
+            self._closing = True
+        if self._channel is not None:
+            self._channel.close()
+
+
+class AgentUnavailable(Exception):
+    """
+    The remote agent is not in use or could not be reached.
+
+    `sent` is True if the request may have reached the agent before the
+    connection was lost.
+
+    """
+    def __init__(self, message, sent=False):
+        super(AgentUnavailable, self).__init__(message)
+        self.sent = sent
+
+
+def _agent_source():
+    """
+    Return the source of the remote agent. The module is packaged as a data
+    file (see the PyInstaller hook), so it can be read in frozen executables
+    where `inspect.getsource` does not work.
+
+    """
+    try:
+        return importlib.resources.files("rjm.runners").joinpath("remote_agent.py").read_text(encoding="utf-8")
+    except OSError:
+        return inspect.getsource(remote_agent)
+
+
+def get_remote_agent(connection, python="python3"):
+    """
+    Return the remote agent for the connection, starting it if required, or
+    None if it could not be started (it is not tried again)
+
+    """
+    with _agents_lock:
+        agent = _agents.get(connection)
+        if agent is False:
+            return None
+
+        if agent is None or not agent.is_alive():
+            agent = RemoteAgent(connection, python=python)
+            try:
+                agent.start()
+            except SSH_RECONNECT_EXCEPTIONS + (OSError, AgentUnavailable) as exc:
+                logger.warning(f"Could not start the remote agent, using shell commands instead: {exc}")
+                agent.close()
+                _agents[connection] = False
+                return None
+            _agents[connection] = agent
+
+        return agent
+
+
+class RemoteAgent:
+    """
+    Client for the helper agent (:mod:`rjm.runners.remote_agent`) running on
+    the remote, over one long-lived channel. Calls can be made from several
+    threads at once and are handled concurrently by the agent.
+
+    """
+    def __init__(self, connection, python="python3"):
+        self._connection = connection
+        self._python = python
+        self._channel = None
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending = {}  # request ids and the futures waiting for their responses
+        self._next_id = 1
+        self._closed = False
+
+    def start(self):
+        """Start the agent on the remote and wait until it is ready"""
+        ready = concurrent.futures.Future()
+        self._pending[0] = ready
+        source = _agent_source()
+        self._channel = self._connection.open_channel(f"{self._python} -u -c {shlex.quote(source)}")
+        threading.Thread(target=self._read_responses, daemon=True).start()
+
+        try:
+            response = ready.result(timeout=AGENT_START_TIMEOUT)
+        except concurrent.futures.TimeoutError as exc:
+            raise AgentUnavailable(f"The remote agent did not start within {AGENT_START_TIMEOUT} s") from exc
+        logger.debug(f"Remote agent started: {response['result']}")
+
+    def _read_responses(self):
+        try:
+            for line in self._channel.makefile("rb"):
+                try:
+                    response = json.loads(line)
+                except ValueError:
+                    logger.debug(f"Ignoring unexpected output from the remote agent: {line!r}")
+                    continue
+                with self._lock:
+                    future = self._pending.pop(response.get("id"), None)
+                if future is not None:
+                    future.set_result(response)
+        except SSH_RECONNECT_EXCEPTIONS + (OSError,) as exc:
+            logger.debug(f"Remote agent channel failed: {exc}")
+        finally:
+            with self._lock:
+                self._closed = True
+                pending = list(self._pending.values())
+                self._pending.clear()
+            for future in pending:
+                future.set_exception(AgentUnavailable("The remote agent stopped before responding", sent=True))
+
+    def is_alive(self):
+        with self._lock:
+            return not self._closed
+
+    def call(self, method, **params):
+        """
+        Call a method of the agent and return the result
+
+        :raises AgentUnavailable: if the agent can't be reached
+        :raises RemoteJobRunnerError: if the method failed on the remote
+
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._closed:
+                raise AgentUnavailable("The remote agent has stopped")
+            request_id = self._next_id
+            self._next_id += 1
+            self._pending[request_id] = future
+
+        request = json.dumps({"id": request_id, "method": method, "params": params}) + "\n"
+        try:
+            with self._send_lock:
+                self._channel.sendall(request.encode())
+        except SSH_RECONNECT_EXCEPTIONS + (OSError,) as exc:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise AgentUnavailable(f"Sending to the remote agent failed: {exc}", sent=True) from exc
+
+        response = future.result()
+        if "error" in response:
+            raise RemoteJobRunnerError(f"Remote agent {method} failed: {response['error']}")
+
+        return response["result"]
+
+    def close(self):
+        """Close the channel, which stops the agent"""
+        with self._lock:
+            self._closed = True
+        if self._channel is not None:
+            self._channel.close()
@@ -0,0 +1,137 @@
+"""
+Helper agent run on the remote by the SSH runner when ``use_agent`` is set
+in the ``[PARAMIKO]`` config section.
+
+The source of this module is sent to the remote and run with ``python3 -c``,
+so it must only use the standard library and should run on older versions of
+Python. Requests and responses are JSON objects, one per line, on stdin and
+stdout::
+
+    {"id": 1, "method": "checksums", "params": {"directory": ..., ...}}
+    {"id": 1, "result": ...}  or  {"id": 1, "error": "..."}
+
+Requests are handled concurrently, so responses may arrive in any order. A
+response with id 0 is sent when the agent is ready.
+
+"""
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+AGENT_VERSION = 1
+MAX_WORKERS = 8  # requests handled at once
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def checksum_file(path, algorithm):
+    """Return the checksum of the file, or None if it can't be read"""
+    try:
+        file_hash = hashlib.new(algorithm)
+        with open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(HASH_BLOCK_SIZE), b""):
+                file_hash.update(block)
+    except OSError:
+        return None
+
+    return file_hash.hexdigest()
+
+
+class Agent:
+    """Reads requests from stdin and writes the responses to stdout"""
+    def __init__(self, stdout):
+        self._stdout = stdout
+        self._write_lock = threading.Lock()
+        self._workers = ThreadPoolExecutor(MAX_WORKERS)
+        # hashlib releases the GIL, so files are hashed in parallel on all the cores
+        self._hashers = ThreadPoolExecutor(os.cpu_count() or 1)
+
+    def send(self, message):
+        with self._write_lock:
+            self._stdout.write(json.dumps(message) + "\n")
+            self._stdout.flush()
+
+    def handle(self, request):
+        try:
+            method = getattr(self, "rpc_" + request["method"])
+            response = {"id": request["id"], "result": method(**request.get("params", {}))}
+        except Exception as exc:
+            response = {"id": request.get("id"), "error": "{}: {}".format(type(exc).__name__, exc)}
+        self.send(response)
+
+    def serve(self, stdin):
+        self.send({"id": 0, "result": {"version": AGENT_VERSION, "pid": os.getpid()}})
+        for line in stdin:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                continue
+            self._workers.submit(self.handle, request)
+        self._workers.shutdown()
+
+    def rpc_run(self, command, input=None):
+        """Run a shell command, with optional text on stdin, returning the exit code, stdout and stderr"""
+        stdin = {"stdin": subprocess.DEVNULL} if input is None else {"input": input.encode()}
+        p = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **stdin)
+
+        return [p.returncode, p.stdout.decode(errors="replace"), p.stderr.decode(errors="replace")]
+
+    def rpc_checksums(self, directory, files, algorithm):
+        """Return the checksums of the files, None for files that don't exist"""
+        paths = [os.path.join(directory, fn) for fn in files]
+
+        return dict(zip(files, self._hashers.map(lambda path: checksum_file(path, algorithm), paths)))
+
+    def rpc_is_directory(self, path):
+        return os.path.isdir(path)
+
+    def rpc_make_directories(self, base, prefixes):
+        """
+        Create a new directory under `base` for each prefix, stopping at the
+        first failure, and return the directories that were created along
+        with the error, if any
+
+        """
+        created = []
+        try:
+            for prefix in prefixes:
+                created.append(tempfile.mkdtemp(prefix=prefix + "-", dir=base))
+        except OSError as exc:
+            return {"created": created, "error": str(exc)}
+
+        return {"created": created, "error": None}
+
+    def rpc_job_statuses(self, directories, exit_code_file, success_file):
+        """Return the live tmux sessions and the exit codes and success markers in the directories"""
+        try:
+            p = subprocess.run(["tmux", "list-sessions", "-F", "#{session_name}"],
+                               stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            sessions = p.stdout.decode(errors="replace").split() if p.returncode == 0 else []
+        except OSError:
+            sessions = []
+
+        exit_codes = {}
+        succeeded = []
+        for directory in directories:
+            try:
+                with open(os.path.join(directory, exit_code_file)) as fh:
+                    exit_codes[directory] = fh.read().strip()
+            except OSError:
+                pass
+            if os.path.isfile(os.path.join(directory, success_file)):
+                succeeded.append(directory)
+
+        return {"sessions": sessions, "exit_codes": exit_codes, "succeeded": succeeded}
+
+
+def main():
+    Agent(sys.stdout).serve(sys.stdin)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 
+import time
 import logging
 
 from retry.api import retry_call
@@ -8,6 +9,8 @@ from rjm import config as config_helper
 from rjm.errors import RemoteJobRunnerError
 
 
+DOWNLOAD_BUNDLE_NAME = ".rjm-downloads.tar.gz"  # archive created on the remote when bundling downloads
+
 logger = logging.getLogger(__name__)
 
 
@@ -16,6 +19,10 @@ class RunnerBase:
     Base class for runner objects
 
     """
+    # whether `get_manifests` gathers the manifests of several jobs in one call,
+    # rather than calling `get_checksums` for each job
+    BATCH_MANIFESTS = False
+
     def __init__(self, config=None):
         self._label = ""
 
@@ -27,6 +34,12 @@ class RunnerBase:
 
         self._retry_tries, self._retry_backoff, self._retry_delay, self._retry_max_delay = utils.get_retry_values_from_config(self._config)
 
+        # algorithm for checksums calculated on the remote (must match the transferer)
+        self._checksum_algorithm = utils.get_checksum_algorithm_from_config(self._config)
+
+        # files up to this size may have their contents returned with the manifest
+        self._inline_max_size = utils.get_inline_max_size_from_config(self._config)
+
     def _log(self, level, message, *args, **kwargs):
         """Add a label to log messages, identifying this specific RemoteJob"""
         logger.log(level, self._label + message, *args, **kwargs)
@@ -57,6 +70,14 @@ class RunnerBase:
         """Do any Globus auth setup here, if required"""
         pass
 
+    def warm_up(self):
+        """
+        Prepare the remote for the first call without waiting for it (e.g.
+        get a worker started), if that helps
+
+        """
+        pass
+
     def make_remote_directory(self, prefix: list[str]):
         """
         Make one or more remote directories, using the given prefix(es).
@@ -68,6 +89,59 @@ class RunnerBase:
         """Check the working directory exists"""
         raise NotImplementedError
 
+    def get_manifests(self, jobs_files):
+        """
+        Return manifests (size and checksum of each file) for the download
+        files of one or more jobs.
+
+        This default implementation calls `get_checksums` for each job,
+        runners should override it to gather all the manifests at once (see
+        `BATCH_MANIFESTS`).
+
+        :param jobs_files: dictionary with remote working directories as keys
+            and lists of files (relative to the working directory) as values
+
+        :returns: dictionary with the working directories as keys and
+            dictionaries as values that map each file name to a dictionary
+            with "size" and "checksum" keys, or None if the file does not exist
+
+        """
+        manifests = {}
+        for working_directory, files in jobs_files.items():
+            checksums = self.get_checksums(working_directory, files)
+            manifests[working_directory] = {
+                fn: None if checksums.get(fn) is None else {"size": None, "checksum": checksums[fn]} for fn in files
+            }
+
+        return manifests
+
+    def bundle_files(self, working_directory, files):
+        """
+        Pack files into a compressed archive on the remote, returning the
+        archive name and checksum along with a manifest of file checksums
+
+        """
+        raise NotImplementedError
+
+    def join_file_parts(self, working_directory, file_parts, discard=None):
+        """
+        Join files that were uploaded in parts (see `pop_file_parts` on the
+        transferers), removing the parts, and return checksums of the joined
+        files. The parts of files in `discard` (e.g. from an upload that
+        failed) are removed without being joined.
+
+        """
+        raise NotImplementedError
+
+    def unpack_bundle(self, working_directory, bundle_name, files):
+        """
+        Unpack an archive of files that was uploaded (see `upload_bundle` on
+        the transferers), removing the archive, and return checksums of the
+        unpacked files
+
+        """
+        raise NotImplementedError
+
     def run_function(self, function, *args, **kwargs):
         """Run the given function and pass back the return value"""
         raise NotImplementedError
@@ -86,6 +160,14 @@ class RunnerBase:
         """Blocks until the processing has finished"""
         raise NotImplementedError
 
+    def wait_for_completion(self, remote_jobs, timeout):
+        """
+        Block for up to `timeout` seconds before the jobs are checked again.
+        Runners that are notified when jobs finish may return early.
+
+        """
+        time.sleep(timeout)
+
     def cancel(self):
         """Cancel the processing"""
         raise NotImplementedError
@@ -1,6 +1,12 @@
 
 import os
+import time
+import hashlib
+import tarfile
+import threading
 import configparser
+import logging
+import concurrent.futures
 
 import pytest
 
@@ -158,6 +164,198 @@ def test_calculate_checksums(runner, tmpdir):
     assert checksums[test_file_not_exist] is None
 
 
+def test_calculate_checksums_parallel_blake2b(runner, tmpdir):
+    files = [f"file{i}.txt" for i in range(5)]
+    for i, fn in enumerate(files):
+        with open(os.path.join(tmpdir, fn), "w") as fh:
+            fh.write("x" * (i + 1) * 1000)
+
+    returncode, checksums = globus_compute_slurm_runner._calculate_checksums(
+        files,
+        str(tmpdir),
+        algorithm="blake2b",
+        max_workers=3,
+    )
+
+    assert returncode == 0
+    for fn in files:
+        with open(os.path.join(tmpdir, fn), "rb") as fh:
+            assert checksums[fn] == hashlib.blake2b(fh.read()).hexdigest()
+
+
+def test_calculate_checksums_time_limit(runner, tmpdir):
+    files = [f"file{i}.txt" for i in range(5)]
+    for fn in files:
+        with open(os.path.join(tmpdir, fn), "w") as fh:
+            fh.write("some text")
+
+    # with no time available the files are omitted from the result, missing files are still reported
+    returncode, checksums = globus_compute_slurm_runner._calculate_checksums(
+        files + ["notexist.txt"],
+        str(tmpdir),
+        time_limit=-1,
+    )
+
+    assert returncode == 0
+    assert checksums == {"notexist.txt": None}
+
+
+def test_get_checksums_partial_results(runner, mocker):
+    mocker.patch('time.sleep')
+    mocked = mocker.patch(
+        'rjm.runners.globus_compute_slurm_runner.GlobusComputeSlurmRunner.run_function',
+        side_effect=[
+            (0, {"file1": "abc", "missing": None}),
+            (0, {"file2": "def"}),
+        ],
+    )
+
+    checksums = runner.get_checksums("some/path", ["file1", "file2", "missing"])
+
+    assert checksums == {"file1": "abc", "file2": "def", "missing": None}
+    assert mocked.call_count == 2
+    assert mocked.call_args.args[1] == ["file2"]
+
+
+def test_get_checksums_no_progress(runner, mocker):
+    mocker.patch('time.sleep')
+    mocked = mocker.patch(
+        'rjm.runners.globus_compute_slurm_runner.GlobusComputeSlurmRunner.run_function',
+        side_effect=[
+            (0, {"file1": "abc"}),
+            (0, {}),
+        ],
+    )
+
+    # the file that is never reported is given up on rather than looping forever
+    checksums = runner.get_checksums("some/path", ["file1", "unreadable"])
+
+    assert checksums == {"file1": "abc", "unreadable": None}
+    assert mocked.call_count == 2
+
+
+def test_calculate_manifests(runner, tmp_path):
+    text = """test file with some text"""
+    expected = "337de094ee88f1bc965a97e1d6767f51a06fd1e6e679664625ff68546e3d2601"
+    jobs_files = {}
+    for job in ("job1", "job2"):
+        (tmp_path / job).mkdir()
+        (tmp_path / job / "output.txt").write_text(text)
+        jobs_files[str(tmp_path / job)] = ["output.txt", "notexist.txt"]
+
+    returncode, manifests = globus_compute_slurm_runner._calculate_manifests(jobs_files)
+
+    assert returncode == 0
+    assert len(manifests) == 2
+    for job in ("job1", "job2"):
+        manifest = manifests[str(tmp_path / job)]
+        assert manifest["output.txt"] == {"size": len(text), "checksum": expected}
+        assert manifest["notexist.txt"] is None
+
+
+def test_get_manifests_partial_results(runner, mocker):
+    mocker.patch('time.sleep')
+    mocked = mocker.patch(
+        'rjm.runners.globus_compute_slurm_runner.GlobusComputeSlurmRunner.run_function',
+        side_effect=[
+            (0, {"dir1": {"file1": {"size": 1, "checksum": "abc"}}, "dir2": {"file3": None}}),
+            (0, {"dir1": {"file2": {"size": 2, "checksum": "def"}}}),
+        ],
+    )
+
+    manifests = runner.get_manifests({"dir1": ["file1", "file2"], "dir2": ["file3"]})
+
+    assert mocked.call_count == 2
+    assert mocked.call_args.args[1] == {"dir1": ["file2"]}
+    assert manifests == {
+        "dir1": {"file1": {"size": 1, "checksum": "abc"}, "file2": {"size": 2, "checksum": "def"}},
+        "dir2": {"file3": None},
+    }
+
+
+def test_get_manifests_no_progress(runner, mocker):
+    mocker.patch('time.sleep')
+    mocked = mocker.patch(
+        'rjm.runners.globus_compute_slurm_runner.GlobusComputeSlurmRunner.run_function',
+        return_value=(0, {"dir1": {}}),
+    )
+
+    manifests = runner.get_manifests({"dir1": ["unreadable"]})
+
+    assert mocked.call_count == 1
+    assert manifests == {"dir1": {"unreadable": None}}
+
+
+def test_bundle_files(runner, tmpdir):
+    text = """test file with some text"""
+    expected = "337de094ee88f1bc965a97e1d6767f51a06fd1e6e679664625ff68546e3d2601"
+    test_file = "testchecksum.txt"
+    test_file_not_exist = "notexist.txt"
+    with open(os.path.join(tmpdir, test_file), "w") as fh:
+        fh.write(text)
+
+    returncode, (archive_checksum, checksums) = globus_compute_slurm_runner._bundle_files(
+        [test_file, test_file_not_exist],
+        str(tmpdir),
+        "bundle.tar.gz",
+    )
+
+    assert returncode == 0
+    assert checksums[test_file] == expected
+    assert checksums[test_file_not_exist] is None
+    with tarfile.open(os.path.join(tmpdir, "bundle.tar.gz")) as tar:
+        assert tar.getnames() == [test_file]
+        assert tar.extractfile(test_file).read().decode() == text
+    with open(os.path.join(tmpdir, "bundle.tar.gz"), "rb") as fh:
+        assert archive_checksum == hashlib.sha256(fh.read()).hexdigest()
+
+
+def test_join_file_parts(runner, tmpdir):
+    data = os.urandom(10000)
+    parts = []
+    for index, offset in enumerate(range(0, len(data), 3000)):
+        parts.append(f".bigfile.rjm-part-{index:04d}")
+        with open(os.path.join(tmpdir, parts[-1]), "wb") as fh:
+            fh.write(data[offset:offset + 3000])
+
+    returncode, checksums = globus_compute_slurm_runner._join_file_parts({"bigfile": parts}, str(tmpdir))
+
+    assert returncode == 0
+    assert checksums == {"bigfile": hashlib.sha256(data).hexdigest()}
+    assert os.listdir(tmpdir) == ["bigfile"]
+    with open(os.path.join(tmpdir, "bigfile"), "rb") as fh:
+        assert fh.read() == data
+
+    # joining again (e.g. a retry after the first call succeeded) just returns the checksum
+    assert globus_compute_slurm_runner._join_file_parts({"bigfile": parts}, str(tmpdir)) == (0, checksums)
+
+
+def test_join_file_parts_missing(runner, tmpdir):
+    with open(os.path.join(tmpdir, ".bigfile.rjm-part-0000"), "wb") as fh:
+        fh.write(b"data")
+
+    returncode, msg = globus_compute_slurm_runner._join_file_parts(
+        {"bigfile": [".bigfile.rjm-part-0000", ".bigfile.rjm-part-0001"]},
+        str(tmpdir),
+    )
+
+    assert returncode == 1
+    assert ".bigfile.rjm-part-0001" in msg
+
+
+def test_join_file_parts_discard(runner, tmpdir):
+    with open(os.path.join(tmpdir, ".bigfile.rjm-part-0000"), "wb") as fh:
+        fh.write(b"data")
+
+    returncode, checksums = globus_compute_slurm_runner._join_file_parts(
+        {}, str(tmpdir), discard={"bigfile": [".bigfile.rjm-part-0000", ".bigfile.rjm-part-0001"]},
+    )
+
+    assert returncode == 0
+    assert checksums == {}
+    assert os.listdir(tmpdir) == []
+
+
 #def test_run_function_timeout(runner, mocker):
 #    class DummyFuture:
 #        def result(self, timeout=None):
@@ -255,6 +453,56 @@ def test_reset_globus_compute_client(configobj, mocker):
     assert child2._executor.id == 2
 
 
+def test_reset_stale_executor_once(configobj, mocker):
+    class MockedExecutor:
+        def __init__(self, stopped):
+            self.stopped = stopped
+            self.shutdowns = 0
+
+        def shutdown(self, *args, **kwargs):
+            self.shutdowns += 1
+
+        def submit(self, *args, **kwargs):
+            if self.stopped:
+                # every thread has submitted to this executor before it fails
+                barrier.wait(timeout=10)
+                raise RuntimeError("executor is shutdown")
+
+    mocker.patch('rjm.runners.globus_compute_slurm_runner.GlobusComputeSlurmRunner._create_globus_compute_client')
+    mocked_create_executor = mocker.patch(
+        'rjm.runners.globus_compute_slurm_runner.GlobusComputeSlurmRunner._create_globus_compute_executor',
+        side_effect=[MockedExecutor(stopped=True), MockedExecutor(stopped=False)],
+    )
+    mocker.patch('rjm.config.load_config', return_value=configobj)
+    runner = globus_compute_slurm_runner.GlobusComputeSlurmRunner()
+    runner._setup_done = True
+    runner._register_functions = False
+    runner.reset_globus_compute_client()
+    stale = runner.get_executor()
+    barrier = threading.Barrier(8)
+    children = []
+    for _ in range(8):
+        child = globus_compute_slurm_runner.GlobusComputeSlurmRunner()
+        child._setup_done = True
+        child._external_runner = runner
+        child._register_functions = False
+        child.reset_globus_compute_client()
+        children.append(child)
+
+    # every child sees the shut down executor at once, only one replaces it
+    def submit(child):
+        with pytest.raises(RuntimeError):
+            child.submit_function(None)
+        child.submit_function(None)
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(submit, children))
+
+    assert mocked_create_executor.call_count == 2
+    assert stale.shutdowns == 1
+    assert all(child.get_executor() is runner.get_executor() is not stale for child in children)
+
+
 class MockedSubprocessReturn:
     def __init__(self, status, output):
         self.returncode = status
@@ -398,3 +646,182 @@ def test_get_poll_interval(config_vals, user_vals, expected_vals, mocker):
     assert polling_interval == expected_vals[0]
     assert warmup_polling_interval == expected_vals[1]
     assert warmup_duration == expected_vals[2]
+
+
+def test_calculate_manifests_inline(runner, tmp_path):
+    (tmp_path / "small.txt").write_bytes(b"small")
+    (tmp_path / "large.txt").write_bytes(b"x" * 100)
+
+    returncode, manifests = globus_compute_slurm_runner._calculate_manifests(
+        {str(tmp_path): ["small.txt", "large.txt"]}, inline_max_size=10)
+
+    assert returncode == 0
+    manifest = manifests[str(tmp_path)]
+    assert manifest["small.txt"] == {"size": 5, "checksum": hashlib.sha256(b"small").hexdigest(), "content": "c21hbGw="}
+    assert "content" not in manifest["large.txt"]
+
+
+def test_unpack_bundle(runner, tmpdir):
+    src_dir = tmpdir.mkdir("src")
+    with tarfile.open(os.path.join(tmpdir, "bundle.tar.gz"), "w:gz") as tar:
+        for name in ("a.txt", "unexpected.txt"):
+            src_dir.join(name).write(name)
+            tar.add(str(src_dir.join(name)), arcname=name)
+
+    returncode, checksums = globus_compute_slurm_runner._unpack_bundle(
+        "bundle.tar.gz", ["a.txt", "missing.txt"], str(tmpdir))
+
+    assert returncode == 0
+    assert checksums == {"a.txt": hashlib.sha256(b"a.txt").hexdigest(), "missing.txt": None}
+    assert sorted(os.listdir(tmpdir)) == ["a.txt", "src"]
+
+    # unpacking again (e.g. a retry after the first call succeeded) just returns the checksums
+    assert globus_compute_slurm_runner._unpack_bundle(
+        "bundle.tar.gz", ["a.txt", "missing.txt"], str(tmpdir)) == (0, checksums)
+
+
+class ImmediateFuture:
+    def __init__(self, function, *args, **kwargs):
+        try:
+            self._result, self._exc = function(*args, **kwargs), None
+        except Exception as exc:
+            self._result, self._exc = None, exc
+
+    def result(self, timeout=None):
+        if self._exc is not None:
+            raise self._exc
+        return self._result
+
+
+def test_run_functions(runner, mocker):
+    submitted = []
+
+    def submit_function(function, *args, **kwargs):
+        submitted.append(args)
+        return ImmediateFuture(function, *args, **kwargs)
+    mocker.patch.object(runner, 'submit_function', side_effect=submit_function)
+
+    def divide(a, b):
+        return a / b
+
+    calls = [(divide, (4, 2), {}), (divide, (1, 0), {}), (divide, (), {"a": 9, "b": 3})]
+    results = runner.run_functions(calls, return_exceptions=True)
+
+    # all submitted before any result is waited for
+    assert len(submitted) == 3
+    assert results[0] == 2
+    assert isinstance(results[1], ZeroDivisionError)
+    assert results[2] == 3
+
+    with pytest.raises(ZeroDivisionError):
+        runner.run_functions(calls)
+
+
+def test_run_functions_single_timeout(runner, mocker):
+    mocker.patch('rjm.runners.globus_compute_slurm_runner.GLOBUS_COMPUTE_TIMEOUT', 0.5)
+    mocker.patch.object(runner, 'submit_function', side_effect=lambda *args, **kwargs: concurrent.futures.Future())
+
+    start_time = time.monotonic()
+    results = runner.run_functions([(None, (), {})] * 4, return_exceptions=True)
+
+    # the functions share one timeout rather than waiting for each in turn
+    assert time.monotonic() - start_time < 1.5
+    assert all(isinstance(result, concurrent.futures.TimeoutError) for result in results)
+
+
+def test_get_manifests_fan_out(runner, mocker):
+    mocker.patch('time.sleep')
+    mocker.patch.object(globus_compute_slurm_runner, 'MANIFEST_DIRECTORIES_PER_CALL', 2)
+    jobs_files = {f"dir{i}": ["file"] for i in range(5)}
+
+    def calculate_manifests(group, **kwargs):
+        if "dir2" in group:
+            return 1, "failed"
+        return 0, {d: {"file": {"size": 1, "checksum": d}} for d in group}
+    mocker.patch.object(runner, 'submit_function', side_effect=lambda f, *a, **k: ImmediateFuture(calculate_manifests, *a, **k))
+    mocked_run_function = mocker.patch.object(runner, 'run_function', return_value=(0, {
+        "dir2": {"file": {"size": 1, "checksum": "dir2"}}, "dir3": {"file": {"size": 1, "checksum": "dir3"}},
+    }))
+
+    manifests = runner.get_manifests(jobs_files)
+
+    assert manifests == {d: {"file": {"size": 1, "checksum": d}} for d in jobs_files}
+    # the failed call was run again on its own
+    assert mocked_run_function.call_count == 1
+    assert mocked_run_function.call_args.args[1] == {"dir2": ["file"], "dir3": ["file"]}
+
+
+def test_registered_functions(mocker, tmp_path):
+    cache_file = str(tmp_path / "functions.json")
+    client = mocker.Mock()
+    client.register_function.return_value = "function-id-1"
+    registry = globus_compute_slurm_runner.RegisteredFunctions(cache_file=cache_file)
+
+    key, function_id = registry.get(client, "endpoint", globus_compute_slurm_runner.submit_slurm_job)
+    assert function_id == "function-id-1"
+    assert registry.get(client, "endpoint", globus_compute_slurm_runner.submit_slurm_job) == (key, function_id)
+    assert client.register_function.call_count == 1
+    client.register_function.assert_called_with(globus_compute_slurm_runner.submit_slurm_job)
+
+    # the id is reused by later runs, but not for other endpoints
+    registry = globus_compute_slurm_runner.RegisteredFunctions(cache_file=cache_file)
+    assert registry.get(client, "endpoint", globus_compute_slurm_runner.submit_slurm_job) == (key, function_id)
+    assert client.register_function.call_count == 1
+    registry.get(client, "other-endpoint", globus_compute_slurm_runner.submit_slurm_job)
+    assert client.register_function.call_count == 2
+
+    # a failed task forgets the id
+    failed = concurrent.futures.Future()
+    failed.set_exception(RuntimeError("function not found"))
+    registry.check_result(key, failed)
+    client.register_function.return_value = "function-id-2"
+    assert registry.get(client, "endpoint", globus_compute_slurm_runner.submit_slurm_job) == (key, "function-id-2")
+
+
+def test_submit_registered_function(runner, mocker, tmp_path):
+    runner._registered_functions = globus_compute_slurm_runner.RegisteredFunctions(cache_file=str(tmp_path / "f.json"))
+    runner._client = mocker.Mock()
+    runner._client.register_function.return_value = "function-id"
+    runner._executor = mocker.Mock(spec=["submit", "submit_to_registered_function"])
+
+    runner.submit_function(globus_compute_slurm_runner.check_dir_exists, "/some/dir")
+
+    runner._executor.submit_to_registered_function.assert_called_once_with("function-id", args=("/some/dir",), kwargs={})
+    runner._executor.submit.assert_not_called()
+
+    # falls back to submitting the code if registration is turned off
+    runner._register_functions = False
+    runner.submit_function(globus_compute_slurm_runner.check_dir_exists, "/some/dir")
+    runner._executor.submit.assert_called_once()
+
+
+def test_warm_up(runner, mocker):
+    runner._register_functions = False
+    mocked_submit = mocker.patch.object(runner, 'submit_function', return_value=concurrent.futures.Future())
+
+    runner.warm_up()
+
+    mocked_submit.assert_called_once_with(globus_compute_slurm_runner._warm_up)
+
+    # failures are not fatal, the endpoint is just not warmed up
+    mocked_submit.side_effect = RuntimeError("not set up")
+    runner.warm_up()
+
+
+def test_submit_function_without_source(runner, mocker, tmp_path, caplog):
+    # e.g. in a frozen executable, where the function source can't be read
+    mocked_getsource = mocker.patch('inspect.getsource', side_effect=OSError("could not get source code"))
+    runner._registered_functions = globus_compute_slurm_runner.RegisteredFunctions(cache_file=str(tmp_path / "f.json"))
+    runner._client = mocker.Mock()
+    runner._executor = mocker.Mock(spec=["submit", "submit_to_registered_function"])
+
+    with caplog.at_level(logging.WARNING):
+        runner.submit_function(globus_compute_slurm_runner.check_dir_exists, "/some/dir")
+        runner.submit_function(globus_compute_slurm_runner.check_dir_exists, "/some/dir")
+
+    # submitted with its code, without a warning, and the source is only looked up once
+    assert runner._executor.submit.call_count == 2
+    runner._executor.submit_to_registered_function.assert_not_called()
+    runner._client.register_function.assert_not_called()
+    assert mocked_getsource.call_count == 1
+    assert caplog.records == []
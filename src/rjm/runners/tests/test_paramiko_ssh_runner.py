@@ -0,0 +1,363 @@
+
+import os
+import sys
+import hashlib
+import time
+import signal
+import tarfile
+import subprocess
+import configparser
+
+import pytest
+
+pytest.importorskip("paramiko")
+
+from rjm.runners.paramiko_ssh_runner import ParamikoSSHRunner  # noqa: E402
+
+# tests that run the remote commands in a local POSIX shell
+posix_shell = pytest.mark.skipif(sys.platform == "win32", reason="requires a POSIX shell")
+
+
+class LocalConnection:
+    """Stand-in for the SSH connection manager that runs commands locally"""
+    def __init__(self):
+        self.commands = []
+
+    def run(self, command, replay=True, input=None):
+        self.commands.append(command)
+        p = subprocess.run(command, shell=True, capture_output=True, text=True, input=input)
+        return p.returncode, p.stdout, p.stderr
+
+
+class FakeRemoteJob:
+    def __init__(self, runner):
+        self._runner = runner
+
+    def get_runner(self):
+        return self._runner
+
+
+@pytest.fixture
+def configobj():
+    config = configparser.ConfigParser()
+    config["PARAMIKO"] = {
+        "private_key_file": "key",
+        "remote_address": "host",
+        "remote_user": "user",
+        "job_script": "run.sh",
+    }
+    config["POLLING"] = {
+        "poll_interval": "60",
+        "warmup_poll_interval": "10",
+        "warmup_duration": "10",
+    }
+
+    return config
+
+
+@pytest.fixture
+def connection():
+    return LocalConnection()
+
+
+def make_runner(configobj, connection, session_name=None, working_directory=None):
+    runner = ParamikoSSHRunner(config=configobj)
+    runner._connection = connection
+    runner._tmux_session_name = session_name
+    runner._working_directory = working_directory
+
+    return runner
+
+
+@posix_shell
+def test_check_finished_jobs_single_command(configobj, connection, tmp_path):
+    remote_jobs = []
+    for name in ("succeeded", "failed", "dir with space"):
+        (tmp_path / name).mkdir()
+        remote_jobs.append(FakeRemoteJob(make_runner(configobj, connection, f"rjm-{name}", str(tmp_path / name))))
+    (tmp_path / "succeeded" / ".rjm-succeeded").touch()
+    (tmp_path / "dir with space" / ".rjm-succeeded").touch()
+    runner = make_runner(configobj, connection)
+
+    successful, failed, unfinished = runner.check_finished_jobs(list(remote_jobs))
+
+    assert len(connection.commands) == 1
+    assert successful == [remote_jobs[0], remote_jobs[2]]
+    assert failed == [remote_jobs[1]]
+    assert unfinished == []
+
+
+@posix_shell
+def test_get_job_statuses_many_jobs(configobj, connection, tmp_path):
+    runner = make_runner(configobj, connection)
+    (tmp_path / "done").mkdir()
+    (tmp_path / "done" / ".rjm-exitcode").write_text("0\n")
+    # together the directories are over the 128 KiB limit on a single argument
+    jobs = [(f"rjm-{i}", str(tmp_path / f"{'x' * 80}-{i:04d}")) for i in range(1500)]
+    jobs.append(("rjm-done", str(tmp_path / "done")))
+    assert sum(len(d) for _, d in jobs) > 128 * 1024
+
+    statuses = runner.get_job_statuses(jobs)
+
+    assert len(connection.commands) == 1
+    assert len(connection.commands[0]) < 1000
+    assert statuses["rjm-done"] == "SUCCEEDED"
+    assert statuses["rjm-0"] == statuses["rjm-1499"] == "FAILED"
+
+
+def test_get_job_statuses_live_session(configobj, connection, mocker, tmp_path):
+    runner = make_runner(configobj, connection)
+    mocker.patch.object(connection, 'run', return_value=(0, "S rjm-live\nD /done\n", ""))
+
+    statuses = runner.get_job_statuses([("rjm-live", "/live"), ("rjm-done", "/done"), ("rjm-failed", "/failed")])
+
+    assert statuses == {"rjm-live": "UNFINISHED", "rjm-done": "SUCCEEDED", "rjm-failed": "FAILED"}
+
+
+@posix_shell
+def test_make_remote_directory_single_command(configobj, connection, tmp_path):
+    runner = make_runner(configobj, connection)
+
+    remote_dirs = runner.make_remote_directory(str(tmp_path), ["job1", "job 2"])
+
+    assert len(connection.commands) == 1
+    for (full_path, rel_path), prefix in zip(remote_dirs, ["job1", "job 2"]):
+        assert (tmp_path / rel_path).is_dir()
+        assert full_path == str(tmp_path / rel_path)
+        assert rel_path.startswith(f"{prefix}-")
+
+    # a single prefix returns a single tuple
+    full_path, rel_path = runner.make_remote_directory(str(tmp_path), "job3")
+    assert rel_path.startswith("job3-")
+
+
+@posix_shell
+def test_make_remote_directory_many_jobs(configobj, connection, mocker, tmp_path):
+    mocker.patch('time.sleep')  # fail fast if the command can't be run
+    runner = make_runner(configobj, connection)
+    # together the prefixes are over the 128 KiB limit on a single argument
+    prefixes = [f"{'x' * 80}-{i:04d}" for i in range(2000)]
+
+    remote_dirs = runner.make_remote_directory(str(tmp_path), prefixes)
+
+    assert len(connection.commands) == 1
+    assert len(connection.commands[0]) < 1000
+    assert len(os.listdir(tmp_path)) == 2000
+    for (full_path, rel_path), prefix in zip(remote_dirs, prefixes):
+        assert rel_path.startswith(f"{prefix}-")
+
+
+def test_make_remote_directory_retries_remaining(configobj, connection, mocker):
+    mocker.patch('time.sleep')
+    runner = make_runner(configobj, connection)
+    mocked = mocker.patch.object(connection, 'run', side_effect=[
+        (1, "0\t/base/a-1\n", "mktemp failed"),
+        (0, "1\t/base/b-2\n", ""),
+    ])
+
+    remote_dirs = runner.make_remote_directory("/base", ["a", "b"])
+
+    assert remote_dirs == [("/base/a-1", "a-1"), ("/base/b-2", "b-2")]
+    # only the directory that was not created is retried
+    assert mocked.call_args.kwargs["input"] == "1/b\n"
+
+
+def test_wait_for_slot_command(configobj, connection, mocker, tmp_path):
+    fcntl = pytest.importorskip("fcntl")
+    mocker.patch('rjm.runners.paramiko_ssh_runner.JOB_SLOT_POLL_INTERVAL', 0.1)
+    configobj["PARAMIKO"]["max_concurrent_jobs"] = "1"
+    runner = make_runner(configobj, connection)
+    env = {"HOME": str(tmp_path), "PATH": os.environ["PATH"]}
+    command = runner._wait_for_slot_command() + "echo started"
+
+    # the only slot is taken, so the job waits until it is released
+    (tmp_path / ".rjm-slots").mkdir()
+    with open(tmp_path / ".rjm-slots" / "slot-1", "w") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        p = subprocess.Popen(["sh", "-c", command], env=env, stdout=subprocess.PIPE, text=True)
+        with pytest.raises(subprocess.TimeoutExpired):
+            p.wait(timeout=0.5)
+        fcntl.flock(fh, fcntl.LOCK_UN)
+    assert p.communicate(timeout=5)[0] == "started\n"
+
+
+def test_no_slot_limit(configobj, connection):
+    assert make_runner(configobj, connection)._wait_for_slot_command() == ""
+
+
+@posix_shell
+def test_start_writes_exit_code(configobj, connection, mocker, tmp_path):
+    runner = make_runner(configobj, connection)
+    mocked = mocker.patch.object(runner, 'run_command', return_value="rjm-session")
+    for name, exit_code in (("ok", 0), ("bad", 3)):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "run.sh").write_text(f"exit {exit_code}\n")
+
+        runner.start(str(tmp_path / name))
+        subprocess.run(["sh", "-c", mocked.call_args.args[0]], check=True)
+
+        assert (tmp_path / name / ".rjm-exitcode").read_text() == f"{exit_code}\n"
+    assert (tmp_path / "ok" / ".rjm-succeeded").exists()
+    assert not (tmp_path / "bad" / ".rjm-succeeded").exists()
+
+
+def test_get_job_statuses_exit_code(configobj, connection, mocker):
+    runner = make_runner(configobj, connection)
+    mocker.patch.object(connection, 'run', return_value=(0, "S rjm-ok\nS rjm-bad\nE 0 /ok\nE 1 /bad\n", ""))
+
+    # the exit code file is used even though the tmux sessions have not closed yet
+    statuses = runner.get_job_statuses([("rjm-ok", "/ok"), ("rjm-bad", "/bad")])
+
+    assert statuses == {"rjm-ok": "SUCCEEDED", "rjm-bad": "FAILED"}
+
+
+class LocalChannel:
+    """Stand-in for a paramiko channel running a command locally"""
+    def __init__(self, command):
+        self._process = subprocess.Popen(["sh", "-c", command], stdout=subprocess.PIPE, env={"PATH": "/usr/bin:/bin"})
+
+    def makefile(self, mode):
+        return self._process.stdout
+
+    def close(self):
+        # like the hang up when the pty of a real channel is closed
+        self._process.send_signal(signal.SIGHUP)
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+
+@posix_shell
+def test_wait_for_completion_woken_by_watcher(configobj, connection, mocker, tmp_path):
+    mocker.patch('rjm.runners.paramiko_ssh_runner.WATCHER_SCAN_INTERVAL', 0.1)
+    connection.open_channel = lambda command, get_pty=False: LocalChannel(command)
+    remote_jobs = []
+    for name in ("job1", "job2"):
+        (tmp_path / name).mkdir()
+        remote_jobs.append(FakeRemoteJob(make_runner(configobj, connection, f"rjm-{name}", str(tmp_path / name))))
+    runner = make_runner(configobj, connection)
+
+    # nothing has finished, so the full time is waited
+    start_time = time.monotonic()
+    runner.wait_for_completion(remote_jobs, 0.5)
+    assert time.monotonic() - start_time >= 0.5
+
+    # woken early when a job finishes
+    (tmp_path / "job2" / ".rjm-exitcode").write_text("0\n")
+    start_time = time.monotonic()
+    runner.wait_for_completion(remote_jobs, 30)
+    assert time.monotonic() - start_time < 10
+
+    # the watcher is closed when no jobs are left
+    watcher = runner._watcher
+    mocker.patch.object(connection, 'run', return_value=(0, f"E 0 {tmp_path / 'job1'}\nE 0 {tmp_path / 'job2'}\n", ""))
+    runner.check_finished_jobs(remote_jobs)
+    assert watcher is not None and runner._watcher is None
+
+
+@posix_shell
+def test_watcher_many_jobs(configobj, connection, mocker, tmp_path):
+    mocker.patch('rjm.runners.paramiko_ssh_runner.WATCHER_SCAN_INTERVAL', 0.1)
+    (tmp_path / "tmp").mkdir()
+    mocker.patch.dict(os.environ, {"TMPDIR": str(tmp_path / "tmp")})
+    commands = []
+
+    def open_channel(command, get_pty=False):
+        commands.append(command)
+        return LocalChannel(command)
+    connection.open_channel = open_channel
+    # together the directories are over the 128 KiB limit on a single argument
+    remote_jobs = []
+    for i in range(1500):
+        working_directory = tmp_path / f"{'x' * 80}-{i:04d}"
+        working_directory.mkdir()
+        remote_jobs.append(FakeRemoteJob(make_runner(configobj, connection, f"rjm-{i}", str(working_directory))))
+    (tmp_path / f"{'x' * 80}-1499" / ".rjm-exitcode").write_text("0\n")
+    runner = make_runner(configobj, connection)
+
+    start_time = time.monotonic()
+    runner.wait_for_completion(remote_jobs, 30)
+
+    assert time.monotonic() - start_time < 10
+    assert len(commands[0]) < 1000
+    # the directory list on the remote is removed when the watcher is closed
+    runner._close_watcher()
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+@posix_shell
+def test_watcher_failed_to_start(configobj, connection, mocker, tmp_path, caplog):
+    commands = []
+
+    def open_channel(command, get_pty=False):
+        commands.append(command)
+        return LocalChannel("echo 'sh: Argument list too long'; exit 126")
+    connection.open_channel = open_channel
+    (tmp_path / "job").mkdir()
+    remote_jobs = [FakeRemoteJob(make_runner(configobj, connection, "rjm-job", str(tmp_path / "job")))]
+    runner = make_runner(configobj, connection)
+
+    runner.wait_for_completion(remote_jobs, 0.5)
+    runner.wait_for_completion(remote_jobs, 0.1)
+    runner.wait_for_completion(remote_jobs, 0.1)
+
+    # the failure is logged and the runner polls instead of starting a new watcher every time
+    assert "Argument list too long" in caplog.text
+    assert "polling instead" in caplog.text
+    assert len(commands) == 1
+
+
+@posix_shell
+def test_get_checksums_parallel(configobj, connection, mocker, tmp_path):
+    mocker.patch('rjm.runners.paramiko_ssh_runner.CHECKSUM_COMMAND_MAX_LENGTH', 200)
+    runner = make_runner(configobj, connection)
+    names = [f"file{i}.txt" for i in range(50)] + ["it's.txt", "-dash", "back\\slash", "new\nline", "trailing "]
+    for name in names:
+        (tmp_path / name).write_text(name)
+
+    checksums = runner.get_checksums(str(tmp_path), names + ["missing.txt"])
+
+    assert checksums == {name: hashlib.sha256(name.encode()).hexdigest() for name in names} | {"missing.txt": None}
+    # the file names were split over several commands
+    assert len(connection.commands) > 1
+
+
+def test_join_and_unpack_not_replayed(configobj, connection, mocker):
+    runner = make_runner(configobj, connection)
+    mocked = mocker.patch.object(connection, 'run', return_value=(0, "", ""))
+    mocker.patch.object(runner, 'get_checksums', return_value={})
+
+    # removing the inputs makes these unsafe to run twice after a reconnect
+    runner.join_file_parts("/job", {"big.dat": ["big.dat.part0", "big.dat.part1"]})
+    assert mocked.call_args.kwargs["replay"] is False
+    runner.unpack_bundle("/job", "bundle.tar.gz", ["a.txt"])
+    assert mocked.call_args.kwargs["replay"] is False
+
+    # other commands are replayed
+    runner.run_command("ls")
+    assert mocked.call_args.kwargs["replay"] is True
+
+
+@posix_shell
+def test_bundle_files_single_command(configobj, connection, tmp_path):
+    runner = make_runner(configobj, connection)
+    names = [f"file{i}.txt" for i in range(20)] + ["it's.txt", "-dash", "new\nline", "trailing "]
+    for name in names:
+        (tmp_path / name).write_text(name)
+
+    bundle_name, archive_checksum, checksums = runner.bundle_files(str(tmp_path), names + ["missing.txt"])
+
+    # the names are sent on stdin and the manifest comes from the same command as the archive
+    assert len(connection.commands) == 1
+    assert checksums == {name: hashlib.sha256(name.encode()).hexdigest() for name in names} | {"missing.txt": None}
+    assert archive_checksum == hashlib.sha256((tmp_path / bundle_name).read_bytes()).hexdigest()
+    with tarfile.open(tmp_path / bundle_name) as tar:
+        assert sorted(tar.getnames()) == sorted(names)
+
+    # nothing to bundle still makes an (empty) archive
+    bundle_name, _, checksums = runner.bundle_files(str(tmp_path), ["missing.txt"])
+    assert checksums == {"missing.txt": None}
+    with tarfile.open(tmp_path / bundle_name) as tar:
+        assert tar.getnames() == []
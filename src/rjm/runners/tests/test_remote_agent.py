@@ -0,0 +1,166 @@
+
+import sys
+import hashlib
+import subprocess
+import configparser
+import concurrent.futures
+
+import pytest
+
+pytest.importorskip("paramiko")
+
+from rjm.runners import paramiko_ssh_runner  # noqa: E402
+from rjm.runners.paramiko_ssh_runner import ParamikoSSHRunner, RemoteAgent, AgentUnavailable  # noqa: E402
+from rjm.errors import RemoteJobRunnerError  # noqa: E402
+
+# the agent and its commands are run in a local POSIX shell
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="requires a POSIX shell")
+
+
+class AgentChannel:
+    """Stand-in for a paramiko channel running a command locally"""
+    def __init__(self, command):
+        self._process = subprocess.Popen(f"exec {command}", shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def makefile(self, mode):
+        return self._process.stdout
+
+    def sendall(self, data):
+        self._process.stdin.write(data)
+        self._process.stdin.flush()
+
+    def close(self):
+        self._process.kill()
+        self._process.wait()
+
+
+class AgentConnection:
+    """Stand-in for the SSH connection manager that runs the agent locally"""
+    def __init__(self):
+        self.commands = []
+        self.channels = []
+
+    def open_channel(self, command, get_pty=False):
+        self.channels.append(AgentChannel(command))
+        return self.channels[-1]
+
+    def run(self, command, replay=True, input=None):
+        self.commands.append(command)
+        p = subprocess.run(command, shell=True, capture_output=True, text=True, input=input)
+        return p.returncode, p.stdout, p.stderr
+
+
+@pytest.fixture
+def agent():
+    agent = RemoteAgent(AgentConnection(), python=sys.executable)
+    agent.start()
+    yield agent
+    agent.close()
+
+
+@pytest.fixture
+def configobj():
+    config = configparser.ConfigParser()
+    config["PARAMIKO"] = {
+        "private_key_file": "key",
+        "remote_address": "host",
+        "remote_user": "user",
+        "job_script": "run.sh",
+        "use_agent": "true",
+        "agent_python": sys.executable,
+    }
+    config["POLLING"] = {
+        "poll_interval": "60",
+        "warmup_poll_interval": "10",
+        "warmup_duration": "10",
+    }
+
+    return config
+
+
+def test_agent_calls(agent, tmp_path):
+    (tmp_path / "a.txt").write_bytes(b"aaa")
+    (tmp_path / "b c.txt").write_bytes(b"bc")
+
+    checksums = agent.call("checksums", directory=str(tmp_path), files=["a.txt", "b c.txt", "missing"],
+                           algorithm="sha256")
+
+    assert checksums == {
+        "a.txt": hashlib.sha256(b"aaa").hexdigest(),
+        "b c.txt": hashlib.sha256(b"bc").hexdigest(),
+        "missing": None,
+    }
+    assert agent.call("is_directory", path=str(tmp_path)) is True
+    assert agent.call("run", command="echo out; exit 3") == [3, "out\n", ""]
+    assert agent.call("run", command="cat", input="in\0put") == [0, "in\0put", ""]
+
+    result = agent.call("make_directories", base=str(tmp_path), prefixes=["job1", "job2"])
+    assert result["error"] is None
+    assert [p.split("/")[-1].rsplit("-", 1)[0] for p in result["created"]] == ["job1", "job2"]
+
+
+def test_agent_concurrent_calls(agent):
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda i: agent.call("run", command=f"sleep 0.2; echo {i}"), range(8)))
+
+    assert [stdout for _, stdout, _ in results] == [f"{i}\n" for i in range(8)]
+
+
+def test_agent_errors(agent):
+    with pytest.raises(RemoteJobRunnerError):
+        agent.call("no_such_method")
+
+    # the agent is still running, until its channel is closed
+    assert agent.call("is_directory", path="/no/such/dir") is False
+    agent.close()
+    with pytest.raises(AgentUnavailable):
+        agent.call("is_directory", path="/")
+
+
+def test_runner_uses_agent(configobj, tmp_path):
+    connection = AgentConnection()
+    runner = ParamikoSSHRunner(config=configobj)
+    runner._connection = connection
+    (tmp_path / "job").mkdir()
+    (tmp_path / "job" / "out.txt").write_bytes(b"output")
+    (tmp_path / "job" / ".rjm-exitcode").write_text("0\n")
+
+    checksums = runner.get_checksums(str(tmp_path / "job"), ["out.txt"])
+    statuses = runner.get_job_statuses([("rjm-job", str(tmp_path / "job"))])
+    runner.check_directory_exists(str(tmp_path / "job"))
+    full_path, _ = runner.make_remote_directory(str(tmp_path), "new")
+
+    assert checksums == {"out.txt": hashlib.sha256(b"output").hexdigest()}
+    assert statuses == {"rjm-job": "SUCCEEDED"}
+    assert full_path.startswith(str(tmp_path / "new-"))
+    # one agent and no shell commands
+    assert len(connection.channels) == 1
+    assert connection.commands == []
+
+
+def test_runner_falls_back_to_shell(configobj, tmp_path):
+    configobj["PARAMIKO"]["agent_python"] = "no-such-python"
+    connection = AgentConnection()
+    runner = ParamikoSSHRunner(config=configobj)
+    runner._connection = connection
+    (tmp_path / "out.txt").write_bytes(b"output")
+
+    checksums = runner.get_checksums(str(tmp_path), ["out.txt"])
+    runner.check_directory_exists(str(tmp_path))
+
+    assert checksums == {"out.txt": hashlib.sha256(b"output").hexdigest()}
+    assert len(connection.commands) == 2
+    # the agent is not started again
+    assert paramiko_ssh_runner._agents[connection] is False
+    assert len(connection.channels) == 1
+
+
+def test_agent_source_without_inspect(mocker):
+    # in a frozen executable the agent is read from its packaged data file
+    mocker.patch('inspect.getsource', side_effect=OSError("could not get source code"))
+    agent = RemoteAgent(AgentConnection(), python=sys.executable)
+    agent.start()
+    try:
+        assert agent.call("is_directory", path="/") is True
+    finally:
+        agent.close()
@@ -0,0 +1,304 @@
+
+import time
+import weakref
+import logging
+import threading
+import contextlib
+
+import paramiko
+
+
+SSH_PORT = 22
+SSH_CONNECT_TIMEOUT = 30
+SSH_KEEPALIVE_INTERVAL = 30  # seconds between keepalive packets, 0 to disable
+SSH_MAX_CHANNELS = 8  # open channels per connection, below the default sshd MaxSessions of 10
+SSH_SLOT_WAIT_INTERVAL = 1  # seconds between looking for idle channels to close when no slot is free
+SSH_CHANNEL_RETRY_DELAY = 5  # seconds to wait when the server refuses to open another channel
+SSH_WINDOW_MB = 16  # paramiko's default of 2 MiB limits throughput on high latency links
+SSH_MAX_PACKET_KB = 32
+SSH_CIPHERS = "aes128-gcm@openssh.com,aes256-gcm@openssh.com,aes128-ctr,aes256-ctr"  # cheapest first
+SSH_RECONNECT_EXCEPTIONS = (paramiko.SSHException, EOFError, ConnectionError, TimeoutError)
+
+logger = logging.getLogger(__name__)
+
+# connection managers shared by all the runners and transferers in this process
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(config):
+    """
+    Return the connection manager for the remote in the ``[PARAMIKO]``
+    section of the config, creating it if required. Runners and transferers
+    connecting to the same remote as the same user share one manager.
+
+    """
+    key = (
+        config.get("PARAMIKO", "remote_address"),
+        config.get("PARAMIKO", "remote_user"),
+        config.get("PARAMIKO", "private_key_file"),
+    )
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = SSHConnectionManager(config)
+
+        return _managers[key]
+
+
+class SSHConnectionManager:
+    """
+    Authenticated SSH connections to one remote, multiplexing the channels
+    of the SSH runner and SFTP transferer.
+
+    - connections are opened when first needed and kept alive with keepalive
+      packets
+    - a connection that has dropped is reopened the next time it is used, and
+      commands that failed because of it are replayed
+    - the number of open channels on each connection is bounded, so the
+      server's MaxSessions limit is not hit. This counts idle channels kept
+      open for reuse and long-lived channels as well as the active ones.
+
+    Compression is a property of the connection, so compressed channels use
+    separate connections.
+
+    """
+    def __init__(self, config):
+        self._remote_address = config.get("PARAMIKO", "remote_address")
+        self._remote_user = config.get("PARAMIKO", "remote_user")
+        self._ssh_private_key_file = config.get("PARAMIKO", "private_key_file")
+        self._keepalive_interval = config.getint("PARAMIKO", "keepalive_interval", fallback=SSH_KEEPALIVE_INTERVAL)
+        self._max_channels = config.getint("PARAMIKO", "max_channels", fallback=SSH_MAX_CHANNELS)
+
+        # transport tuning
+        self.window_size = config.getint("PARAMIKO", "sftp_window_mb", fallback=SSH_WINDOW_MB) * 1024 * 1024
+        self.max_packet_size = config.getint("PARAMIKO", "sftp_max_packet_kb", fallback=SSH_MAX_PACKET_KB) * 1024
+        self.ciphers = self._preferred_ciphers(config.get("PARAMIKO", "sftp_ciphers", fallback=SSH_CIPHERS))
+
+        self._private_key = None
+        self._ssh_clients = {}
+        self._lock = threading.Lock()
+        self._slots = {}
+        # pools keeping idle channels open, which are asked to close one when no slot is free
+        self._idle_pools = weakref.WeakSet()
+
+    def __repr__(self):
+        return f"SSHConnectionManager({self._remote_user}@{self._remote_address})"
+
+    def _preferred_ciphers(self, ciphers):
+        """Return the ciphers from the comma separated list that paramiko supports, in order"""
+        requested = [c.strip() for c in ciphers.split(",") if c.strip()]
+        supported = [c for c in requested if c in paramiko.Transport._preferred_ciphers]
+        unsupported = [c for c in requested if c not in supported]
+        if unsupported:
+            logger.warning(f"Ignoring ciphers that are not supported by paramiko: {', '.join(unsupported)}")
+
+        return supported
+
+    def _transport_factory(self, sock, **kwargs):
+        """Create the SSH transport with the tuned window and packet sizes and cipher preferences"""
+        transport = paramiko.Transport(
+            sock,
+            default_window_size=self.window_size,
+            default_max_packet_size=self.max_packet_size,
+            **kwargs,
+        )
+        if self.ciphers:
+            # put the preferred ciphers first, keep the rest as fallbacks
+            security_options = transport.get_security_options()
+            security_options.ciphers = tuple(self.ciphers) + tuple(
+                c for c in security_options.ciphers if c not in self.ciphers)
+
+        return transport
+
+    def _connect(self, compress=False):
+        """Open a new SSH connection to the remote"""
+        if self._private_key is None:
+            logger.debug(f"Loading SSH key from {self._ssh_private_key_file}")
+            self._private_key = paramiko.RSAKey(filename=self._ssh_private_key_file)
+
+        ssh_client = paramiko.SSHClient()
+        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh_client.connect(
+            hostname=self._remote_address,
+            port=SSH_PORT,
+            username=self._remote_user,
+            pkey=self._private_key,
+            timeout=SSH_CONNECT_TIMEOUT,
+            look_for_keys=False,
+            compress=compress,
+            transport_factory=self._transport_factory,
+        )
+        transport = ssh_client.get_transport()
+        if self._keepalive_interval > 0:
+            transport.set_keepalive(self._keepalive_interval)
+        logger.debug(f"Connected to: {self._remote_user}@{self._remote_address} "
+                     f"(cipher {transport.remote_cipher}, compression {compress})")
+
+        return ssh_client
+
+    def ssh_client(self, index=0, compress=False):
+        """
+        Return a connected SSH client, reconnecting if the connection dropped
+
+        :param index: which of the connections to return, when channels are
+            spread over several
+        :param compress: whether to return a compressed connection
+
+        """
+        with self._lock:
+            ssh_client = self._ssh_clients.get((index, compress))
+            transport = None if ssh_client is None else ssh_client.get_transport()
+            if transport is None or not transport.is_active():
+                if ssh_client is not None:
+                    logger.warning(f"SSH connection to {self._remote_address} was lost, reconnecting")
+                    ssh_client.close()
+                ssh_client = self._ssh_clients[(index, compress)] = self._connect(compress=compress)
+
+        return ssh_client
+
+    def _drop(self, index=0, compress=False):
+        """Close a connection that has failed, so the next use reconnects"""
+        with self._lock:
+            ssh_client = self._ssh_clients.pop((index, compress), None)
+        if ssh_client is not None:
+            ssh_client.close()
+
+    def _channel_slots(self, index, compress):
+        """Return the semaphore counting the open channels on a connection"""
+        with self._lock:
+            if (index, compress) not in self._slots:
+                self._slots[(index, compress)] = threading.BoundedSemaphore(max(1, self._max_channels))
+
+            return self._slots[(index, compress)]
+
+    def add_idle_pool(self, pool):
+        """
+        Register a pool that keeps idle channels open. When no slot is free,
+        the pool's ``reclaim_idle(index, compress)`` method is called to close
+        one of its idle channels on that connection.
+
+        """
+        self._idle_pools.add(pool)
+
+    def acquire_channel_slot(self, index=0, compress=False):
+        """
+        Wait until another channel can be opened on a connection. The slot is
+        held for as long as the channel is open, idle or not, and must be given
+        back with :meth:`release_channel_slot` once the channel is closed.
+
+        """
+        slots = self._channel_slots(index, compress)
+        while not slots.acquire(blocking=False):
+            # make room by closing an idle channel, otherwise wait for one to be closed
+            if not any(pool.reclaim_idle(index, compress) for pool in list(self._idle_pools)):
+                if slots.acquire(timeout=SSH_SLOT_WAIT_INTERVAL):
+                    return
+
+    def release_channel_slot(self, index=0, compress=False):
+        """Give back the slot of a channel that has been closed"""
+        self._channel_slots(index, compress).release()
+
+    @contextlib.contextmanager
+    def channel_slot(self, index=0, compress=False):
+        """Context manager that holds a slot while a short-lived channel is open"""
+        self.acquire_channel_slot(index, compress)
+        try:
+            yield
+        finally:
+            self.release_channel_slot(index, compress)
+
+    def run(self, command, replay=True, input=None):
+        """
+        Run a command on the remote.
+
+        If the connection fails before the command was sent, it is reopened
+        and the command is sent again. If it fails after the command was sent,
+        the command is only replayed if `replay` is True (i.e. it is safe to
+        run twice).
+
+        :param input: optional, text to send to the command's stdin (sent
+            before any output is read, so the command should read all of it
+            before writing much output)
+
+        :returns: tuple of the exit code, stdout and stderr
+
+        """
+        for attempt in range(2):
+            sent = False
+            try:
+                with self.channel_slot():
+                    channel = self.ssh_client().get_transport().open_session(timeout=SSH_CONNECT_TIMEOUT)
+                    with channel:
+                        # from here the command may have reached the remote
+                        sent = True
+                        channel.exec_command(command)
+                        if input is not None:
+                            channel.sendall(input.encode())
+                            channel.shutdown_write()
+                        stdout = channel.makefile("rb").read()
+                        stderr = channel.makefile_stderr("rb").read()
+                        exit_code = channel.recv_exit_status()
+
+                return exit_code, stdout.decode(), stderr.decode()
+
+            except paramiko.ChannelException as exc:
+                # the server refused another channel, but the connection and
+                # the other channels on it are fine, so it is not dropped
+                if attempt > 0 or sent:
+                    raise
+                logger.warning(f"SSH server refused to open a channel, trying again: {exc}")
+                time.sleep(SSH_CHANNEL_RETRY_DELAY)
+
+            except SSH_RECONNECT_EXCEPTIONS as exc:
+                if attempt > 0 or (sent and not replay):
+                    raise
+                logger.warning(f"SSH connection failed, reconnecting to run command again: {exc}")
+                self._drop()
+
+    def open_channel(self, command, get_pty=False):
+        """
+        Start a long-running command on the remote and return its channel,
+        for streaming the output. The channel holds a slot until it is closed
+        by the caller.
+
+        :param get_pty: request a pseudo-terminal, so the command is hung up
+            when the channel is closed
+
+        """
+        self.acquire_channel_slot()
+        try:
+            channel = self.ssh_client().get_transport().open_session(timeout=SSH_CONNECT_TIMEOUT)
+            if get_pty:
+                channel.get_pty()
+            channel.exec_command(command)
+        except BaseException:
+            self.release_channel_slot()
+            raise
+
+        return SlotChannel(channel, self.release_channel_slot)
+
+    def close(self):
+        """Close all connections"""
+        with self._lock:
+            ssh_clients = list(self._ssh_clients.values())
+            self._ssh_clients.clear()
+        for ssh_client in ssh_clients:
+            ssh_client.close()
+
+
+class SlotChannel:
+    """Channel that gives back its slot in the connection manager when it is closed"""
+    def __init__(self, channel, release):
+        self._channel = channel
+        self._release = release
+        self._release_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+    def close(self):
+        self._channel.close()
+        with self._release_lock:
+            release, self._release = self._release, None
+        if release is not None:
+            release()
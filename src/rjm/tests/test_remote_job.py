@@ -6,7 +6,7 @@ import json
 import pytest
 
 from rjm.remote_job import RemoteJob
-from rjm.errors import RemoteJobRunnerError
+from rjm.errors import RemoteJobRunnerError, RemoteJobTransfererError
 
 
 @pytest.fixture
@@ -119,6 +119,165 @@ def test_run_wait_restarts_succeed(rj, mocker):
     assert rj._run_succeeded is True
 
 
+def test_upload_files_verify_reuploads_mismatched(rj, tmpdir, mocker):
+    rj._local_path = str(tmpdir)
+    rj._remote_full_path = "/remote/path"
+    rj._upload_files = [str(tmpdir / "file1"), str(tmpdir / "file2")]
+    mocker.patch.object(rj, '_read_uploads_file')
+    mocker.patch.object(rj, '_save_state')
+    mocked_upload = mocker.patch.object(
+        rj._transfer,
+        'upload_files',
+        side_effect=[
+            {"file1": "abc", "file2": "def"},
+            {"file2": "def"},
+        ],
+    )
+    mocked_checksums = mocker.patch.object(
+        rj._runner,
+        'get_checksums',
+        side_effect=[
+            {"file1": "abc", "file2": "corrupted"},
+            {"file2": "def"},
+        ],
+    )
+
+    rj.upload_files()
+
+    assert rj.files_uploaded() is True
+    assert mocked_checksums.call_count == 2
+    assert mocked_upload.call_count == 2
+    mocked_upload.assert_called_with([str(tmpdir / "file2")])
+    mocked_checksums.assert_called_with("/remote/path", ["file2"])
+
+
+def test_upload_files_verify_fail(rj, tmpdir, mocker):
+    rj._local_path = str(tmpdir)
+    rj._remote_full_path = "/remote/path"
+    rj._upload_files = [str(tmpdir / "file1")]
+    mocker.patch.object(rj, '_read_uploads_file')
+    mocker.patch.object(rj, '_save_state')
+    mocked_upload = mocker.patch.object(rj._transfer, 'upload_files', return_value={"file1": "abc"})
+    mocker.patch.object(rj._runner, 'get_checksums', return_value={"file1": None})
+
+    with pytest.raises(RemoteJobTransfererError):
+        rj.upload_files()
+
+    assert rj.files_uploaded() is False
+    assert mocked_upload.call_count == 3
+
+
+def test_upload_files_joins_parts(rj, tmpdir, mocker):
+    rj._local_path = str(tmpdir)
+    rj._remote_full_path = "/remote/path"
+    rj._upload_files = [str(tmpdir / "file1"), str(tmpdir / "bigfile")]
+    mocker.patch.object(rj, '_read_uploads_file')
+    mocker.patch.object(rj, '_save_state')
+    mocker.patch.object(rj._transfer, 'upload_files', return_value={"file1": "abc", "bigfile": "def"})
+    mocker.patch.object(rj._transfer, 'pop_file_parts', return_value={"bigfile": ["part0", "part1"]})
+    mocked_join = mocker.patch.object(rj._runner, 'join_file_parts', return_value={"bigfile": "def"})
+    mocked_checksums = mocker.patch.object(rj._runner, 'get_checksums', return_value={"file1": "abc"})
+
+    rj.upload_files()
+
+    assert rj.files_uploaded() is True
+    mocked_join.assert_called_once_with("/remote/path", {"bigfile": ["part0", "part1"]})
+    # the joined file is not checksummed again
+    mocked_checksums.assert_called_once_with("/remote/path", ["file1"])
+
+
+def test_upload_files_failed_discards_parts(rj, tmpdir, mocker):
+    rj._remote_full_path = "/remote/path"
+    rj._upload_files = [str(tmpdir / "bigfile")]
+    mocker.patch.object(rj, '_read_uploads_file')
+    mocker.patch.object(rj._transfer, 'upload_files', side_effect=RemoteJobTransfererError("part failed"))
+    mocker.patch.object(rj._transfer, 'pop_file_parts', return_value={"bigfile": ["part0", "part1"]})
+    mocked_join = mocker.patch.object(rj._runner, 'join_file_parts', return_value={})
+
+    with pytest.raises(RemoteJobTransfererError):
+        rj.upload_files()
+
+    # the parts that did arrive are removed rather than joined
+    mocked_join.assert_called_once_with("/remote/path", {}, discard={"bigfile": ["part0", "part1"]})
+
+
+def test_download_files_with_manifest(rj, mocker):
+    rj._run_started = True
+    rj._run_succeeded = True
+    rj._remote_full_path = "/remote/path"
+    mocker.patch.object(rj, '_read_downloads_file')
+    mocker.patch.object(rj, '_save_state')
+    rj._download_files = ["file1", "file2"]
+    mocked_checksums = mocker.patch.object(rj._runner, 'get_checksums')
+    mocked_download = mocker.patch.object(rj._transfer, 'download_files')
+
+    rj.download_files(manifest={"file1": {"size": 3, "checksum": "abc"}, "file2": None})
+
+    assert mocked_checksums.call_count == 0
+    mocked_download.assert_called_once_with(
+        ["file1", "file2"],
+        {"file1": "abc", "file2": None},
+        remote_files={"file1": {"size": 3, "checksum": "abc"}},
+    )
+    assert rj.files_downloaded() is True
+
+
+def test_upload_files_planned(configobj, tmpdir, mocker):
+    configobj["FILES"]["plan_transfers"] = "true"
+    mocker.patch('rjm.config.load_config', return_value=configobj)
+    rj = RemoteJob()
+    rj._remote_full_path = "/remote/path"
+    rj._upload_files = []
+    for name, size in (("small1", 10), ("small2", 10), ("large", 2 * 1024 * 1024)):
+        tmpdir.join(name).write(b"x" * size, mode="wb")
+        rj._upload_files.append(str(tmpdir / name))
+    mocker.patch.object(rj, '_read_uploads_file')
+    mocker.patch.object(rj, '_save_state')
+    mocked_upload = mocker.patch.object(rj._transfer, 'upload_files', return_value={"large": "c"})
+    mocked_bundle = mocker.patch.object(rj._transfer, 'upload_bundle',
+                                        return_value=(".bundle", {"small1": "a", "small2": "b"}))
+    mocked_unpack = mocker.patch.object(rj._runner, 'unpack_bundle', return_value={"small1": "a", "small2": "b"})
+    mocker.patch.object(rj._runner, 'get_checksums', return_value={"large": "c"})
+
+    rj.upload_files()
+
+    assert rj.files_uploaded() is True
+    mocked_upload.assert_called_once_with([str(tmpdir / "large")])
+    mocked_bundle.assert_called_once_with([str(tmpdir / "small1"), str(tmpdir / "small2")])
+    mocked_unpack.assert_called_once_with("/remote/path", ".bundle", ["small1", "small2"])
+
+
+def test_download_files_planned(configobj, mocker):
+    configobj["FILES"]["plan_transfers"] = "true"
+    mocker.patch('rjm.config.load_config', return_value=configobj)
+    rj = RemoteJob()
+    rj._run_started = True
+    rj._run_succeeded = True
+    rj._remote_full_path = "/remote/path"
+    mocker.patch.object(rj, '_read_downloads_file')
+    mocker.patch.object(rj, '_save_state')
+    rj._download_files = ["inline", "small1", "small2", "large", "missing"]
+    manifest = {
+        "inline": {"size": 1, "checksum": "a", "content": "eA=="},
+        "small1": {"size": 100 * 1024, "checksum": "b"},
+        "small2": {"size": 100 * 1024, "checksum": "c"},
+        "large": {"size": 10 * 1024 * 1024, "checksum": "d"},
+        "missing": None,
+    }
+    mocked_inline = mocker.patch.object(rj._transfer, 'write_inline_files')
+    mocked_bundle = mocker.patch.object(rj._runner, 'bundle_files', return_value=(".bundle", "e", {}))
+    mocked_download_bundle = mocker.patch.object(rj._transfer, 'download_bundle')
+    mocked_download = mocker.patch.object(rj._transfer, 'download_files')
+
+    rj.download_files(manifest=manifest)
+
+    mocked_inline.assert_called_once_with({"inline": manifest["inline"]})
+    mocked_bundle.assert_called_once_with("/remote/path", ["small1", "small2"])
+    mocked_download_bundle.assert_called_once_with(".bundle", "e", {})
+    assert mocked_download.call_args.args == (["large", "missing"], {"large": "d", "missing": None})
+    assert rj.files_downloaded() is True
+
+
 def test_save_state(rj, tmpdir, mocker):
     rj._local_path = tmpdir
     rj._state_file = tmpdir / "test_state.json"
@@ -2,6 +2,7 @@
 import os
 import configparser
 import time
+import threading
 
 import pytest
 
@@ -206,3 +207,94 @@ def test_calc_wait_time(input_vals, current_time, expected_val, mocker):
     wait_time = remote_job_batch._calc_wait_time(input_vals[0], input_vals[1], input_vals[2], input_vals[3])
 
     assert wait_time == expected_val
+
+
+def test_get_manifests(rjb, mocker):
+    rjs = []
+    for i in range(3):
+        rj = RemoteJob()
+        mocker.patch.object(rj, 'get_remote_directory', return_value=f"/remote/dir{i}")
+        mocker.patch.object(rj, 'get_download_files', return_value=[f"file{i}"])
+        rjs.append(rj)
+    rjs[2]._compress_downloads = True  # gets its manifest when bundling instead
+    mocked_manifests = mocker.patch.object(
+        rjb._runner,
+        'get_manifests',
+        return_value={
+            "/remote/dir0": {"file0": {"size": 1, "checksum": "abc"}},
+            "/remote/dir1": {"file1": None},
+        },
+    )
+
+    manifests = rjb._get_manifests(rjs)
+
+    mocked_manifests.assert_called_once_with({"/remote/dir0": ["file0"], "/remote/dir1": ["file1"]})
+    assert manifests == {
+        rjs[0]: {"file0": {"size": 1, "checksum": "abc"}},
+        rjs[1]: {"file1": None},
+    }
+
+
+def test_get_manifests_failed(rjb, mocker):
+    rj = RemoteJob()
+    mocker.patch.object(rj, 'get_remote_directory', return_value="/remote/dir")
+    mocker.patch.object(rj, 'get_download_files', return_value=["file"])
+    mocker.patch.object(rjb._runner, 'get_manifests', side_effect=RuntimeError("failed"))
+
+    # jobs fall back to calculating their own checksums
+    assert rjb._get_manifests([rj]) == {}
+
+
+def test_get_manifests_not_batched(rjb, mocker):
+    rj = RemoteJob()
+    mocker.patch.object(rj, 'get_download_files', return_value=["file"])
+    mocker.patch.object(rjb._runner, 'BATCH_MANIFESTS', False)
+    mocked_manifests = mocker.patch.object(rjb._runner, 'get_manifests')
+
+    # each job gets its own checksums in its download thread instead
+    assert rjb._get_manifests([rj]) == {}
+    mocked_manifests.assert_not_called()
+
+
+def test_setup_in_background(rjb, mocker, tmp_path):
+    local_dirs = []
+    for i in range(3):
+        local_dir = tmp_path / f"job{i}"
+        local_dir.mkdir()
+        (local_dir / "uploads.txt").write_text("")
+        (local_dir / "downloads.txt").write_text("")
+        local_dirs.append(str(local_dir))
+    localdirsfile = tmp_path / "localdirs.txt"
+    localdirsfile.write_text(os.linesep.join(local_dirs) + os.linesep)
+
+    # the auth is done on this thread, before the jobs are loaded
+    auth_threads = []
+    mocked_globus_auth = mocker.patch('rjm.utils.handle_globus_auth',
+                                      side_effect=lambda scopes: auth_threads.append(threading.current_thread()))
+    mocker.patch('rjm.runners.globus_compute_slurm_runner.GlobusComputeSlurmRunner.get_globus_scopes', return_value=["scope"])
+
+    # the runner setup waits until the jobs have been loaded, so this fails if they were not loaded alongside it
+    jobs_loaded = threading.Event()
+    original_setup = RemoteJob.setup
+
+    def setup_job(rj, *args, **kwargs):
+        original_setup(rj, *args, **kwargs)
+        if len(rjb._remote_jobs) == 3:
+            jobs_loaded.set()
+
+    def setup_runner(*args, **kwargs):
+        assert jobs_loaded.wait(timeout=10)
+    mocker.patch.object(RemoteJob, 'setup', autospec=True, side_effect=setup_job)
+    mocker.patch('rjm.runners.globus_compute_slurm_runner.GlobusComputeSlurmRunner.setup_globus_auth', side_effect=setup_runner)
+    mocker.patch('rjm.transferers.globus_https_transferer.GlobusHttpsTransferer.setup_globus_auth')
+    mocked_warm_up = mocker.patch('rjm.runners.globus_compute_slurm_runner.GlobusComputeSlurmRunner.warm_up')
+    mocked_auth = mocker.patch.object(RemoteJob, 'do_globus_auth')
+
+    rjb.setup(str(localdirsfile))
+
+    mocked_globus_auth.assert_called_once()
+    assert auth_threads == [threading.current_thread()]
+    mocked_warm_up.assert_called_once()
+    # every job is set up from the batch runner and transferer once those are ready
+    assert mocked_auth.call_count == 3
+    assert mocked_auth.call_args.kwargs == {"runner": rjb._runner, "transfer": rjb._transfer}
@@ -0,0 +1,199 @@
+
+import socket
+import configparser
+
+import pytest
+
+paramiko = pytest.importorskip("paramiko")
+
+from rjm import ssh_connection  # noqa: E402
+
+
+class FakeChannel:
+    def __init__(self, transport):
+        self._transport = transport
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def exec_command(self, command):
+        self._transport.commands.append(command)
+        if self._transport.fail_after_send:
+            raise EOFError("connection dropped")
+
+    def sendall(self, data):
+        self._transport.stdin.append(data)
+
+    def shutdown_write(self):
+        self._transport.stdin.append(None)
+
+    def makefile(self, mode):
+        return FakeFile(b"output")
+
+    def makefile_stderr(self, mode):
+        return FakeFile(b"")
+
+    def recv_exit_status(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+class FakeFile:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class FakeTransport:
+    def __init__(self, fail_open=False, fail_after_send=False):
+        self.fail_open = fail_open
+        self.fail_after_send = fail_after_send
+        self.commands = []
+        self.stdin = []
+
+    def is_active(self):
+        return True
+
+    def open_session(self, timeout=None):
+        if self.fail_open:
+            raise paramiko.SSHException("connection dropped")
+        return FakeChannel(self)
+
+
+class FakeSshClient:
+    def __init__(self, transport):
+        self._transport = transport
+        self.closed = False
+
+    def get_transport(self):
+        return self._transport
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def configobj():
+    config = configparser.ConfigParser()
+    config["PARAMIKO"] = {
+        "private_key_file": "key",
+        "remote_address": "host",
+        "remote_user": "user",
+    }
+
+    return config
+
+
+def make_manager(configobj, mocker, transports):
+    manager = ssh_connection.SSHConnectionManager(configobj)
+    mocker.patch.object(manager, '_connect', side_effect=[FakeSshClient(t) for t in transports])
+
+    return manager
+
+
+def test_manager_shared(configobj):
+    manager = ssh_connection.get_connection_manager(configobj)
+    assert ssh_connection.get_connection_manager(configobj) is manager
+
+    other = configparser.ConfigParser()
+    other.read_dict(configobj)
+    other["PARAMIKO"]["remote_user"] = "someone_else"
+    assert ssh_connection.get_connection_manager(other) is not manager
+
+
+def test_transport_options(configobj):
+    configobj["PARAMIKO"]["sftp_ciphers"] = "chacha20-poly1305@openssh.com,aes256-gcm@openssh.com"
+    configobj["PARAMIKO"]["sftp_window_mb"] = "4"
+    manager = ssh_connection.SSHConnectionManager(configobj)
+
+    # unsupported ciphers are dropped, the rest are preferred in order
+    assert manager.ciphers == ["aes256-gcm@openssh.com"]
+    sock, other = socket.socketpair()
+    with sock, other:
+        transport = manager._transport_factory(sock)
+        assert transport.get_security_options().ciphers[0] == "aes256-gcm@openssh.com"
+        assert transport.default_window_size == 4 * 1024 * 1024
+
+
+def test_run_reconnects_before_send(configobj, mocker):
+    manager = make_manager(configobj, mocker, [FakeTransport(fail_open=True), FakeTransport()])
+
+    assert manager.run("tmux new-session", replay=False) == (0, "output", "")
+
+
+def test_run_input(configobj, mocker):
+    transport = FakeTransport()
+    manager = make_manager(configobj, mocker, [transport])
+
+    assert manager.run("tar -T -", input="a\0b\0") == (0, "output", "")
+    # the input is sent and then stdin is closed, so the command sees EOF
+    assert transport.stdin == [b"a\0b\0", None]
+
+
+def test_run_replay_after_send(configobj, mocker):
+    first, second = FakeTransport(fail_after_send=True), FakeTransport()
+    manager = make_manager(configobj, mocker, [first, second])
+    assert manager.run("ls") == (0, "output", "")
+    assert first.commands == second.commands == ["ls"]
+
+    # commands that are not safe to replay are not sent again
+    manager = make_manager(configobj, mocker, [FakeTransport(fail_after_send=True), FakeTransport()])
+    with pytest.raises(EOFError):
+        manager.run("tmux new-session", replay=False)
+
+
+def test_run_channel_refused_keeps_connection(configobj, mocker):
+    mocker.patch('time.sleep')
+    transport = FakeTransport()
+    manager = make_manager(configobj, mocker, [transport])
+    mocker.patch.object(transport, 'open_session', side_effect=[
+        paramiko.ChannelException(1, "administratively prohibited"),
+        FakeChannel(transport),
+    ])
+
+    # the command is sent again on the same connection
+    assert manager.run("ls") == (0, "output", "")
+    assert manager._connect.call_count == 1
+
+
+class FakeIdlePool:
+    def __init__(self, manager, idle):
+        self._manager = manager
+        self.idle = idle
+        manager.add_idle_pool(self)
+
+    def reclaim_idle(self, index, compress):
+        if not self.idle:
+            return False
+        self.idle -= 1
+        self._manager.release_channel_slot(index, compress)
+        return True
+
+
+def test_channel_slots_count_open_channels(configobj, mocker):
+    configobj["PARAMIKO"]["max_channels"] = "3"
+    manager = make_manager(configobj, mocker, [FakeTransport()])
+
+    # a long-lived channel and two idle channels fill the connection
+    channel = manager.open_channel("watch")
+    pool = FakeIdlePool(manager, idle=2)
+    for _ in range(2):
+        manager.acquire_channel_slot()
+
+    # an idle channel is closed to make room for the command
+    assert manager.run("ls") == (0, "output", "")
+    assert pool.idle == 1
+
+    # closing the long-lived channel gives back its slot, once
+    channel.close()
+    channel.close()
+    slots = manager._channel_slots(0, False)
+    assert slots.acquire(blocking=False) and slots.acquire(blocking=False)
+    assert not slots.acquire(blocking=False)
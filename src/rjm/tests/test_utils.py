@@ -6,6 +6,7 @@ import configparser
 import pytest
 
 from rjm import utils
+from rjm.errors import RemoteJobConfigError
 
 
 def test_backup(tmp_path):
@@ -45,3 +46,25 @@ def test_get_retry_values_from_config(config_vals, expected_vals):
     assert t == expected_vals[0]
     assert b == expected_vals[1]
     assert d == expected_vals[2]
+
+
+@pytest.mark.parametrize("algorithm", ["sha256", "blake2b"])
+def test_get_checksum_algorithm_from_config(algorithm):
+    config = configparser.ConfigParser()
+    config["FILES"] = {
+        "checksum_algorithm": algorithm,
+    }
+
+    assert utils.get_checksum_algorithm_from_config(config) == algorithm
+    assert utils.new_checksum(algorithm).name == algorithm
+
+
+def test_get_checksum_algorithm_from_config_defaults():
+    config = configparser.ConfigParser()
+    assert utils.get_checksum_algorithm_from_config(config) == utils.DEFAULT_CHECKSUM_ALGORITHM
+
+    config["FILES"] = {
+        "checksum_algorithm": "md5",
+    }
+    with pytest.raises(RemoteJobConfigError):
+        utils.get_checksum_algorithm_from_config(config)
@@ -0,0 +1,413 @@
+
+import os
+import time
+import asyncio
+import logging
+import platform
+import threading
+
+import httpx
+
+from rjm.transferers.globus_https_transferer import (
+    GlobusHttpsTransferer,
+    DOWNLOAD_CHUNK_SIZE,
+    DOWNLOAD_SUFFIX,
+    REQUESTS_TIMEOUT,
+)
+from rjm.transferers.transferer_base import FILE_CHUNK_SIZE
+from rjm.transferers import local_io
+from rjm.errors import RemoteJobTransfererError
+
+try:
+    import h2  # noqa: F401
+except ImportError:
+    HTTP2_AVAILABLE = False
+else:
+    HTTP2_AVAILABLE = True
+
+
+ASYNC_MAX_STREAMS = 200  # maximum number of files being transferred at the same time
+
+logger = logging.getLogger(__name__)
+
+
+def _read_chunk(f, size, checksum=None):
+    """Read a chunk of the file, adding it to the checksum (run off the event loop)"""
+    chunk = f.read(size)
+    if checksum is not None:
+        checksum.update(chunk)
+
+    return chunk
+
+
+def _write_chunk(f, chunk, checksum=None):
+    """Write a chunk to the file, adding it to the checksum (run off the event loop)"""
+    f.write(chunk)
+    if checksum is not None:
+        checksum.update(chunk)
+
+
+class GlobusHttpsAsyncTransferer(GlobusHttpsTransferer):
+    """
+    Upload and download files to a remote Globus endpoint (guest collection)
+    using HTTPS, with all of the transfers running as coroutines on an event
+    loop owned by the transferer.
+
+    This allows many more files to be in flight at once than the thread based
+    :class:`GlobusHttpsTransferer`, which helps with jobs that have many small
+    files. Connections are pooled and HTTP/2 is used if the `h2` package is
+    installed and the server supports it. File reads, writes and checksums
+    run in worker threads, so they don't hold up the other transfers on the
+    loop.
+
+    """
+    def __init__(self, config=None):
+        super(GlobusHttpsAsyncTransferer, self).__init__(config=config)
+
+        # maximum number of concurrent transfers
+        self._max_streams = self._config.getint("GLOBUS_TRANSFER", "max_streams", fallback=ASYNC_MAX_STREAMS)
+        self._async_client = None
+        self._owns_async_client = False
+
+    def setup_globus_auth(self, globus_cli, transfer=None):
+        """Setting up Globus authentication."""
+        super(GlobusHttpsAsyncTransferer, self).setup_globus_auth(globus_cli, transfer=transfer)
+
+        # share the event loop and connections of the passed in transferer
+        if transfer is not None and hasattr(transfer, "get_async_client"):
+            self._async_client = transfer.get_async_client()
+
+    def get_async_client(self):
+        """Return the event loop and HTTP client, creating them if required"""
+        if self._async_client is None:
+            self._async_client = AsyncHttpClient(self._pool_size, self._max_streams)
+            self._owns_async_client = True
+
+        return self._async_client
+
+    def close(self):
+        """Close the event loop and HTTP client, if this transferer created them"""
+        if self._owns_async_client:
+            self._async_client.close()
+            self._async_client = None
+            self._owns_async_client = False
+
+    async def _retry_async(self, func, *args):
+        """
+        Await the given coroutine function, retrying using the same settings
+        as :func:`retry.api.retry_call`.
+
+        """
+        tries, delay = self._retry_tries, self._retry_delay
+        while tries:
+            try:
+                return await func(*args)
+            except Exception as exc:
+                tries -= 1
+                if not tries:
+                    raise
+
+                self._log(logging.WARNING, f"{exc}, retrying in {delay} seconds...")
+                await asyncio.sleep(delay)
+                delay *= self._retry_backoff
+                if self._retry_max_delay is not None:
+                    delay = min(delay, self._retry_max_delay)
+
+    def _upload_files_concurrently(self, filenames: list[str]):
+        """
+        Upload the files as coroutines on the event loop.
+
+        :returns: tuple containing a dictionary of checksums of the uploaded
+            files and a list of error messages
+
+        """
+        return self.get_async_client().run(self._upload_files_async(filenames))
+
+    async def _upload_files_async(self, filenames: list[str]):
+        """Upload the files concurrently, returning checksums and errors"""
+        coros = []
+        for fname in filenames:
+            size = os.path.getsize(fname)
+            if self._use_chunked_upload(size):
+                coros.append(self._upload_file_in_parts_async(fname, size))
+            else:
+                coros.append(self._retry_async(self._upload_file_async, fname))
+        results = await asyncio.gather(*coros, return_exceptions=True)
+
+        errors = []
+        checksums = {}
+        for fname, result in zip(filenames, results):
+            if isinstance(result, Exception):
+                msg = f"Failed to upload '{fname}': {result}"
+                self._log(logging.ERROR, msg)
+                errors.append(msg)
+            else:
+                checksums[os.path.basename(fname)] = result
+
+        return checksums, errors
+
+    async def _upload_file_async(self, filename: str):
+        """
+        Upload file to remote.
+
+        :param filename: File to be uploaded
+
+        :returns: the checksum of the uploaded data
+
+        """
+        upload_url = self._url_for_file(os.path.basename(filename))
+        headers = dict(self._https_headers)
+        headers["Content-Length"] = str(os.path.getsize(filename))
+        checksum = self._new_checksum()
+        rate_limiter = self.get_rate_limiter()
+
+        async with self._async_client.stream_slot():
+            start_time = time.perf_counter()
+            with open(filename, 'rb') as f:
+                async def body():
+                    # calculate the checksum as the file is streamed out
+                    while chunk := await asyncio.to_thread(_read_chunk, f, FILE_CHUNK_SIZE, checksum):
+                        await rate_limiter.throttle_async("upload", len(chunk))
+                        yield chunk
+
+                r = await self._async_client.client.put(upload_url, content=body(), headers=headers,
+                                                        timeout=REQUESTS_TIMEOUT)
+                r.raise_for_status()
+            upload_time = time.perf_counter() - start_time
+
+        self.log_transfer_time("Uploaded", filename, upload_time)
+
+        return checksum.hexdigest()
+
+    async def _upload_file_in_parts_async(self, filename: str, size: int):
+        """
+        Upload a large file in parts, retrying each part separately.
+
+        :returns: the checksum of the whole file
+
+        """
+        parts = self._file_parts_for_upload(filename, size)
+        self._log(logging.DEBUG, f"Uploading {filename} in {len(parts)} parts")
+
+        # the parts are read out of order, so checksum the whole file separately (off the event loop)
+        checksum_task = asyncio.ensure_future(asyncio.to_thread(self._calculate_checksum, filename))
+        results = await asyncio.gather(
+            *(self._retry_async(self._upload_file_part_async, filename, *part) for part in parts),
+            return_exceptions=True,
+        )
+        checksum = await checksum_task
+
+        # recorded even if some parts failed, so the parts that did arrive can be removed
+        self._file_parts[os.path.basename(filename)] = [part_name for part_name, _, _ in parts]
+        failed = [result for result in results if isinstance(result, Exception)]
+        if failed:
+            raise RemoteJobTransfererError(f"Failed to upload {len(failed)} of {len(parts)} parts: {failed[0]}")
+
+        return checksum
+
+    async def _upload_file_part_async(self, filename: str, part_name: str, offset: int, length: int):
+        """Upload part of a file to a temporary remote file"""
+        upload_url = self._url_for_file(part_name)
+        headers = dict(self._https_headers)
+        headers["Content-Length"] = str(length)
+        rate_limiter = self.get_rate_limiter()
+
+        async with self._async_client.stream_slot():
+            with open(filename, 'rb') as f:
+                f.seek(offset)
+
+                async def body():
+                    remaining = length
+                    while remaining and (chunk := await asyncio.to_thread(_read_chunk, f, min(FILE_CHUNK_SIZE, remaining))):
+                        await rate_limiter.throttle_async("upload", len(chunk))
+                        remaining -= len(chunk)
+                        yield chunk
+
+                r = await self._async_client.client.put(upload_url, content=body(), headers=headers,
+                                                        timeout=REQUESTS_TIMEOUT)
+                r.raise_for_status()
+
+    def _download_files_concurrently(self, filenames: list[str], checksums: dict, retries: bool, sizes: dict):
+        """
+        Download the files to temporary files as coroutines on the event loop.
+        Files whose size is known to be above the threshold are downloaded in
+        parallel byte ranges.
+
+        :returns: tuple containing the list of temporary files that were
+            downloaded and the number of files that failed
+
+        """
+        return self.get_async_client().run(self._download_files_async(filenames, checksums, retries, sizes))
+
+    async def _download_files_async(self, filenames: list[str], checksums: dict, retries: bool, sizes: dict):
+        """Download the files concurrently, returning temporary files and number of errors"""
+        coros = []
+        for fname in filenames:
+            if self._use_ranged_download(sizes.get(fname)):
+                coros.append(self._download_file_ranged_async(fname, checksums[fname], sizes[fname], retries))
+            elif retries:
+                coros.append(self._retry_async(self._download_file_async, fname, checksums[fname]))
+            else:
+                coros.append(self._download_file_async(fname, checksums[fname]))
+        self._log(logging.DEBUG, f"Waiting for {len(filenames)} files to be downloaded")
+        results = await asyncio.gather(*coros, return_exceptions=True)
+
+        downloaded_tmp_files = []
+        errors = 0
+        for fname, result in zip(filenames, results):
+            if isinstance(result, Exception):
+                self._log(logging.ERROR, f"Failed to download '{fname}': {result}")
+                errors += 1
+            else:
+                downloaded_tmp_files.append(result)
+
+        return downloaded_tmp_files, errors
+
+    async def _download_file_async(self, filename: str, checksum: str):
+        """
+        Download a file from remote.
+
+        :param filename: file name relative to `remote_path`
+        :param checksum: the expected checksum of the file
+
+        """
+        # check destination directory exists
+        if not os.path.exists(self._local_path):
+            self._log(logging.WARNING, f"Download directory does not exist - creating it ({self._local_path})")
+            os.makedirs(self._local_path, exist_ok=True)
+
+        # download to a temporary file first
+        download_url = self._url_for_file(filename)
+        local_file_tmp = os.path.join(self._local_path, filename + DOWNLOAD_SUFFIX)
+        if len(local_file_tmp) > 255 and platform.system() == "Windows":
+            self._log(logging.WARNING, f"Temporary filename is long ({len(local_file_tmp)} characters), may cause problems on Windows")
+
+        # download, updating the checksum as chunks arrive
+        checksum_local = self._new_checksum()
+        rate_limiter = self.get_rate_limiter()
+        async with self._async_client.stream_slot():
+            start_time = time.perf_counter()
+            async with self._async_client.client.stream("GET", download_url, headers=self._https_headers,
+                                                        timeout=REQUESTS_TIMEOUT) as r:
+                self._log(logging.DEBUG, f"Response for {filename}: {r.status_code}, {r.reason_phrase}")
+                r.raise_for_status()
+                with open(local_file_tmp, 'wb') as f:
+                    await asyncio.to_thread(local_io.preallocate, f, int(r.headers.get("Content-Length", 0)))
+                    async for chunk in r.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        await rate_limiter.throttle_async("download", len(chunk))
+                        await asyncio.to_thread(_write_chunk, f, chunk, checksum_local)
+                    await asyncio.to_thread(f.truncate)
+                    local_io.advise_done(f)
+            download_time = time.perf_counter() - start_time
+
+        # check the checksum of the downloaded file
+        if checksum is not None:
+            checksum_local = checksum_local.hexdigest()
+            if checksum != checksum_local:
+                msg = f"Checksum of downloaded \"{local_file_tmp}\" doesn't match ({checksum_local} vs {checksum})"
+                self._log(logging.ERROR, msg)
+                raise RemoteJobTransfererError(msg)
+
+        self.log_transfer_time("Downloaded", local_file_tmp, download_time)
+
+        return local_file_tmp
+
+    async def _download_file_ranged_async(self, filename: str, checksum: str, size: int, retries: bool):
+        """
+        Download a large file from remote by fetching byte ranges
+        concurrently, retrying each range separately.
+
+        """
+        download_url = self._url_for_file(filename)
+        byte_ranges = self._byte_ranges(size)
+        self._log(logging.DEBUG, f"Downloading {filename} in {len(byte_ranges)} ranges")
+
+        start_time = time.perf_counter()
+        local_file_tmp = await asyncio.to_thread(self._preallocate_download, filename, size)
+        try:
+            if retries:
+                coros = (self._retry_async(self._download_range_async, download_url, local_file_tmp, first, last)
+                         for first, last in byte_ranges)
+            else:
+                coros = (self._download_range_async(download_url, local_file_tmp, first, last) for first, last in byte_ranges)
+            results = await asyncio.gather(*coros, return_exceptions=True)
+            download_time = time.perf_counter() - start_time
+
+            errors = [result for result in results if isinstance(result, Exception)]
+            for exc in errors:
+                self._log(logging.ERROR, f"Failed to download range of '{filename}': {exc}")
+            if errors:
+                raise RemoteJobTransfererError(f"Failed to download {len(errors)} of {len(byte_ranges)} ranges of '{filename}'")
+
+            # reading the whole file back is done off the event loop
+            await asyncio.to_thread(self._verify_downloaded_file, local_file_tmp, checksum)
+        except BaseException:
+            self._remove_failed_download(local_file_tmp)
+            raise
+        self.log_transfer_time("Downloaded", local_file_tmp, download_time, single_stream=False)
+
+        return local_file_tmp
+
+    async def _download_range_async(self, download_url: str, local_file_tmp: str, first: int, last: int):
+        """Download a byte range of a file and write it at its offset in the temporary file"""
+        headers = dict(self._https_headers)
+        headers["Range"] = f"bytes={first}-{last}"
+        rate_limiter = self.get_rate_limiter()
+        written = 0
+        async with self._async_client.stream_slot():
+            async with self._async_client.client.stream("GET", download_url, headers=headers,
+                                                        timeout=REQUESTS_TIMEOUT) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise RemoteJobTransfererError(f"Server did not return the requested range ({r.status_code})")
+                with open(local_file_tmp, 'r+b') as f:
+                    f.seek(first)
+                    async for chunk in r.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        await rate_limiter.throttle_async("download", len(chunk))
+                        await asyncio.to_thread(_write_chunk, f, chunk)
+                        written += len(chunk)
+
+        if written != last - first + 1:
+            raise RemoteJobTransfererError(f"Received {written} bytes for range {first}-{last}")
+
+
+class AsyncHttpClient:
+    """
+    An event loop running in a background thread together with an HTTP client
+    whose connections are pooled and reused by all coroutines on the loop.
+
+    Coroutines can be submitted from any thread using :meth:`run`, so one
+    instance is shared by all the transferers in a batch.
+
+    """
+    def __init__(self, pool_size, max_streams=ASYNC_MAX_STREAMS, transport=None):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="rjm-async-transfers", daemon=True)
+        self._thread.start()
+
+        # the client and semaphore must be created on the loop
+        self.client, self._semaphore = self.run(self._start(pool_size, max_streams, transport))
+
+    async def _start(self, pool_size, max_streams, transport):
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        client = httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=limits, transport=transport)
+        logger.debug(f"Created async HTTP client (HTTP/2 {'enabled' if HTTP2_AVAILABLE else 'disabled'})")
+
+        return client, asyncio.Semaphore(max_streams)
+
+    def stream_slot(self):
+        """Return the semaphore limiting the number of concurrent transfers"""
+        return self._semaphore
+
+    def run(self, coro):
+        """Run the coroutine on the event loop and wait for the result"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def close(self):
+        """Close the client and stop the event loop"""
+        if self._loop.is_closed():
+            return
+        self.run(self.client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
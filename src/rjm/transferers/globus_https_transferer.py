@@ -2,6 +2,7 @@
 import logging
 import os
 import time
+import threading
 import concurrent.futures
 import urllib.parse
 import platform
@@ -10,14 +11,22 @@ import globus_sdk
 import requests
 from retry.api import retry_call
 
-from rjm.transferers.transferer_base import TransfererBase
+from rjm.transferers.transferer_base import TransfererBase, ChecksumFileReader, UPLOAD_PART_NAME
+from rjm.transferers import local_io
+from rjm.transferers.transfer_planner import TransferPlanner, LANE_RANGED
 from rjm import utils
 from rjm.errors import RemoteJobTransfererError
 
 
-DOWNLOAD_CHUNK_SIZE = 8000000
+DOWNLOAD_CHUNK_SIZE = local_io.IO_BUFFER_SIZE
 DOWNLOAD_SUFFIX = '.rjm'
 REQUESTS_TIMEOUT = 30
+HTTPS_POOL_SIZE = 32  # maximum keep-alive connections, matches the default worker limit of ThreadPoolExecutor
+RANGED_DOWNLOAD_THRESHOLD_MB = 1024  # files at least this big are downloaded in byte ranges
+RANGE_SIZE_MB = 256
+RANGED_DOWNLOAD_STREAMS = 8
+CHUNKED_UPLOAD_THRESHOLD_MB = 1024  # files at least this big are uploaded in parts
+UPLOAD_PART_SIZE_MB = 256
 
 logger = logging.getLogger(__name__)
 
@@ -42,7 +51,23 @@ class GlobusHttpsTransferer(TransfererBase):
         # https uploads/downloads
         self._https_base_url = None
         self._https_auth_header = None
+        self._https_headers = None
         self._max_workers = None
+        self._pool_size = self._config.getint("GLOBUS_TRANSFER", "pool_size", fallback=HTTPS_POOL_SIZE)
+        self._session_pool = None
+
+        # large files are downloaded in parallel byte ranges
+        self._ranged_download_threshold = self._config.getint(
+            "GLOBUS_TRANSFER", "ranged_download_threshold_mb", fallback=RANGED_DOWNLOAD_THRESHOLD_MB) * 1024 * 1024
+        self._range_size = self._config.getint("GLOBUS_TRANSFER", "range_size_mb", fallback=RANGE_SIZE_MB) * 1024 * 1024
+        self._ranged_download_streams = self._config.getint("GLOBUS_TRANSFER", "ranged_download_streams",
+                                                            fallback=RANGED_DOWNLOAD_STREAMS)
+
+        # large files are uploaded in parallel parts that are joined on the remote
+        self._chunked_upload_threshold = self._config.getint(
+            "GLOBUS_TRANSFER", "chunked_upload_threshold_mb", fallback=CHUNKED_UPLOAD_THRESHOLD_MB) * 1024 * 1024
+        self._upload_part_size = self._config.getint("GLOBUS_TRANSFER", "upload_part_size_mb",
+                                                     fallback=UPLOAD_PART_SIZE_MB) * 1024 * 1024
 
         # Globus stuff
         self._https_authoriser = None
@@ -81,12 +106,17 @@ class GlobusHttpsTransferer(TransfererBase):
             self._log(logging.DEBUG, f"Remote endpoint HTTPS base URL: {self._https_base_url}")
             # HTTPS authoriser
             self._https_authoriser = authorisers[self._https_scope]
+            # keep-alive connections to the HTTPS server
+            self._session_pool = HttpsSessionPool(self._pool_size)
         else:
             # initialise from passed in transferer object
             self._log(logging.DEBUG, "Initialising transferer from another")
             self._https_base_url = transfer.get_https_base_url()
             self._https_authoriser = transfer.get_https_authoriser()
             self._transfer_client = transfer.get_transfer_client()
+            self._session_pool = transfer.get_https_session_pool()
+            self._rate_limiter = transfer.get_rate_limiter()
+            self._planner = transfer.get_planner()
 
     def get_transfer_client(self):
         """Return the transfer client"""
@@ -100,6 +130,20 @@ class GlobusHttpsTransferer(TransfererBase):
         """Return the globus authoriser"""
         return self._https_authoriser
 
+    def get_https_session_pool(self):
+        """Return the pool of HTTPS sessions, creating it if required"""
+        if self._session_pool is None:
+            self._session_pool = HttpsSessionPool(self._pool_size)
+
+        return self._session_pool
+
+    def _refresh_https_auth_header(self):
+        """Make sure we have a current access token and the headers to send it"""
+        self._https_auth_header = self._https_authoriser.get_authorization_header()
+        self._https_headers = {
+            "Authorization": self._https_auth_header,
+        }
+
     def _url_for_file(self, filename: str):
         """
         Create Globus HTTPS URL for given remote file name.
@@ -122,6 +166,8 @@ class GlobusHttpsTransferer(TransfererBase):
         :param filename: File to be uploaded
         :type filename: str
 
+        :returns: the checksum of the uploaded data
+
         """
         # use basename for remote file name
         basename = os.path.basename(filename)
@@ -129,19 +175,72 @@ class GlobusHttpsTransferer(TransfererBase):
         # make the URL to upload file to
         upload_url = self._url_for_file(basename)
 
-        # authorisation
-        headers = {
-            "Authorization": self._https_auth_header,
-        }
-
-        # upload
+        # upload, calculating the checksum as the file is streamed out
         start_time = time.perf_counter()
+        session = self.get_https_session_pool().get_session()
         with open(filename, 'rb') as f:
-            r = requests.put(upload_url, data=f, headers=headers, timeout=REQUESTS_TIMEOUT)
+            local_io.advise_sequential(f)
+            reader = ChecksumFileReader(f, self._new_checksum(), throttle=self._throttle_upload)
+            r = session.put(upload_url, data=reader, headers=self._https_headers, timeout=REQUESTS_TIMEOUT)
             r.raise_for_status()
+            checksum = reader.hexdigest()
+            local_io.advise_done(f)
         upload_time = time.perf_counter() - start_time
         self.log_transfer_time("Uploaded", filename, upload_time)
 
+        return checksum
+
+    def _create_planner(self):
+        """Create the transfer planner, with the thresholds for splitting files"""
+        return TransferPlanner(
+            self._config,
+            split_thresholds={"upload": self._chunked_upload_threshold, "download": self._ranged_download_threshold},
+            min_split_sizes={"upload": self._upload_part_size, "download": self._range_size},
+        )
+
+    def _use_chunked_upload(self, size: int):
+        """Return whether a file of the given size should be uploaded in parts"""
+        return self.get_planner().lane_for(size, "upload") == LANE_RANGED
+
+    def _file_parts_for_upload(self, filename: str, size: int):
+        """
+        Split a file into parts for uploading.
+
+        :returns: list of tuples containing the remote name, offset and length
+            of each part
+
+        """
+        basename = os.path.basename(filename)
+        return [
+            (UPLOAD_PART_NAME.format(name=basename, index=index), offset, min(self._upload_part_size, size - offset))
+            for index, offset in enumerate(range(0, size, self._upload_part_size))
+        ]
+
+    def _upload_file_part(self, filename: str, part_name: str, offset: int, length: int):
+        """
+        Upload part of a file to a temporary remote file.
+
+        :param filename: File to upload part of
+        :param part_name: remote name for the part
+        :param offset: offset of the part within the file
+        :param length: length of the part
+
+        """
+        upload_url = self._url_for_file(part_name)
+        session = self.get_https_session_pool().get_session()
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            reader = ChecksumFileReader(f, self._new_checksum(), size=length, throttle=self._throttle_upload)
+            r = session.put(upload_url, data=reader, headers=self._https_headers, timeout=REQUESTS_TIMEOUT)
+            r.raise_for_status()
+            reader.hexdigest()  # raises if the part was not read completely
+
+    def _upload_file_part_with_retries(self, filename: str, part_name: str, offset: int, length: int):
+        """Upload part of a file, retrying if the upload fails"""
+        return retry_call(self._upload_file_part, fargs=(filename, part_name, offset, length),
+                          tries=self._retry_tries, backoff=self._retry_backoff,
+                          delay=self._retry_delay, max_delay=self._retry_max_delay)
+
     def _upload_file_with_retries(self, filename: str):
         """
         Upload file, retrying if the upload fails
@@ -150,9 +249,9 @@ class GlobusHttpsTransferer(TransfererBase):
         :type filename: str
 
         """
-        retry_call(self._upload_file, fargs=(filename,), tries=self._retry_tries,
-                   backoff=self._retry_backoff, delay=self._retry_delay,
-                   max_delay=self._retry_max_delay)
+        return retry_call(self._upload_file, fargs=(filename,), tries=self._retry_tries,
+                          backoff=self._retry_backoff, delay=self._retry_delay,
+                          max_delay=self._retry_max_delay)
 
     def upload_files(self, filenames: list[str]):
         """
@@ -162,38 +261,83 @@ class GlobusHttpsTransferer(TransfererBase):
             remote directory.
         :type filenames: iterable of str
 
+        :returns: dictionary with remote file names as keys and the checksums
+            of the uploaded data as values. Large files are uploaded in parts,
+            which must be joined on the remote before they can be used (see
+            `pop_file_parts`).
+
         """
         # make sure we have a current access token
-        self._https_auth_header = self._https_authoriser.get_authorization_header()
+        self._refresh_https_auth_header()
 
-        # start a pool of threads to do the uploading
+        # do the uploading
+        checksums, errors = self._upload_files_concurrently(filenames)
+
+        # handle errors
+        if len(errors):
+            msg = [f"Failed to upload files in '{self._local_path}':"]
+            msg.append("")
+            for err in errors:
+                msg.append("  - " + err)
+            msg = os.linesep.join(msg)
+            raise RemoteJobTransfererError(msg)
+
+        return checksums
+
+    def _upload_files_concurrently(self, filenames: list[str]):
+        """
+        Upload the files using a pool of threads. Files above the threshold
+        size are split into parts that are uploaded in parallel and retried
+        separately.
+
+        :returns: tuple containing a dictionary of checksums of the uploaded
+            files and a list of error messages
+
+        """
         with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_workers) as executor:
             # start the uploads and mark each future with its filename
-            future_to_fname = {
-                executor.submit(self._upload_file_with_retries, fname): fname for fname in filenames
-            }
+            future_to_fname = {}
+            part_futures = {}
+            for fname in filenames:
+                size = os.path.getsize(fname)
+                if self._use_chunked_upload(size):
+                    parts = self._file_parts_for_upload(fname, size)
+                    self._log(logging.DEBUG, f"Uploading {fname} in {len(parts)} parts")
+                    part_futures[fname] = (parts, [
+                        executor.submit(self._upload_file_part_with_retries, fname, *part) for part in parts
+                    ])
+                    # the parts are read out of order, so checksum the whole file separately
+                    future_to_fname[executor.submit(self._calculate_checksum, fname)] = fname
+                else:
+                    future_to_fname[executor.submit(self._upload_file_with_retries, fname)] = fname
 
             # wait for completion
             errors = []
+            checksums = {}
             for future in concurrent.futures.as_completed(future_to_fname):
                 fname = future_to_fname[future]
                 try:
-                    future.result()
+                    checksums[os.path.basename(fname)] = future.result()
                 except Exception as exc:
                     msg = f"Failed to upload '{fname}': {exc}"
                     self._log(logging.ERROR, msg)
                     errors.append(msg)
 
-        # handle errors
-        if len(errors):
-            msg = [f"Failed to upload files in '{self._local_path}':"]
-            msg.append("")
-            for err in errors:
-                msg.append("  - " + err)
-            msg = os.linesep.join(msg)
-            raise RemoteJobTransfererError(msg)
+            # record the files that were uploaded in parts (including failed
+            # ones, so the parts that did arrive can be removed)
+            for fname, (parts, futures) in part_futures.items():
+                failed = [exc for exc in (future.exception() for future in futures) if exc is not None]
+                basename = os.path.basename(fname)
+                if failed:
+                    msg = f"Failed to upload {len(failed)} of {len(parts)} parts of '{fname}': {failed[0]}"
+                    self._log(logging.ERROR, msg)
+                    errors.append(msg)
+                    checksums.pop(basename, None)
+                self._file_parts[basename] = [part_name for part_name, _, _ in parts]
 
-    def download_files(self, filenames, checksums, retries=True):
+        return checksums, errors
+
+    def download_files(self, filenames, checksums, retries=True, remote_files=None):
         """
         Download the given files (which should be relative to `remote_path`) to
         the local directory.
@@ -203,11 +347,15 @@ class GlobusHttpsTransferer(TransfererBase):
         :param checksums: dictionary with filenames as keys and checksums as
             values
         :param retries: optional, retry downloads if they fail (default is True)
+        :param remote_files: optional, dictionary of the files that exist on the
+            remote (e.g. from a manifest), if not passed the remote directory
+            will be listed
 
         """
         # list directory, so we only try downloading files that exist
-        self._log(logging.DEBUG, f"Listing remote directory: {self._remote_path}")
-        remote_files = self.list_directory(self._remote_path)
+        if remote_files is None:
+            self._log(logging.DEBUG, f"Listing remote directory: {self._remote_path}")
+            remote_files = self.list_directory(self._remote_path)
 
         # look for missing files
         errors = 0
@@ -221,8 +369,39 @@ class GlobusHttpsTransferer(TransfererBase):
                 self._log(logging.ERROR, f"File to download is missing: '{fn}'")
 
         # make sure we have a current access token
-        self._https_auth_header = self._https_authoriser.get_authorization_header()
+        self._refresh_https_auth_header()
+
+        # download to temporary files
+        sizes = {fn: remote_files[fn].get("size") for fn in existing_files}
+        downloaded_tmp_files, download_errors = self._download_files_concurrently(existing_files, checksums, retries, sizes)
+        errors += download_errors
+
+        # at this point we have downloaded to temporary files, now we need to rename them to the actual files
+        self._log(logging.DEBUG, f"Renaming {len(downloaded_tmp_files)} downloaded temporary files")
+        start_time = time.perf_counter()
+        for tmp_file in downloaded_tmp_files:
+            save_file = tmp_file.removesuffix(DOWNLOAD_SUFFIX)
+            self._log(logging.DEBUG, f'Renaming "{tmp_file}" -> "{save_file}"')
+            os.replace(tmp_file, save_file)
+        rename_time = time.perf_counter() - start_time
+        self._log(logging.DEBUG, f"Finished renaming files in {rename_time:.1f} s")
+
+        # if there were any errors downloading files, raise an exception now
+        if errors > 0:
+            raise RemoteJobTransfererError(f"Failed to download files in '{self._local_path}'")
+
+        self._log(logging.DEBUG, "Finished downloading files")
 
+    def _download_files_concurrently(self, filenames: list[str], checksums: dict, retries: bool, sizes: dict):
+        """
+        Download the files to temporary files using a pool of threads. Files
+        whose size is known to be above the threshold are downloaded in
+        parallel byte ranges.
+
+        :returns: tuple containing the list of temporary files that were
+            downloaded and the number of files that failed
+
+        """
         # function to download files
         download_func = self._download_file_with_retries if retries else self._download_file
         self._log(logging.DEBUG, f"Download function is: {download_func}")
@@ -231,18 +410,19 @@ class GlobusHttpsTransferer(TransfererBase):
         self._log(logging.DEBUG, "Using ThreadPoolExecutor to download files")
         with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
             # start the downloads and mark each future with its filename
-            future_to_fname = {
-                executor.submit(
-                    download_func,
-                    fname,
-                    checksums[fname],
-                ): fname for fname in existing_files
-            }
+            future_to_fname = {}
+            for fname in filenames:
+                if self._use_ranged_download(sizes.get(fname)):
+                    future = executor.submit(self._download_file_ranged, fname, checksums[fname], sizes[fname], retries)
+                else:
+                    future = executor.submit(download_func, fname, checksums[fname])
+                future_to_fname[future] = fname
 
             # wait for completion
             self._log(logging.DEBUG, f"Waiting for {len(future_to_fname)} files to be downloaded")
             num_to_download = len(future_to_fname)
             downloaded_tmp_files = []
+            errors = 0
             count = 0
             for future in concurrent.futures.as_completed(future_to_fname):
                 fname = future_to_fname[future]
@@ -254,21 +434,7 @@ class GlobusHttpsTransferer(TransfererBase):
                     errors += 1
                 count += 1
 
-        # at this point we have downloaded to temporary files, now we need to rename them to the actual files
-        self._log(logging.DEBUG, f"Renaming {len(downloaded_tmp_files)} downloaded temporary files")
-        start_time = time.perf_counter()
-        for tmp_file in downloaded_tmp_files:
-            save_file = tmp_file.removesuffix(DOWNLOAD_SUFFIX)
-            self._log(logging.DEBUG, f'Renaming "{tmp_file}" -> "{save_file}"')
-            os.replace(tmp_file, save_file)
-        rename_time = time.perf_counter() - start_time
-        self._log(logging.DEBUG, f"Finished renaming files in {rename_time:.1f} s")
-
-        # if there were any errors downloading files, raise an exception now
-        if errors > 0:
-            raise RemoteJobTransfererError(f"Failed to download files in '{self._local_path}'")
-
-        self._log(logging.DEBUG, "Finished downloading files")
+        return downloaded_tmp_files, errors
 
     def _download_file_with_retries(self, filename: str, checksum: str):
         """
@@ -306,27 +472,30 @@ class GlobusHttpsTransferer(TransfererBase):
         if len(local_file_tmp) > 255 and platform.system() == "Windows":
             self._log(logging.WARNING, f"Temporary filename is long ({len(local_file_tmp)} characters), may cause problems on Windows")
 
-        # authorisation
-        headers = {
-            "Authorization": self._https_auth_header,
-        }
-
-        # download with temporary local file name
+        # download with temporary local file name, updating the checksum as chunks arrive
         start_time = time.perf_counter()
-        with requests.get(download_url, headers=headers, stream=True, timeout=REQUESTS_TIMEOUT) as r:
+        checksum_local = self._new_checksum()
+        session = self.get_https_session_pool().get_session()
+        with session.get(download_url, headers=self._https_headers, stream=True, timeout=REQUESTS_TIMEOUT) as r:
             self._log(logging.DEBUG, f"Requests response for {filename}: {r.status_code}, {r.reason}")
             r.raise_for_status()
             with open(local_file_tmp, 'wb') as f:
+                # preallocate when the size is known, trimming afterwards in case it was wrong
+                local_io.preallocate(f, int(r.headers.get("Content-Length", 0)))
                 for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                     if chunk:
+                        self._throttle_download(len(chunk))
                         f.write(chunk)
+                        checksum_local.update(chunk)
+                f.truncate()
+                local_io.advise_done(f)
         download_time = time.perf_counter() - start_time
         self._log(logging.DEBUG, f"Finished writing {local_file_tmp} (file exists? {os.path.exists(local_file_tmp)})")
 
         # check the checksum of the downloaded file
         if checksum is not None:
             self._log(logging.DEBUG, f"Verifying checksum of \"{local_file_tmp}\"...")
-            checksum_local = self._calculate_checksum(local_file_tmp)
+            checksum_local = checksum_local.hexdigest()
             if checksum != checksum_local:
                 msg = f"Checksum of downloaded \"{local_file_tmp}\" doesn't match ({checksum_local} vs {checksum})"
                 self._log(logging.ERROR, msg)
@@ -336,6 +505,129 @@ class GlobusHttpsTransferer(TransfererBase):
 
         return local_file_tmp
 
+    def _use_ranged_download(self, size):
+        """Return whether a file of the given size should be downloaded in byte ranges"""
+        return self.get_planner().lane_for(size, "download") == LANE_RANGED
+
+    def _byte_ranges(self, size: int):
+        """Split a file of the given size into a list of (first, last) byte ranges"""
+        return [(start, min(start + self._range_size, size) - 1) for start in range(0, size, self._range_size)]
+
+    def _preallocate_download(self, filename: str, size: int):
+        """
+        Create the temporary file to download the given file to, with the
+        final size, so that byte ranges can be written at their offsets.
+
+        :returns: path to the temporary file
+
+        """
+        if not os.path.exists(self._local_path):
+            self._log(logging.WARNING, f"Download directory does not exist - creating it ({self._local_path})")
+            os.makedirs(self._local_path, exist_ok=True)
+
+        local_file_tmp = os.path.join(self._local_path, filename + DOWNLOAD_SUFFIX)
+        with open(local_file_tmp, 'wb') as f:
+            local_io.preallocate(f, size)
+
+        return local_file_tmp
+
+    def _verify_downloaded_file(self, local_file_tmp: str, checksum: str):
+        """Check the checksum of a file that was downloaded out of order"""
+        if checksum is not None:
+            self._log(logging.DEBUG, f"Verifying checksum of \"{local_file_tmp}\"...")
+            checksum_local = self._calculate_checksum(local_file_tmp)
+            if checksum != checksum_local:
+                msg = f"Checksum of downloaded \"{local_file_tmp}\" doesn't match ({checksum_local} vs {checksum})"
+                self._log(logging.ERROR, msg)
+                raise RemoteJobTransfererError(msg)
+
+    def _remove_failed_download(self, local_file_tmp: str):
+        """Remove the (full size) temporary file of a download that failed"""
+        try:
+            os.remove(local_file_tmp)
+        except OSError as exc:
+            self._log(logging.WARNING, f"Could not remove temporary file \"{local_file_tmp}\": {exc}")
+
+    def _download_file_ranged(self, filename: str, checksum: str, size: int, retries: bool = True):
+        """
+        Download a large file from remote by fetching byte ranges in parallel,
+        retrying each range separately.
+
+        :param filename: file name relative to `remote_path`
+        :param checksum: the expected checksum of the file
+        :param size: the size of the file on the remote
+        :param retries: optional, retry ranges if they fail (default is True)
+
+        """
+        download_url = self._url_for_file(filename)
+        byte_ranges = self._byte_ranges(size)
+        self._log(logging.DEBUG, f"Downloading {filename} in {len(byte_ranges)} ranges")
+
+        start_time = time.perf_counter()
+        local_file_tmp = self._preallocate_download(filename, size)
+        try:
+            range_func = self._download_range_with_retries if retries else self._download_range
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self._ranged_download_streams) as executor:
+                futures = [
+                    executor.submit(range_func, download_url, local_file_tmp, first, last) for first, last in byte_ranges
+                ]
+                errors = 0
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as exc:
+                        self._log(logging.ERROR, f"Failed to download range of '{filename}': {exc}")
+                        errors += 1
+            download_time = time.perf_counter() - start_time
+
+            if errors:
+                raise RemoteJobTransfererError(f"Failed to download {errors} of {len(byte_ranges)} ranges of '{filename}'")
+
+            # the ranges arrive out of order so the checksum is calculated once they are all written
+            self._verify_downloaded_file(local_file_tmp, checksum)
+        except BaseException:
+            self._remove_failed_download(local_file_tmp)
+            raise
+        self.log_transfer_time("Downloaded", local_file_tmp, download_time, single_stream=False)
+
+        return local_file_tmp
+
+    def _download_range_with_retries(self, download_url: str, local_file_tmp: str, first: int, last: int):
+        """Download a byte range, retrying if the download fails"""
+        return retry_call(self._download_range, fargs=(download_url, local_file_tmp, first, last),
+                          tries=self._retry_tries, backoff=self._retry_backoff,
+                          delay=self._retry_delay, max_delay=self._retry_max_delay)
+
+    def _download_range(self, download_url: str, local_file_tmp: str, first: int, last: int):
+        """
+        Download a byte range of a file and write it at its offset in the
+        temporary file.
+
+        :param download_url: URL of the file
+        :param local_file_tmp: preallocated temporary file to write to
+        :param first: first byte of the range
+        :param last: last byte of the range (inclusive)
+
+        """
+        headers = dict(self._https_headers)
+        headers["Range"] = f"bytes={first}-{last}"
+        session = self.get_https_session_pool().get_session()
+        with session.get(download_url, headers=headers, stream=True, timeout=REQUESTS_TIMEOUT) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise RemoteJobTransfererError(f"Server did not return the requested range ({r.status_code})")
+            written = 0
+            with open(local_file_tmp, 'r+b') as f:
+                f.seek(first)
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if chunk:
+                        self._throttle_download(len(chunk))
+                        f.write(chunk)
+                        written += len(chunk)
+
+        if written != last - first + 1:
+            raise RemoteJobTransfererError(f"Received {written} bytes for range {first}-{last}")
+
     def list_directory(self, path: str):
         """
         Return a listing of the given directory.
@@ -372,3 +664,29 @@ class GlobusHttpsTransferer(TransfererBase):
         self._log(logging.DEBUG, f"Contents: {listing}")
 
         return listing
+
+
+class HttpsSessionPool:
+    """
+    Thread-safe pool of keep-alive HTTPS connections.
+
+    Each thread gets its own `requests.Session`, since sessions are not
+    guaranteed to be thread-safe, but all of the sessions share one adapter and
+    therefore one pool of connections, which is reused across threads and across
+    transferers that were set up from the same transferer.
+
+    """
+    def __init__(self, pool_size=HTTPS_POOL_SIZE):
+        self._adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self._local = threading.local()
+
+    def get_session(self):
+        """Return the session for the current thread"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            self._local.session = session
+
+        return session
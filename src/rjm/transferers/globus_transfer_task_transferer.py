@@ -0,0 +1,287 @@
+
+import os
+import time
+import logging
+import platform
+import posixpath
+import threading
+
+import globus_sdk
+
+from rjm.transferers.globus_https_transferer import GlobusHttpsTransferer
+from rjm.errors import RemoteJobTransfererError, RemoteJobConfigError
+
+
+TASK_POLL_INTERVAL = 10
+TASK_TIMEOUT = 12 * 3600  # seconds before a task is cancelled, e.g. one stuck inactive waiting for consent
+TASK_FINISHED_STATUSES = ("SUCCEEDED", "FAILED")
+
+logger = logging.getLogger(__name__)
+
+
+class GlobusTransferTaskTransferer(GlobusHttpsTransferer):
+    """
+    Upload and download files by submitting asynchronous Globus Transfer
+    tasks between a local collection (e.g. Globus Connect Personal) and the
+    remote guest collection.
+
+    Parallelism, integrity checking and restarts are handled by Globus, so
+    this process only has to wait for the task to finish. When used in a
+    batch, one task is submitted for all the jobs being uploaded or downloaded
+    (see `batch_upload` and `batch_download`) and the per-file results are
+    mapped back to each job.
+
+    """
+    BATCH_TRANSFERS = True
+
+    def __init__(self, config=None):
+        super(GlobusTransferTaskTransferer, self).__init__(config=config)
+
+        self._local_endpoint = self._config.get("GLOBUS_TRANSFER", "local_endpoint", fallback=None)
+        if not self._local_endpoint:
+            raise RemoteJobConfigError("'local_endpoint' must be set in the [GLOBUS_TRANSFER] section to use Globus Transfer tasks")
+        self._task_poll_interval = self._config.getint("GLOBUS_TRANSFER", "task_poll_interval", fallback=TASK_POLL_INTERVAL)
+        self._task_timeout = self._config.getint("GLOBUS_TRANSFER", "task_timeout", fallback=TASK_TIMEOUT)
+
+        # tasks that were submitted for this job as part of a batch
+        self._pending_tasks = {}
+
+    def _local_collection_path(self, path: str):
+        """Convert a local path to the path on the local collection"""
+        path = os.path.abspath(path)
+        if platform.system() == "Windows":
+            # Globus Connect Personal on Windows uses paths like /C/Users/...
+            drive, rest = os.path.splitdrive(path)
+            path = "/" + drive.rstrip(":") + rest.replace("\\", "/")
+
+        return path
+
+    def _remote_collection_path(self, filename: str):
+        """Return the path on the remote collection for the given file name"""
+        return posixpath.join("/", self._remote_path, filename)
+
+    def _upload_items(self, filenames: list[str]):
+        """Return (source, destination) paths for uploading the given files"""
+        return [
+            (self._local_collection_path(fn), self._remote_collection_path(os.path.basename(fn))) for fn in filenames
+        ]
+
+    def _download_items(self, filenames: list[str]):
+        """Return (source, destination) paths for downloading the given files"""
+        os.makedirs(self._local_path, exist_ok=True)
+        return [
+            (self._remote_collection_path(fn), self._local_collection_path(os.path.join(self._local_path, fn)))
+            for fn in filenames
+        ]
+
+    def _submit_task(self, direction: str, items: list[tuple[str, str]], label: str):
+        """
+        Submit a transfer task with the given (source, destination) items.
+
+        :param direction: "upload" or "download"
+
+        :returns: :class:`TransferTask` for waiting on the task
+
+        """
+        if direction == "upload":
+            source, destination = self._local_endpoint, self._remote_endpoint
+        else:
+            source, destination = self._remote_endpoint, self._local_endpoint
+
+        # the submission id is added by submit_transfer
+        tdata = globus_sdk.TransferData(
+            source_endpoint=source,
+            destination_endpoint=destination,
+            label=label,
+            verify_checksum=True,
+            skip_source_errors=True,  # missing files of one job should not fail the whole batch
+            fail_on_quota_errors=True,
+            notify_on_succeeded=False,
+        )
+        for source_path, destination_path in items:
+            tdata.add_item(source_path, destination_path)
+
+        task_id = self._transfer_client.submit_transfer(tdata)["task_id"]
+        logger.info(f"Submitted Globus Transfer task {task_id} ({direction} of {len(items)} files)")
+
+        return TransferTask(self._transfer_client, task_id, self._task_poll_interval, self._task_timeout)
+
+    def _get_task(self, direction: str, filenames: list[str], items: list[tuple[str, str]]):
+        """Return the task submitted for these files as part of a batch, or submit a new one"""
+        pending = self._pending_tasks.pop(direction, None)
+        if pending is not None and set(filenames) <= pending[1]:
+            self._log(logging.DEBUG, f"Using batch transfer task {pending[0].task_id}")
+            return pending[0]
+
+        return self._submit_task(direction, items, f"RJM {direction} {os.path.basename(self._local_path)}")
+
+    def batch_upload(self, job_uploads):
+        """
+        Submit one transfer task that uploads the files of several jobs. Each
+        job's `upload_files` then waits for the shared task.
+
+        :param job_uploads: list of tuples containing the transferer of each
+            job and the files it will upload
+
+        """
+        items = []
+        for transferer, filenames in job_uploads:
+            items.extend(transferer._upload_items(filenames))
+        if not items:
+            return
+
+        task = self._submit_task("upload", items, f"RJM upload ({len(job_uploads)} jobs)")
+        for transferer, filenames in job_uploads:
+            transferer._pending_tasks["upload"] = (task, set(filenames))
+
+    def batch_download(self, job_downloads):
+        """
+        Submit one transfer task that downloads the files of several jobs.
+        Each job's `download_files` then waits for the shared task.
+
+        :param job_downloads: list of tuples containing the transferer of each
+            job and the files it will download
+
+        """
+        items = []
+        for transferer, filenames in job_downloads:
+            items.extend(transferer._download_items(filenames))
+        if not items:
+            return
+
+        task = self._submit_task("download", items, f"RJM download ({len(job_downloads)} jobs)")
+        for transferer, filenames in job_downloads:
+            transferer._pending_tasks["download"] = (task, set(filenames))
+
+    def upload_files(self, filenames: list[str]):
+        """
+        Upload the given files to the remote directory.
+
+        :param filenames: List of files to upload to the
+            remote directory.
+
+        :returns: dictionary with remote file names as keys and the checksums
+            of the local files as values
+
+        """
+        if not filenames:
+            return {}
+
+        items = self._upload_items(filenames)
+        task = self._get_task("upload", filenames, items)
+
+        # calculate the checksums of the local files while the task runs
+        checksums = {os.path.basename(fn): self._calculate_checksum(fn) for fn in filenames}
+
+        succeeded = task.wait()
+        failed = [fn for fn, (_, destination_path) in zip(filenames, items) if destination_path not in succeeded]
+        if failed:
+            msg = f"Failed to upload files in Globus Transfer task {task.task_id}: {', '.join(failed)}"
+            self._log(logging.ERROR, msg)
+            raise RemoteJobTransfererError(msg)
+
+        return checksums
+
+    def download_files(self, filenames, checksums, retries=True, remote_files=None):
+        """
+        Download the given files (which should be relative to `remote_path`) to
+        the local directory.
+
+        :param filenames: list of file names relative to the `remote_path`
+            directory to download to the local directory.
+        :param checksums: dictionary with filenames as keys and checksums as
+            values
+        :param retries: ignored, Globus retries failed transfers itself
+        :param remote_files: optional, dictionary of the files that exist on the
+            remote (e.g. from a manifest), if not passed the remote directory
+            will be listed
+
+        """
+        if remote_files is None:
+            remote_files = self.list_directory(self._remote_path)
+
+        errors = 0
+        existing_files = []
+        for fn in filenames:
+            if fn in remote_files:
+                existing_files.append(fn)
+            else:
+                errors += 1
+                self._log(logging.ERROR, f"File to download is missing: '{fn}'")
+
+        if existing_files:
+            items = self._download_items(existing_files)
+            task = self._get_task("download", existing_files, items)
+            succeeded = task.wait()
+
+            for fn, (_, destination_path) in zip(existing_files, items):
+                local_file = os.path.join(self._local_path, fn)
+                if destination_path not in succeeded:
+                    errors += 1
+                    self._log(logging.ERROR, f"Failed to download '{fn}' in Globus Transfer task {task.task_id}")
+                elif checksums.get(fn) is not None and self._calculate_checksum(local_file) != checksums[fn]:
+                    errors += 1
+                    self._log(logging.ERROR, f"Checksum of downloaded \"{local_file}\" doesn't match")
+                    os.remove(local_file)
+
+        if errors > 0:
+            raise RemoteJobTransfererError(f"Failed to download files in '{self._local_path}'")
+
+
+class TransferTask:
+    """
+    A submitted Globus Transfer task that may be shared by several jobs. The
+    first caller of :meth:`wait` polls the task, the rest wait for it.
+
+    """
+    def __init__(self, transfer_client, task_id, poll_interval=TASK_POLL_INTERVAL, timeout=TASK_TIMEOUT):
+        self.task_id = task_id
+        self._transfer_client = transfer_client
+        self._poll_interval = poll_interval
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._succeeded = None
+        self._error = None
+
+    def wait(self):
+        """
+        Wait for the task to finish.
+
+        :returns: set of destination paths that were transferred successfully
+
+        """
+        with self._lock:
+            if self._succeeded is None and self._error is None:
+                try:
+                    self._succeeded = self._wait()
+                except Exception as exc:
+                    self._error = exc
+        if self._error is not None:
+            raise self._error
+
+        return self._succeeded
+
+    def _wait(self):
+        start_time = time.monotonic()
+        while (status := self._transfer_client.get_task(self.task_id)["status"]) not in TASK_FINISHED_STATUSES:
+            if self._timeout and time.monotonic() - start_time > self._timeout:
+                try:
+                    self._transfer_client.cancel_task(self.task_id)
+                except globus_sdk.GlobusAPIError as exc:
+                    logger.warning(f"Failed to cancel Globus Transfer task {self.task_id}: {exc}")
+                raise RemoteJobTransfererError(f"Globus Transfer task {self.task_id} did not finish in {self._timeout} s "
+                                               f"(last status: {status}), it has been cancelled")
+            time.sleep(self._poll_interval)
+        logger.debug(f"Globus Transfer task {self.task_id} finished with status: {status}")
+
+        # the successful transfers are returned a page at a time
+        succeeded = set()
+        marker = None
+        while True:
+            response = self._transfer_client.task_successful_transfers(self.task_id, marker=marker)
+            succeeded.update(item["destination_path"] for item in response)
+            marker = response.get("next_marker")
+            if not marker:
+                break
+
+        return succeeded
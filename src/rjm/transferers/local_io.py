@@ -0,0 +1,138 @@
+
+import os
+import mmap
+import queue
+import logging
+import contextlib
+
+
+IO_BUFFER_SIZE = 4 * 1024 * 1024
+IO_BUFFER_POOL_SIZE = 32  # buffers kept for reuse, beyond this they are left to the garbage collector
+MMAP_THRESHOLD = 64 * 1024 * 1024  # local files at least this big are hashed through mmap
+
+logger = logging.getLogger(__name__)
+
+
+class BufferPool:
+    """
+    Thread-safe pool of preallocated buffers that are reused for reading
+    files, rather than allocating a new bytes object for every chunk.
+
+    """
+    def __init__(self, buffer_size=IO_BUFFER_SIZE, max_buffers=IO_BUFFER_POOL_SIZE):
+        self._buffer_size = buffer_size
+        self._buffers = queue.LifoQueue(maxsize=max_buffers)
+
+    @contextlib.contextmanager
+    def buffer(self):
+        """Context manager that provides a memoryview of a buffer from the pool"""
+        try:
+            buf = self._buffers.get_nowait()
+        except queue.Empty:
+            buf = bytearray(self._buffer_size)
+        try:
+            with memoryview(buf) as view:
+                yield view
+        finally:
+            try:
+                self._buffers.put_nowait(buf)
+            except queue.Full:
+                pass
+
+
+# buffers shared by all transferers
+BUFFER_POOL = BufferPool()
+
+
+def advise_sequential(fh):
+    """Tell the OS that the file will be read sequentially, if supported"""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def advise_done(fh):
+    """
+    Tell the OS that we are finished with the file's cached pages, if
+    supported, so that bulk transfers do not evict the rest of the page cache
+
+    """
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+
+def preallocate(fh, size):
+    """
+    Allocate space for a file that is about to be written, so it is less
+    likely to be fragmented and running out of space is detected early. The
+    file size is set to `size`.
+
+    """
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fh.fileno(), 0, size)
+            return
+        except OSError as exc:
+            logger.debug(f"posix_fallocate failed, falling back to truncate: {exc}")
+    fh.truncate(size)
+
+
+def hash_file(filename, checksum):
+    """
+    Update the checksum with the contents of the file, using mmap for large
+    files and a reused buffer otherwise.
+
+    :returns: the checksum object
+
+    """
+    with open(filename, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        advise_sequential(fh)
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, "madvise"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(mm) as view:
+                    for offset in range(0, size, IO_BUFFER_SIZE):
+                        checksum.update(view[offset:offset + IO_BUFFER_SIZE])
+        else:
+            with BUFFER_POOL.buffer() as view:
+                while nread := fh.readinto(view):
+                    checksum.update(view[:nread])
+        advise_done(fh)
+
+    return checksum
+
+
+def copy_with_checksum(src, dst, checksum, throttle=None):
+    """
+    Copy from one file object to another through a reused buffer, updating
+    the checksum with the data as it is copied. If `throttle` is given it is
+    called with the size of each chunk, to limit the rate.
+
+    :returns: the number of bytes copied
+
+    """
+    copied = 0
+    if hasattr(src, "readinto"):
+        with BUFFER_POOL.buffer() as view:
+            while nread := src.readinto(view):
+                if throttle is not None:
+                    throttle(nread)
+                checksum.update(view[:nread])
+                dst.write(view[:nread])
+                copied += nread
+    else:
+        while chunk := src.read(IO_BUFFER_SIZE):
+            if throttle is not None:
+                throttle(len(chunk))
+            checksum.update(chunk)
+            dst.write(chunk)
+            copied += len(chunk)
+
+    return copied
@@ -4,14 +4,26 @@ import stat
 import time
 import platform
 import logging
-import paramiko
+import threading
+import contextlib
+import concurrent.futures
 
-from rjm.transferers.transferer_base import TransfererBase
+from retry.api import retry_call
+
+from rjm.transferers.transferer_base import TransfererBase, ChecksumFileReader
+from rjm.transferers import local_io
 from rjm import utils
-from rjm.errors import RemoteJobTransfererError
+from rjm.ssh_connection import get_connection_manager, SSH_RECONNECT_EXCEPTIONS
+from rjm.errors import RemoteJobTransfererError, RemoteJobConfigError
 
 
 DOWNLOAD_SUFFIX = '.rjm'
+SFTP_CHANNELS = 4  # concurrent transfers, below the default sshd MaxSessions of 10
+SFTP_CONNECTIONS = 1
+SFTP_RETRY_EXCEPTIONS = SSH_RECONNECT_EXCEPTIONS
+COMPRESSED_EXTENSIONS = {  # not worth compressing again in the SSH transport
+    ".gz", ".tgz", ".bz2", ".xz", ".zst", ".zip", ".7z", ".png", ".jpg", ".jpeg", ".mp4", ".npz",
+}
 
 
 logger = logging.getLogger(__name__)
@@ -27,96 +39,176 @@ class ParamikoSftpTransferer(TransfererBase):
         super(ParamikoSftpTransferer, self).__init__(config=config)
 
         # config
-        self._ssh_private_key_file = self._config.get("PARAMIKO", "private_key_file")
-        self._remote_address = self._config.get("PARAMIKO", "remote_address")
-        self._remote_user = self._config.get("PARAMIKO", "remote_user")
         self._remote_base_path = self._config.get("PARAMIKO", "remote_base_path")
 
+        # number of SFTP channels used concurrently and SSH connections they are spread over
+        self._sftp_channels = self._config.getint("PARAMIKO", "sftp_channels", fallback=SFTP_CHANNELS)
+        self._sftp_connections = self._config.getint("PARAMIKO", "sftp_connections", fallback=SFTP_CONNECTIONS)
+
+        # compression of the SSH connections used for transfers
+        self._compression = self._config.get("PARAMIKO", "sftp_compression", fallback="false").lower()
+        if self._compression not in ("false", "true", "auto"):
+            raise RemoteJobConfigError(f"sftp_compression must be one of 'false', 'true' or 'auto': {self._compression}")
+
+        # outstanding read requests per download, by default enough to fill the window (see setup)
+        self._max_requests = self._config.getint("PARAMIKO", "sftp_max_requests", fallback=0)
+
         # retry params
         self._retry_tries, self._retry_backoff, self._retry_delay, self._retry_max_delay = utils.get_retry_values_from_config(self._config)
 
-        # TODO: move to a setup function??
-        self._private_key = None
-        self._ssh_client = None
-        self._sftp_client = None
-
-#    def __del__(self):
-#        if self._sftp_client is not None:
-#            self._sftp_client.close()
-#        if self._ssh_client is not None:
-#            self._ssh_client.close()
+        # pool of SFTP channels, shared with transferers that are set up from this one
+        self._connection = None
+        self._sftp_pool = None
 
     def _log(self, level, message, *args, **kwargs):
         """Add a label to log messages, identifying this specific RemoteJob"""
         logger.log(level, self._label + message, *args, **kwargs)
 
-    def setup(self, *args, **kwargs):
-        """Setup the SFTP client"""
+    def setup(self, *args, transfer=None, **kwargs):
+        """Setup the SFTP channel pool, or share the one from `transfer`"""
         self._log(logging.DEBUG, "Setting up ParamikoSftpTransferer...")
-        self._ssh_client = paramiko.SSHClient()
-        self._ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-        self._log(logging.DEBUG, f"Loading SSH key from {self._ssh_private_key_file}")
-        self._private_key = paramiko.RSAKey(filename=self._ssh_private_key_file)
-
-        # Connect to server
-        self._ssh_client.connect(
-            hostname=self._remote_address,
-            port=22,
-            username=self._remote_user,
-            pkey=self._private_key,
-            timeout=30,
-            look_for_keys=False,
-        )
-
-        # Create SFTP client
-        self._sftp_client = self._ssh_client.open_sftp()
-        self._log(logging.DEBUG, f"Connected to: {self._remote_address} ({self._sftp_client})")
+        if transfer is not None:
+            self._rate_limiter = transfer.get_rate_limiter()
+            self._planner = transfer.get_planner()
+            self._sftp_pool = transfer.get_sftp_pool()
+            self._connection = transfer._connection
+            self._max_requests = transfer._max_requests
+            return
+
+        # the SSH connections are shared with the runner
+        self._connection = get_connection_manager(self._config)
+        self._sftp_pool = SftpChannelPool(self._connection, self._sftp_connections, self._sftp_channels)
+        self._log(logging.DEBUG, f"Using up to {self._sftp_channels} SFTP channels over {self._sftp_connections} connections")
+        if self._max_requests <= 0:
+            self._max_requests = max(1, self._connection.window_size // self._connection.max_packet_size)
 
         # Ensure remote base path exists
-        # Use ssh_client to run mkdir -p
-        stdin, stdout, stderr = self._ssh_client.exec_command(f'mkdir -p "{self._remote_base_path}"')
-        exit_status = stdout.channel.recv_exit_status()
+        exit_status, _, err = self._connection.run(f'mkdir -p "{self._remote_base_path}"')
         if exit_status != 0:
-            err = stderr.read().decode()
             self._log(logging.ERROR, f'Failed to create remote base path: {self._remote_base_path}. Error: {err}')
         else:
             self._log(logging.DEBUG, f'Ensured remote base path exists: {self._remote_base_path}')
 
+    def _compress(self, filename):
+        """Return whether the file should be sent over a compressed connection"""
+        if self._compression == "auto":
+            return os.path.splitext(filename)[1].lower() not in COMPRESSED_EXTENSIONS
+
+        return self._compression == "true"
+
+    def get_sftp_pool(self):
+        """Return the pool of SFTP channels"""
+        return self._sftp_pool
+
+    def close(self):
+        """Close the idle SFTP channels (the connections are shared with the runner)"""
+        if self._sftp_pool is not None:
+            self._sftp_pool.close()
+
+    def _remote_file_path(self, basename):
+        """Return the full remote path of a file in the remote directory"""
+        return f"{self._remote_base_path}/{self._remote_path}/{basename}"
+
     def upload_files(self, filenames: list[str]):
         """
-        Upload the given files to the remote directory.
+        Upload the given files to the remote directory, spread over the
+        channels in the pool.
 
         :param filenames: List of files to upload to the
             remote directory.
         :type filenames: iterable of str
 
+        :returns: dictionary with remote file names as keys and the checksums
+            of the uploaded data as values
+
         """
         self._log(logging.DEBUG, "Uploading files...")
         self._log(logging.DEBUG, f"Remote base path is: {self._remote_base_path}")
         self._log(logging.DEBUG, f"Remote path is: {self._remote_path}")
+        checksums = {}
+        errors = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._sftp_pool.size) as executor:
+            future_to_file = {executor.submit(self._upload_file_with_retries, fn): fn for fn in filenames}
+            for future in concurrent.futures.as_completed(future_to_file):
+                filename = future_to_file[future]
+                try:
+                    checksums[os.path.basename(filename)] = future.result()
+                except Exception as exc:
+                    errors.append(f"{filename}: {exc}")
+
+        # one listing confirms the sizes of all the files, rather than a stat per file
+        if checksums:
+            errors.extend(self._confirm_uploads([fn for fn in filenames if os.path.basename(fn) in checksums]))
+
+        if errors:
+            msg = [f"Failed to upload files in '{self._local_path}':", ""]
+            msg.extend("  - " + err for err in errors)
+            self._log(logging.ERROR, "\n".join(msg))
+            raise RemoteJobTransfererError("\n".join(msg))
+
+        return checksums
+
+    def _confirm_uploads(self, filenames: list[str]):
+        """
+        Check the uploaded files have the same sizes as the local files
+
+        :returns: list of error messages for files that do not match
+
+        """
+        listing = self.list_directory(f"{self._remote_base_path}/{self._remote_path}")
+        errors = []
         for filename in filenames:
-            # use basename for remote file name
             basename = os.path.basename(filename)
-            remote_filename = f"{self._remote_base_path}/{self._remote_path}/{basename}"
-            self._log(logging.DEBUG, f"Uploading: {filename} -> {remote_filename}")
+            local_size = os.path.getsize(filename)
+            remote_size = listing[basename]["size"] if basename in listing else None
+            if remote_size != local_size:
+                errors.append(f"{filename}: size mismatch after upload ({remote_size} vs {local_size})")
+
+        return errors
 
-            # upload
-            start_time = time.perf_counter()
-            self._sftp_client.put(filename, remote_filename)
-            upload_time = time.perf_counter() - start_time
-            self.log_transfer_time("Uploaded", filename, upload_time)
+    def _upload_file_with_retries(self, filename: str):
+        """Upload a file, retrying on a fresh channel if the connection fails"""
+        return retry_call(self._upload_file, fargs=(filename,), exceptions=SFTP_RETRY_EXCEPTIONS,
+                          tries=self._retry_tries, backoff=self._retry_backoff,
+                          delay=self._retry_delay, max_delay=self._retry_max_delay)
+
+    def _upload_file(self, filename: str):
+        """
+        Upload a file over a channel from the pool.
+
+        :returns: the checksum of the uploaded data
+
+        """
+        # use basename for remote file name
+        remote_filename = self._remote_file_path(os.path.basename(filename))
+        self._log(logging.DEBUG, f"Uploading: {filename} -> {remote_filename}")
 
-    def download_files(self, filenames, checksums, retries=True):
+        # upload, calculating the checksum as the file is streamed out
+        start_time = time.perf_counter()
+        with self._sftp_pool.channel(compress=self._compress(filename)) as sftp_client:
+            with open(filename, 'rb') as fh:
+                local_io.advise_sequential(fh)
+                reader = ChecksumFileReader(fh, self._new_checksum(), throttle=self._throttle_upload)
+                # writes are pipelined by putfo, sizes are confirmed afterwards for all files at once
+                sftp_client.putfo(reader, remote_filename, file_size=len(reader), confirm=False)
+                local_io.advise_done(fh)
+        upload_time = time.perf_counter() - start_time
+        self.log_transfer_time("Uploaded", filename, upload_time)
+
+        return reader.hexdigest()
+
+    def download_files(self, filenames, checksums, retries=True, remote_files=None):
         """
         Download the given files (which should be relative to `remote_path`) to
-        the local directory.
+        the local directory, spread over the channels in the pool.
 
         :param filenames: list of file names relative to the `remote_path`
             directory to download to the local directory.
         :param checksums: dictionary with filenames as keys and checksums as
             values
         :param retries: optional, retry downloads if they fail (default is True)
+        :param remote_files: optional, dictionary of the files that exist on the
+            remote (e.g. from a manifest), missing files will not be requested
 
         """
         errors = 0
@@ -126,38 +218,38 @@ class ParamikoSftpTransferer(TransfererBase):
             self._log(logging.WARNING, f"Download directory does not exist - creating it ({self._local_path})")
             os.makedirs(self._local_path, exist_ok=True)
 
-        # loop over the files to download
-        self._log(logging.DEBUG, "Downloading files...")
-        downloaded_tmp_files = []
+        # check the files exist first
+        existing_files = []
         for fn in filenames:
-            self._log(logging.DEBUG, f"Downloading: {fn}")
-            remote_fn = f"{self._remote_base_path}/{self._remote_path}/{fn}"
-
-            # check it exists first
-
-
-            # download to temporary file
-            local_file_tmp = os.path.join(self._local_path, fn + DOWNLOAD_SUFFIX)
-            self._log(logging.DEBUG, f"Downloading {fn} to temporary file first: {local_file_tmp}")
-            if len(local_file_tmp) > 255 and platform.system() == "Windows":
-                self._log(logging.WARNING, f"Temporary filename is long ({len(local_file_tmp)} characters), may cause problems on Windows")
-
-            # run the download
-            start_time = time.perf_counter()
-            try:
-                self._sftp_client.get(remote_fn, local_file_tmp)
-            except FileNotFoundError as exc:
+            if remote_files is not None and fn not in remote_files:
                 errors += 1
-                self._log(logging.ERROR, f"File to download is missing: '{fn}' ({exc})")
+                self._log(logging.ERROR, f"File to download is missing: '{fn}'")
             else:
-                download_time = time.perf_counter() - start_time
-                self.log_transfer_time("Downloaded", local_file_tmp, download_time)
+                existing_files.append(fn)
+
+        # download to temporary files
+        self._log(logging.DEBUG, "Downloading files...")
+        downloaded_tmp_files = []
+        download_func = self._download_file_with_retries if retries else self._download_file
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._sftp_pool.size) as executor:
+            future_to_file = {executor.submit(download_func, fn): fn for fn in existing_files}
+            for future in concurrent.futures.as_completed(future_to_file):
+                fn = future_to_file[future]
+                try:
+                    local_file_tmp, checksum_local = future.result()
+                except FileNotFoundError as exc:
+                    errors += 1
+                    self._log(logging.ERROR, f"File to download is missing: '{fn}' ({exc})")
+                    continue
+                except Exception as exc:
+                    errors += 1
+                    self._log(logging.ERROR, f"Failed to download '{fn}': {exc}")
+                    continue
 
                 # validate the checksum of the downloaded file
                 if fn in checksums:
                     checksum = checksums[fn]
                     self._log(logging.DEBUG, f"Verifying checksum of \"{local_file_tmp}\"...")
-                    checksum_local = self._calculate_checksum(local_file_tmp)
                     if checksum != checksum_local:
                         msg = f"Checksum of downloaded \"{local_file_tmp}\" doesn't match ({checksum_local} vs {checksum})"
                         self._log(logging.ERROR, msg)
@@ -181,6 +273,44 @@ class ParamikoSftpTransferer(TransfererBase):
 
         self._log(logging.DEBUG, "Finished downloading files")
 
+    def _download_file_with_retries(self, filename: str):
+        """Download a file, retrying on a fresh channel if the connection fails"""
+        return retry_call(self._download_file, fargs=(filename,), exceptions=SFTP_RETRY_EXCEPTIONS,
+                          tries=self._retry_tries, backoff=self._retry_backoff,
+                          delay=self._retry_delay, max_delay=self._retry_max_delay)
+
+    def _download_file(self, filename: str):
+        """
+        Download a file to a temporary file over a channel from the pool.
+
+        :returns: tuple of the temporary file and the checksum of the data
+
+        """
+        self._log(logging.DEBUG, f"Downloading: {filename}")
+        remote_fn = self._remote_file_path(filename)
+
+        # download to temporary file
+        local_file_tmp = os.path.join(self._local_path, filename + DOWNLOAD_SUFFIX)
+        self._log(logging.DEBUG, f"Downloading {filename} to temporary file first: {local_file_tmp}")
+        if len(local_file_tmp) > 255 and platform.system() == "Windows":
+            self._log(logging.WARNING, f"Temporary filename is long ({len(local_file_tmp)} characters), may cause problems on Windows")
+
+        # run the download, calculating the checksum as the data arrives
+        start_time = time.perf_counter()
+        with self._sftp_pool.channel(compress=self._compress(filename)) as sftp_client:
+            with sftp_client.open(remote_fn, 'rb') as src:
+                file_size = src.stat().st_size
+                src.prefetch(file_size, max_concurrent_requests=self._max_requests)
+                with open(local_file_tmp, 'wb') as dst:
+                    local_io.preallocate(dst, file_size)
+                    checksum_local = self._copy_with_checksum(src, dst, throttle=self._throttle_download)
+                    dst.truncate()
+                    local_io.advise_done(dst)
+        download_time = time.perf_counter() - start_time
+        self.log_transfer_time("Downloaded", local_file_tmp, download_time)
+
+        return local_file_tmp, checksum_local
+
     def list_directory(self, path: str):
         """
         Return a listing of the given directory.
@@ -190,7 +320,8 @@ class ParamikoSftpTransferer(TransfererBase):
         """
         self._log(logging.DEBUG, f"Listing remote directory: {path}")
 
-        raw_listing = self._sftp_client.listdir_attr(path=path)
+        with self._sftp_pool.channel() as sftp_client:
+            raw_listing = sftp_client.listdir_attr(path=path)
 
         listing = {}
         for entry in raw_listing:
@@ -205,3 +336,124 @@ class ParamikoSftpTransferer(TransfererBase):
         self._log(logging.DEBUG, f"Listing: {listing}")
 
         return listing
+
+
+class SftpChannelPool:
+    """
+    Pool of SFTP channels spread over one or more SSH connections, shared by
+    all the transferers in a batch.
+
+    Channels are opened as they are needed, up to the pool size, and
+    returned to the pool for reuse after each transfer, including transfers
+    that failed with an SFTP error such as a missing file. A channel that
+    failed for any other reason is closed rather than reused, and a
+    connection that has dropped is reopened by the connection manager the
+    next time a channel is needed from it.
+
+    """
+    def __init__(self, connection, num_connections=SFTP_CONNECTIONS, num_channels=SFTP_CHANNELS):
+        """
+        :param connection: the :class:`SSHConnectionManager` for the remote
+        :param num_connections: number of SSH connections to spread channels over
+        :param num_channels: maximum number of channels in use at once
+
+        """
+        self.size = max(1, num_channels)
+        self._connection = connection
+        self._num_connections = max(1, num_connections)
+        # idle channels, with the index of their connection, most recently used last
+        self._idle = {compress: [] for compress in (False, True)}
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._opened = 0
+
+        # open channels count towards the connection's limit, idle or not
+        self._connection.add_idle_pool(self)
+
+    def _open_channel(self, compress):
+        """Open a new SFTP channel on the next connection, round robin"""
+        with self._lock:
+            index = self._opened % self._num_connections
+            self._opened += 1
+
+        self._connection.acquire_channel_slot(index, compress)
+        try:
+            sftp_client = self._connection.ssh_client(index, compress=compress).open_sftp()
+        except BaseException:
+            self._connection.release_channel_slot(index, compress)
+            raise
+
+        return sftp_client, index
+
+    def _close_channel(self, sftp_client, index, compress):
+        """Close a channel and give back its slot in the connection manager"""
+        try:
+            sftp_client.close()
+        finally:
+            self._connection.release_channel_slot(index, compress)
+
+    def _get_idle(self, compress, index=None):
+        """Take an idle channel from the pool, optionally on a given connection"""
+        with self._lock:
+            idle = self._idle[compress]
+            for i in reversed(range(len(idle))):
+                if index is None or idle[i][1] == index:
+                    return idle.pop(i)
+
+        return None
+
+    def reclaim_idle(self, index, compress):
+        """
+        Close an idle channel on the given connection, so the connection
+        manager can open another channel there
+
+        :returns: whether a channel was closed
+
+        """
+        item = self._get_idle(compress, index)
+        if item is None:
+            return False
+        self._close_channel(*item, compress)
+
+        return True
+
+    @contextlib.contextmanager
+    def channel(self, compress=False):
+        """Context manager that provides an `SFTPClient` from the pool"""
+        with self._slots:
+            item = None
+            while item is None:
+                item = self._get_idle(compress)
+                if item is None:
+                    item = self._open_channel(compress)
+                elif item[0].get_channel().closed:
+                    self._close_channel(*item, compress)
+                    item = None
+            sftp_client, index = item
+
+            reusable = False
+            try:
+                yield sftp_client
+                reusable = True
+            except SFTP_RETRY_EXCEPTIONS:
+                raise
+            except OSError:
+                # SFTP status errors (e.g. a missing file) and local file
+                # errors leave the channel usable
+                reusable = True
+                raise
+            finally:
+                if reusable:
+                    with self._lock:
+                        self._idle[compress].append(item)
+                else:
+                    self._close_channel(sftp_client, index, compress)
+
+    def close(self):
+        """Close all channels (the connections belong to the connection manager)"""
+        for compress in self._idle:
+            while True:
+                item = self._get_idle(compress)
+                if item is None:
+                    break
+                self._close_channel(*item, compress)
@@ -0,0 +1,119 @@
+
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime
+
+from rjm.errors import RemoteJobConfigError
+
+
+RATE_LIMIT_BURST_SECONDS = 1.0  # the bucket holds this many seconds' worth of tokens
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, with one token per byte.
+
+    Callers take the tokens for the data they are about to send or have just
+    received and are told how long to wait before continuing. Tokens can go
+    negative, so large chunks are allowed through but the following ones are
+    delayed accordingly.
+
+    """
+    def __init__(self, rate):
+        self._tokens = rate * RATE_LIMIT_BURST_SECONDS
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, nbytes, rate):
+        """
+        Take tokens for `nbytes` bytes, refilling at `rate` bytes per second.
+
+        :returns: the number of seconds to wait before continuing
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._last) * rate, rate * RATE_LIMIT_BURST_SECONDS)
+            self._last = now
+            self._tokens -= nbytes
+
+            return 0 if self._tokens >= 0 else -self._tokens / rate
+
+
+class RateLimiter:
+    """
+    Limits the transfer rate using a global token bucket plus separate buckets
+    for uploads and downloads. Limits are read from the ``[RATE_LIMIT]``
+    config section (in MB/s) and can be multiplied by a factor during an
+    off-peak period.
+
+    A single limiter is shared by all the transferers in a batch.
+
+    """
+    def __init__(self, config):
+        self._rates = {}
+        self._buckets = {}
+        for name, option in (("global", "max_rate"), ("upload", "upload_max_rate"), ("download", "download_max_rate")):
+            rate = config.getfloat("RATE_LIMIT", option, fallback=0)
+            if rate > 0:
+                self._rates[name] = rate * 1000 * 1000
+                self._buckets[name] = TokenBucket(self._rates[name])
+
+        # optional off-peak boost, e.g. "19-7" multiplies the limits between 19:00 and 07:00
+        self._offpeak_hours = None
+        self._offpeak_multiplier = config.getfloat("RATE_LIMIT", "offpeak_multiplier", fallback=1)
+        if self._offpeak_multiplier <= 0:
+            raise RemoteJobConfigError(f"offpeak_multiplier must be positive: {self._offpeak_multiplier}")
+        offpeak_hours = config.get("RATE_LIMIT", "offpeak_hours", fallback=None)
+        if offpeak_hours:
+            try:
+                start, end = (int(hour) for hour in offpeak_hours.split("-"))
+            except ValueError as exc:
+                raise RemoteJobConfigError(f"Invalid offpeak_hours (expected e.g. '19-7'): {offpeak_hours}") from exc
+            self._offpeak_hours = (start, end)
+
+        if self._rates:
+            logger.debug(f"Rate limits (bytes/s): {self._rates}")
+
+    def _multiplier(self):
+        """Return the factor to apply to the limits at the current time"""
+        if self._offpeak_hours is None:
+            return 1
+
+        start, end = self._offpeak_hours
+        hour = datetime.now().hour
+        offpeak = start <= hour < end if start <= end else hour >= start or hour < end
+
+        return self._offpeak_multiplier if offpeak else 1
+
+    def _delay(self, direction, nbytes):
+        """Take tokens from the global and direction buckets, returning the time to wait"""
+        multiplier = self._multiplier()
+        delay = 0
+        for name in ("global", direction):
+            if name in self._buckets:
+                delay = max(delay, self._buckets[name].take(nbytes, self._rates[name] * multiplier))
+
+        return delay
+
+    def throttle(self, direction, nbytes):
+        """
+        Block until `nbytes` bytes can be transferred in the given direction
+        ("upload" or "download") without exceeding the limits.
+
+        """
+        if self._rates:
+            delay = self._delay(direction, nbytes)
+            if delay > 0:
+                time.sleep(delay)
+
+    async def throttle_async(self, direction, nbytes):
+        """Coroutine version of :meth:`throttle`, for use on an event loop"""
+        if self._rates:
+            delay = self._delay(direction, nbytes)
+            if delay > 0:
+                await asyncio.sleep(delay)
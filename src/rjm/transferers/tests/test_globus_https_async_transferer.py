@@ -0,0 +1,230 @@
+
+import os
+import hashlib
+import configparser
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from rjm.transferers.globus_https_async_transferer import GlobusHttpsAsyncTransferer, AsyncHttpClient  # noqa: E402
+from rjm.errors import RemoteJobTransfererError  # noqa: E402
+
+
+class AuthoriserMock:
+    def get_authorization_header(self):
+        return "Bearer abc"
+
+
+@pytest.fixture
+def configobj():
+    config = configparser.ConfigParser()
+    config["GLOBUS_TRANSFER"] = {
+        "remote_endpoint": "qwerty",
+        "remote_path": "asdfg",
+        "max_streams": "2",
+    }
+    config["RETRY"] = {
+        "override_defaults": "1",
+        "delay": "0",
+        "backoff": "1",
+        "tries": "3",
+    }
+
+    return config
+
+
+class FakeServer:
+    """Remote directory served through an httpx mock transport"""
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.failures = {}
+
+    async def handler(self, request):
+        name = os.path.basename(request.url.path)
+        self.requests.append((request.method, name))
+        if self.failures.get(name, 0) > 0:
+            self.failures[name] -= 1
+            return httpx.Response(503)
+        if request.method == "PUT":
+            self.files[name] = await request.aread()
+            return httpx.Response(200)
+        if name in self.files:
+            return httpx.Response(200, content=self.files[name])
+        return httpx.Response(404)
+
+
+@pytest.fixture
+def server():
+    return FakeServer()
+
+
+@pytest.fixture
+def tf(mocker, configobj, server, tmpdir):
+    mocker.patch('rjm.config.load_config', return_value=configobj)
+    tf = GlobusHttpsAsyncTransferer()
+    tf._https_authoriser = AuthoriserMock()
+    tf._https_base_url = "https://my.base.url"
+    tf._remote_path = "my/remote/path"
+    tf._local_path = str(tmpdir)
+    tf._async_client = AsyncHttpClient(4, max_streams=2, transport=httpx.MockTransport(server.handler))
+    yield tf
+    tf._async_client.close()
+
+
+def test_upload_files(tf, server, tmpdir):
+    uploads = []
+    for i in range(5):
+        fn = tmpdir / f"upload{i}"
+        fn.write_binary(os.urandom(1000 * i))
+        uploads.append(str(fn))
+    server.failures["upload1"] = 1
+
+    checksums = tf.upload_files(uploads)
+
+    assert checksums.keys() == {os.path.basename(fn) for fn in uploads}
+    for name, checksum in checksums.items():
+        assert hashlib.sha256(server.files[name]).hexdigest() == checksum
+    assert server.requests.count(("PUT", "upload1")) == 2  # retried after failure
+
+
+def test_upload_files_retries_fail(tf, server, tmpdir):
+    fn = tmpdir / "upload"
+    fn.write_binary(b"data")
+    server.failures["upload"] = 3
+
+    with pytest.raises(RemoteJobTransfererError):
+        tf.upload_files([str(fn)])
+
+    assert server.requests.count(("PUT", "upload")) == 3
+
+
+def test_download_files(tf, server, tmpdir):
+    checksums = {}
+    for i in range(5):
+        data = os.urandom(1000 * i)
+        server.files[f"download{i}"] = data
+        checksums[f"download{i}"] = hashlib.sha256(data).hexdigest()
+    server.failures["download2"] = 1
+
+    tf.download_files(list(checksums), checksums, remote_files={name: {"size": None} for name in checksums})
+
+    for name in checksums:
+        assert (tmpdir / name).read_binary() == server.files[name]
+        assert not os.path.exists(tmpdir / (name + ".rjm"))
+
+
+def test_download_files_bad_checksum(tf, server, tmpdir):
+    server.files["good"] = b"good"
+    server.files["bad"] = b"bad"
+    checksums = {
+        "good": hashlib.sha256(b"good").hexdigest(),
+        "bad": hashlib.sha256(b"not bad").hexdigest(),
+    }
+
+    with pytest.raises(RemoteJobTransfererError):
+        tf.download_files(["good", "bad"], checksums, retries=False, remote_files={name: {"size": None} for name in checksums})
+
+    assert (tmpdir / "good").read_binary() == b"good"
+    assert not os.path.exists(tmpdir / "bad")
+
+
+def test_async_client_shared(mocker, configobj, tf):
+    mocker.patch('rjm.transferers.globus_https_transferer.GlobusHttpsTransferer.setup_globus_auth')
+    tf2 = GlobusHttpsAsyncTransferer()
+    tf2.setup_globus_auth(None, transfer=tf)
+
+    assert tf2.get_async_client() is tf.get_async_client()
+
+    # only the transferer that created the client closes it
+    tf2.close()
+    assert not tf.get_async_client()._loop.is_closed()
+
+
+def test_close_async_client(mocker, configobj):
+    mocker.patch('rjm.config.load_config', return_value=configobj)
+    tf = GlobusHttpsAsyncTransferer()
+    client = tf.get_async_client()
+
+    tf.close()
+
+    assert client._loop.is_closed()
+    assert not client._thread.is_alive()
+    # a new client is created if the transferer is used again
+    assert tf.get_async_client() is not client
+    tf.close()
+
+
+def test_download_files_ranged(tf, server, tmpdir):
+    data = os.urandom(10000)
+    tf._ranged_download_threshold = 5000
+    tf._range_size = 3000
+    requested = []
+
+    async def handler(request):
+        first, last = map(int, request.headers["Range"].removeprefix("bytes=").split("-"))
+        requested.append(first)
+        if requested.count(first) == 1 and first == 6000:
+            return httpx.Response(500)
+        return httpx.Response(206, content=data[first:last + 1])
+
+    tf._async_client.close()
+    tf._async_client = AsyncHttpClient(4, max_streams=2, transport=httpx.MockTransport(handler))
+
+    checksums = {"bigfile": hashlib.sha256(data).hexdigest()}
+    tf.download_files(["bigfile"], checksums, remote_files={"bigfile": {"size": len(data)}})
+
+    assert (tmpdir / "bigfile").read_binary() == data
+    assert sorted(requested) == [0, 3000, 6000, 6000, 9000]
+
+
+def test_download_files_ranged_bad_checksum(tf, tmpdir):
+    data = os.urandom(10000)
+    tf._ranged_download_threshold = 5000
+    tf._range_size = 3000
+
+    async def handler(request):
+        first, last = map(int, request.headers["Range"].removeprefix("bytes=").split("-"))
+        return httpx.Response(206, content=data[first:last + 1])
+
+    tf._async_client.close()
+    tf._async_client = AsyncHttpClient(4, max_streams=2, transport=httpx.MockTransport(handler))
+
+    with pytest.raises(RemoteJobTransfererError):
+        tf.download_files(["bigfile"], {"bigfile": "wrong"}, remote_files={"bigfile": {"size": len(data)}})
+
+    # the temporary file is removed
+    assert os.listdir(tmpdir) == []
+
+
+def test_upload_files_in_parts(tf, server, tmpdir):
+    data = os.urandom(10000)
+    bigfile = tmpdir / "bigfile"
+    bigfile.write_binary(data)
+    tf._chunked_upload_threshold = 5000
+    tf._upload_part_size = 3000
+    parts = [f".bigfile.rjm-part-{index:04d}" for index in range(4)]
+    server.failures[parts[2]] = 1
+
+    checksums = tf.upload_files([str(bigfile)])
+
+    assert checksums == {"bigfile": hashlib.sha256(data).hexdigest()}
+    assert b"".join(server.files[part] for part in parts) == data
+    assert server.requests.count(("PUT", parts[2])) == 2
+    assert tf.pop_file_parts() == {"bigfile": parts}
+
+
+def test_upload_files_in_parts_fail(tf, server, tmpdir):
+    bigfile = tmpdir / "bigfile"
+    bigfile.write_binary(os.urandom(10000))
+    tf._chunked_upload_threshold = 5000
+    tf._upload_part_size = 3000
+    parts = [f".bigfile.rjm-part-{index:04d}" for index in range(4)]
+    server.failures[parts[2]] = 3
+
+    with pytest.raises(RemoteJobTransfererError):
+        tf.upload_files([str(bigfile)])
+
+    # the parts are still reported, so the ones that arrived can be removed
+    assert tf.pop_file_parts() == {"bigfile": parts}
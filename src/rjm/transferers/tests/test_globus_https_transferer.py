@@ -1,6 +1,8 @@
 
 import os
+import hashlib
 import configparser
+import concurrent.futures
 
 import requests
 import pytest
@@ -101,11 +103,13 @@ def test_upload_files(tf, uploads, mocker):
         json={"msg": "OK"},
         status=200,
     )
-    spy = mocker.spy(requests, 'put')
+    spy = mocker.spy(requests.Session, 'put')
 
-    tf.upload_files(uploads[:2])
+    checksums = tf.upload_files(uploads[:2])
 
     assert spy.call_count == 3  # should have tried twice, one failure then success
+    empty_checksum = "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+    assert checksums == {os.path.basename(fn): empty_checksum for fn in uploads[:2]}
 
 
 @responses.activate()
@@ -147,7 +151,7 @@ def test_upload_files_retries_fail(tf, uploads, mocker):
         json={"msg": "OK"},
         status=200,
     )
-    spy = mocker.spy(requests, 'put')
+    spy = mocker.spy(requests.Session, 'put')
 
     with pytest.raises(RemoteJobTransfererError):
         tf.upload_files(uploads[:2])
@@ -165,3 +169,139 @@ def test_calculate_checksum(tf, tmpdir):
     checksum = tf._calculate_checksum(test_file)
 
     assert checksum == expected
+
+
+@responses.activate()
+@pytest.mark.parametrize("valid_checksum", [True, False])
+def test_download_file_checksum_while_streaming(tf, tmpdir, mocker, valid_checksum):
+    text = """test file with some text"""
+    checksum = "337de094ee88f1bc965a97e1d6767f51a06fd1e6e679664625ff68546e3d2601"
+    tf._https_base_url = "https://my.base.url"
+    tf._remote_path = "my/remote/path"
+    tf._local_path = str(tmpdir)
+    responses.add(
+        responses.GET,
+        tf._url_for_file("testfile"),
+        body=text,
+        status=200,
+    )
+    spy = mocker.spy(tf, '_calculate_checksum')
+
+    if valid_checksum:
+        tmp_file = tf._download_file("testfile", checksum)
+        with open(tmp_file) as fh:
+            assert fh.read() == text
+    else:
+        with pytest.raises(RemoteJobTransfererError):
+            tf._download_file("testfile", "notthechecksum")
+
+    # the file should not be read back from disk to verify it
+    assert spy.call_count == 0
+
+
+def test_https_session_pool_shared(tf, configobj, mocker):
+    # transferers set up from another share its connection pool
+    tf2 = GlobusHttpsTransferer()
+    mocker.patch.object(tf, 'get_https_base_url')
+    mocker.patch.object(tf, 'get_https_authoriser')
+    mocker.patch.object(tf, 'get_transfer_client')
+    tf2.setup_globus_auth(None, transfer=tf)
+    assert tf2.get_https_session_pool() is tf.get_https_session_pool()
+
+    # one session per thread, all using the same adapter
+    pool = tf.get_https_session_pool()
+    session = pool.get_session()
+    assert pool.get_session() is session
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        other_session = executor.submit(pool.get_session).result()
+    assert other_session is not session
+    assert other_session.get_adapter("https://my.base.url") is session.get_adapter("https://my.base.url")
+
+
+@responses.activate()
+def test_download_files_ranged(tf, tmpdir, mocker):
+    mocker.patch('time.sleep')
+    data = os.urandom(10000)
+    checksum = hashlib.sha256(data).hexdigest()
+    tf._https_authoriser = AuthoriserMock()
+    tf._https_base_url = "https://my.base.url"
+    tf._remote_path = "my/remote/path"
+    tf._local_path = str(tmpdir)
+    tf._ranged_download_threshold = 5000
+    tf._range_size = 3000
+    failed = []
+
+    def range_callback(request):
+        first, last = map(int, request.headers["Range"].removeprefix("bytes=").split("-"))
+        if first == 3000 and not failed:
+            # fail one range once, it should be retried on its own
+            failed.append(first)
+            return (500, {}, "error")
+        return (206, {}, data[first:last + 1])
+
+    responses.add_callback(responses.GET, tf._url_for_file("bigfile"), callback=range_callback)
+
+    tf.download_files(["bigfile"], {"bigfile": checksum}, remote_files={"bigfile": {"size": len(data)}})
+
+    assert (tmpdir / "bigfile").read_binary() == data
+    assert len(responses.calls) == 5  # four ranges, one of them retried
+
+
+@responses.activate()
+def test_download_files_ranged_short_range(tf, tmpdir):
+    data = os.urandom(10000)
+    tf._https_authoriser = AuthoriserMock()
+    tf._https_base_url = "https://my.base.url"
+    tf._remote_path = "my/remote/path"
+    tf._local_path = str(tmpdir)
+    tf._ranged_download_threshold = 5000
+    tf._range_size = 3000
+
+    def range_callback(request):
+        first, last = map(int, request.headers["Range"].removeprefix("bytes=").split("-"))
+        return (206, {}, data[first:last])  # one byte short
+
+    responses.add_callback(responses.GET, tf._url_for_file("bigfile"), callback=range_callback)
+
+    with pytest.raises(RemoteJobTransfererError):
+        tf.download_files(["bigfile"], {"bigfile": None}, retries=False, remote_files={"bigfile": {"size": len(data)}})
+    assert not os.path.exists(tmpdir / "bigfile")
+    # the partial download is not left behind
+    assert os.listdir(tmpdir) == []
+
+
+@responses.activate()
+def test_upload_files_in_parts(tf, tmpdir, mocker):
+    mocker.patch('time.sleep')
+    data = os.urandom(10000)
+    bigfile = tmpdir / "bigfile"
+    bigfile.write_binary(data)
+    tf._https_authoriser = AuthoriserMock()
+    tf._https_base_url = "https://my.base.url"
+    tf._remote_path = "my/remote/path"
+    tf._local_path = str(tmpdir)
+    tf._max_workers = 2
+    tf._chunked_upload_threshold = 5000
+    tf._upload_part_size = 3000
+    parts = [f".bigfile.rjm-part-{index:04d}" for index in range(4)]
+    received = {}
+
+    def put_callback(request):
+        name = os.path.basename(request.url)
+        if name == parts[1] and name not in received:
+            # fail one part once, it should be retried on its own
+            received[name] = None
+            return (500, {}, "error")
+        received[name] = request.body
+        return (200, {}, "")
+
+    for part in parts:
+        responses.add_callback(responses.PUT, tf._url_for_file(part), callback=put_callback)
+
+    checksums = tf.upload_files([str(bigfile)])
+
+    assert checksums == {"bigfile": hashlib.sha256(data).hexdigest()}
+    assert b"".join(received[part] for part in parts) == data
+    assert len(responses.calls) == 5
+    assert tf.pop_file_parts() == {"bigfile": parts}
+    assert tf.pop_file_parts() == {}
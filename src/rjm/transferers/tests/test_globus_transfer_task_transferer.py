@@ -0,0 +1,170 @@
+
+import os
+import shutil
+import hashlib
+import configparser
+
+import pytest
+
+from rjm.transferers.globus_transfer_task_transferer import GlobusTransferTaskTransferer, TransferTask
+from rjm.errors import RemoteJobTransfererError, RemoteJobConfigError
+
+
+class FakeTransferClient:
+    """
+    Local stand-in for the Globus Transfer API: the local collection is the
+    local filesystem and the remote collection is rooted at `remote_root`.
+
+    """
+    def __init__(self, remote_root):
+        self.remote_root = remote_root
+        self.tasks = {}
+
+    def _path(self, endpoint, path):
+        return os.path.join(self.remote_root, path.lstrip("/")) if endpoint == "remote-ep" else path
+
+    def submit_transfer(self, data):
+        task_id = f"task-{len(self.tasks)}"
+        succeeded = []
+        for item in data["DATA"]:
+            source = self._path(data["source_endpoint"], item["source_path"])
+            destination = self._path(data["destination_endpoint"], item["destination_path"])
+            if os.path.isfile(source):
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.copyfile(source, destination)
+                succeeded.append({"source_path": item["source_path"], "destination_path": item["destination_path"]})
+        self.tasks[task_id] = {"status": "ACTIVE", "polls": 0, "succeeded": succeeded}
+
+        return {"task_id": task_id}
+
+    def get_task(self, task_id):
+        # active on the first poll, then finished
+        task = self.tasks[task_id]
+        task["polls"] += 1
+        if task["polls"] > 1:
+            task["status"] = "SUCCEEDED"
+
+        return {"status": task["status"]}
+
+    def task_successful_transfers(self, task_id, marker=None):
+        # one item per page, to test paging
+        succeeded = self.tasks[task_id]["succeeded"]
+        index = int(marker or 0)
+        return PageMock(succeeded[index:index + 1], str(index + 1) if index + 1 < len(succeeded) else None)
+
+    def cancel_task(self, task_id):
+        self.tasks[task_id]["status"] = "FAILED"
+
+
+class PageMock(list):
+    def __init__(self, items, next_marker):
+        super().__init__(items)
+        self._next_marker = next_marker
+
+    def get(self, key):
+        return self._next_marker if key == "next_marker" else None
+
+
+@pytest.fixture
+def configobj():
+    config = configparser.ConfigParser()
+    config["GLOBUS_TRANSFER"] = {
+        "remote_endpoint": "remote-ep",
+        "remote_path": "base",
+        "local_endpoint": "local-ep",
+        "task_poll_interval": "0",
+    }
+
+    return config
+
+
+@pytest.fixture
+def client(tmpdir):
+    return FakeTransferClient(str(tmpdir / "remote"))
+
+
+def make_transferer(mocker, configobj, client, local_dir, remote_path):
+    mocker.patch('rjm.config.load_config', return_value=configobj)
+    tf = GlobusTransferTaskTransferer()
+    tf._transfer_client = client
+    tf.set_local_directory(str(local_dir))
+    tf.set_remote_directory(remote_path)
+
+    return tf
+
+
+def test_local_endpoint_required(mocker, configobj):
+    del configobj["GLOBUS_TRANSFER"]["local_endpoint"]
+    mocker.patch('rjm.config.load_config', return_value=configobj)
+    with pytest.raises(RemoteJobConfigError):
+        GlobusTransferTaskTransferer()
+
+
+def test_upload_and_download(mocker, configobj, client, tmpdir):
+    local_dir = tmpdir / "job"
+    local_dir.mkdir()
+    (local_dir / "input.txt").write_binary(b"input data")
+    tf = make_transferer(mocker, configobj, client, local_dir, "job-remote")
+
+    checksums = tf.upload_files([str(local_dir / "input.txt")])
+
+    assert checksums == {"input.txt": hashlib.sha256(b"input data").hexdigest()}
+    with open(os.path.join(client.remote_root, "job-remote", "input.txt"), "rb") as fh:
+        assert fh.read() == b"input data"
+
+    # download it back to a different directory
+    tf.set_local_directory(str(tmpdir / "download"))
+    tf.download_files(["input.txt"], checksums, remote_files={"input.txt": {"size": 10}})
+    assert (tmpdir / "download" / "input.txt").read_binary() == b"input data"
+
+
+def test_download_missing_or_bad_checksum(mocker, configobj, client, tmpdir):
+    remote_dir = os.path.join(client.remote_root, "job-remote")
+    os.makedirs(remote_dir)
+    with open(os.path.join(remote_dir, "output.txt"), "wb") as fh:
+        fh.write(b"output")
+    tf = make_transferer(mocker, configobj, client, tmpdir / "job", "job-remote")
+
+    with pytest.raises(RemoteJobTransfererError):
+        tf.download_files(
+            ["output.txt", "missing.txt"],
+            {"output.txt": hashlib.sha256(b"output").hexdigest(), "missing.txt": None},
+            remote_files={"output.txt": {}, "missing.txt": {}},
+        )
+    assert (tmpdir / "job" / "output.txt").read_binary() == b"output"
+
+    with pytest.raises(RemoteJobTransfererError):
+        tf.download_files(["output.txt"], {"output.txt": "wrong"}, remote_files={"output.txt": {}})
+    assert not os.path.exists(tmpdir / "job" / "output.txt")
+
+
+def test_batch_upload_single_task(mocker, configobj, client, tmpdir):
+    batch_tf = make_transferer(mocker, configobj, client, tmpdir, None)
+    job_uploads = []
+    for i in range(3):
+        local_dir = tmpdir / f"job{i}"
+        local_dir.mkdir()
+        (local_dir / "input.txt").write_binary(f"job {i}".encode())
+        tf = make_transferer(mocker, configobj, client, local_dir, f"job{i}-remote")
+        job_uploads.append((tf, [str(local_dir / "input.txt")]))
+
+    batch_tf.batch_upload(job_uploads)
+    for tf, files in job_uploads:
+        tf.upload_files(files)
+
+    # all the jobs were uploaded by one task
+    assert len(client.tasks) == 1
+    for i in range(3):
+        with open(os.path.join(client.remote_root, f"job{i}-remote", "input.txt"), "rb") as fh:
+            assert fh.read() == f"job {i}".encode()
+
+
+def test_task_timeout(mocker, client):
+    mocker.patch('time.sleep')
+    mocker.patch('time.monotonic', side_effect=[0, 10, 100])
+    client.tasks["task-0"] = {"status": "INACTIVE", "polls": -100, "succeeded": []}
+
+    # a task that is stuck is cancelled rather than waited for forever
+    with pytest.raises(RemoteJobTransfererError, match="did not finish"):
+        TransferTask(client, "task-0", timeout=50).wait()
+    assert client.tasks["task-0"]["status"] == "FAILED"
@@ -0,0 +1,57 @@
+
+import os
+import hashlib
+import io
+
+import pytest
+
+from rjm.transferers import local_io
+
+
+@pytest.mark.parametrize("size", [0, 1000, 5 * 1024 * 1024])
+def test_hash_file(tmpdir, mocker, size):
+    # use a small threshold so the mmap path is tested too
+    mocker.patch('rjm.transferers.local_io.MMAP_THRESHOLD', 1024 * 1024)
+    data = os.urandom(size)
+    fn = tmpdir / "file"
+    fn.write_binary(data)
+
+    checksum = local_io.hash_file(str(fn), hashlib.sha256())
+
+    assert checksum.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_copy_with_checksum():
+    data = os.urandom(10 * 1024 * 1024 + 123)
+    dst = io.BytesIO()
+    checksum = hashlib.sha256()
+
+    copied = local_io.copy_with_checksum(io.BytesIO(data), dst, checksum)
+
+    assert copied == len(data)
+    assert dst.getvalue() == data
+    assert checksum.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_buffer_pool_reuses_buffers():
+    pool = local_io.BufferPool(buffer_size=16, max_buffers=1)
+    with pool.buffer() as view:
+        first = view.obj
+        # a second buffer is allocated while the first is in use
+        with pool.buffer() as other:
+            assert other.obj is not first
+            second = other.obj
+
+    # only one buffer is kept for reuse (the first one returned)
+    with pool.buffer() as view:
+        assert view.obj is second
+
+
+def test_preallocate(tmpdir):
+    fn = tmpdir / "file"
+    with open(fn, "wb") as fh:
+        local_io.preallocate(fh, 1000)
+        fh.write(b"data")
+        fh.truncate()
+
+    assert fn.read_binary() == b"data"
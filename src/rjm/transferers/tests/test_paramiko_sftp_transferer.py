@@ -0,0 +1,193 @@
+
+import os
+import shutil
+import hashlib
+import configparser
+
+import pytest
+
+paramiko = pytest.importorskip("paramiko")
+
+from rjm.transferers.paramiko_sftp_transferer import ParamikoSftpTransferer, SftpChannelPool  # noqa: E402
+
+
+class FakeSftpClient:
+    """SFTP client backed by the local filesystem"""
+    def __init__(self):
+        self.closed = False
+        self.fail_next = False
+
+    def get_channel(self):
+        return self
+
+    def putfo(self, fh, remote_path, file_size=0, confirm=True):
+        assert confirm is False
+        if self.fail_next:
+            self.fail_next = False
+            raise paramiko.SSHException("channel closed")
+        with open(remote_path, "wb") as out:
+            shutil.copyfileobj(fh, out)
+
+    def listdir_attr(self, path):
+        entries = []
+        for name in os.listdir(path):
+            attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)))
+            attr.filename = name
+            entries.append(attr)
+
+        return entries
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSshClient:
+    def __init__(self, compress=False):
+        self.compress = compress
+        self.channels = []
+
+    def open_sftp(self):
+        self.channels.append(FakeSftpClient())
+        return self.channels[-1]
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Connection manager that opens fake connections"""
+    def __init__(self):
+        self.ssh_clients = {}
+        self.open_channels = 0
+
+    def ssh_client(self, index=0, compress=False):
+        if (index, compress) not in self.ssh_clients:
+            self.ssh_clients[(index, compress)] = FakeSshClient(compress)
+        return self.ssh_clients[(index, compress)]
+
+    def add_idle_pool(self, pool):
+        pass
+
+    def acquire_channel_slot(self, index=0, compress=False):
+        self.open_channels += 1
+
+    def release_channel_slot(self, index=0, compress=False):
+        self.open_channels -= 1
+
+
+@pytest.fixture
+def connection():
+    return FakeConnection()
+
+
+@pytest.fixture
+def ssh_clients(connection):
+    return connection.ssh_clients
+
+
+@pytest.fixture
+def pool(connection):
+    return SftpChannelPool(connection, num_connections=2, num_channels=4)
+
+
+def test_channels_reused_and_spread(pool, ssh_clients):
+    with pool.channel() as first:
+        with pool.channel() as second:
+            pass
+    with pool.channel() as third:
+        pass
+
+    # two connections, one channel on each, and channels are reused
+    assert len(ssh_clients) == 2
+    assert first is not second
+    assert third in (first, second)
+
+
+def test_failed_channel_discarded(pool):
+    with pytest.raises(paramiko.SSHException):
+        with pool.channel() as failed:
+            raise paramiko.SSHException("broken")
+    with pool.channel() as replacement:
+        pass
+
+    assert failed.closed
+    assert replacement is not failed
+
+
+def test_channel_kept_after_sftp_error(pool, connection, ssh_clients):
+    for _ in range(3):
+        with pytest.raises(FileNotFoundError):
+            with pool.channel():
+                raise FileNotFoundError("missing output file")
+
+    # the same channel was returned to the pool each time
+    assert len(ssh_clients[(0, False)].channels) == 1
+    assert not ssh_clients[(0, False)].channels[0].closed
+    assert connection.open_channels == 1
+
+    # any other error closes the channel rather than leaking it
+    with pytest.raises(ValueError):
+        with pool.channel() as failed:
+            raise ValueError("unexpected")
+    assert failed.closed
+    assert connection.open_channels == 0
+
+
+@pytest.fixture
+def configobj(tmp_path):
+    config = configparser.ConfigParser()
+    config["PARAMIKO"] = {
+        "private_key_file": "key",
+        "remote_address": "host",
+        "remote_user": "user",
+        "remote_base_path": str(tmp_path / "remote"),
+    }
+    config["RETRY"] = {"override_defaults": "1", "tries": "2", "delay": "0", "backoff": "1"}
+
+    return config
+
+
+def test_compressed_channels_use_separate_connections(pool, ssh_clients):
+    with pool.channel():
+        pass
+    with pool.channel(compress=True):
+        pass
+
+    assert list(ssh_clients) == [(0, False), (1, True)]
+
+
+def test_compression_by_file_type(configobj):
+    configobj["PARAMIKO"]["sftp_compression"] = "auto"
+    tf = ParamikoSftpTransferer(config=configobj)
+
+    assert tf._compress("output.txt")
+    assert not tf._compress("results.tar.gz")
+
+
+def test_upload_files_retries_on_new_channel(mocker, configobj, pool, ssh_clients, tmp_path):
+    tf = ParamikoSftpTransferer(config=configobj)
+    tf._sftp_pool = pool
+    tf.set_local_directory(str(tmp_path / "local"))
+    tf.set_remote_directory("job")
+    os.makedirs(tmp_path / "remote" / "job")
+    os.makedirs(tmp_path / "local")
+    files = []
+    for name in ("a.txt", "b.txt", "c.txt"):
+        (tmp_path / "local" / name).write_bytes(name.encode())
+        files.append(str(tmp_path / "local" / name))
+
+    # the first channel fails once
+    with pool.channel() as sftp_client:
+        sftp_client.fail_next = True
+
+    checksums = tf.upload_files(files)
+
+    assert checksums == {name: hashlib.sha256(name.encode()).hexdigest() for name in ("a.txt", "b.txt", "c.txt")}
+    for name in ("a.txt", "b.txt", "c.txt"):
+        assert (tmp_path / "remote" / "job" / name).read_bytes() == name.encode()
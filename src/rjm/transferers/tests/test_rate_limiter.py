@@ -0,0 +1,76 @@
+
+import configparser
+from datetime import datetime
+
+import pytest
+
+from rjm.transferers import rate_limiter
+from rjm.transferers.rate_limiter import RateLimiter
+from rjm.errors import RemoteJobConfigError
+
+
+@pytest.fixture
+def configobj():
+    config = configparser.ConfigParser()
+    config["RATE_LIMIT"] = {
+        "max_rate": "2",
+        "download_max_rate": "1",
+    }
+
+    return config
+
+
+@pytest.fixture
+def clock(mocker):
+    # frozen monotonic clock
+    return mocker.patch('rjm.transferers.rate_limiter.time.monotonic', return_value=100.0)
+
+
+def test_no_limits(mocker):
+    mocked_sleep = mocker.patch('rjm.transferers.rate_limiter.time.sleep')
+    limiter = RateLimiter(configparser.ConfigParser())
+
+    limiter.throttle("upload", 10 ** 12)
+
+    mocked_sleep.assert_not_called()
+
+
+def test_throttle(configobj, clock, mocker):
+    mocked_sleep = mocker.patch('rjm.transferers.rate_limiter.time.sleep')
+    limiter = RateLimiter(configobj)
+
+    # the initial burst is allowed through
+    limiter.throttle("download", 1000000)
+    mocked_sleep.assert_not_called()
+
+    # the download cap (1 MB/s) applies before the global cap (2 MB/s)
+    limiter.throttle("download", 1000000)
+    mocked_sleep.assert_called_once_with(pytest.approx(1.0))
+
+    # uploads are only limited by the global cap, which has been used up by the downloads
+    mocked_sleep.reset_mock()
+    limiter.throttle("upload", 1000000)
+    mocked_sleep.assert_called_once_with(pytest.approx(0.5))
+
+
+def test_offpeak_multiplier(configobj, clock, mocker):
+    configobj["RATE_LIMIT"]["offpeak_hours"] = "19-7"
+    configobj["RATE_LIMIT"]["offpeak_multiplier"] = "4"
+    mocked_datetime = mocker.patch.object(rate_limiter, 'datetime')
+    mocked_sleep = mocker.patch('rjm.transferers.rate_limiter.time.sleep')
+    limiter = RateLimiter(configobj)
+
+    mocked_datetime.now.return_value = datetime(2024, 1, 1, 12)
+    assert limiter._multiplier() == 1
+    mocked_datetime.now.return_value = datetime(2024, 1, 1, 3)
+    assert limiter._multiplier() == 4
+
+    # off-peak the download bucket refills at 4 MB/s
+    limiter.throttle("download", 2000000)
+    mocked_sleep.assert_called_once_with(pytest.approx(0.25))
+
+
+def test_invalid_offpeak_hours(configobj):
+    configobj["RATE_LIMIT"]["offpeak_hours"] = "evenings"
+    with pytest.raises(RemoteJobConfigError):
+        RateLimiter(configobj)
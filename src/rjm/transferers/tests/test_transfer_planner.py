@@ -0,0 +1,82 @@
+
+import configparser
+
+import pytest
+
+from rjm.transferers.transfer_planner import (
+    TransferPlanner, LANE_INLINE, LANE_BUNDLE, LANE_STREAM, LANE_RANGED, SPLIT_AFTER_SECONDS,
+)
+
+
+@pytest.fixture
+def configobj():
+    config = configparser.ConfigParser()
+    config["FILES"] = {
+        "plan_transfers": "true",
+        "inline_max_kb": "1",
+        "bundle_max_kb": "10",
+    }
+
+    return config
+
+
+@pytest.fixture
+def planner(configobj):
+    return TransferPlanner(
+        configobj,
+        split_thresholds={"upload": 1000000, "download": 1000000},
+        min_split_sizes={"upload": 1000, "download": 1000},
+    )
+
+
+def test_lane_for(planner):
+    assert planner.lane_for(100, "download", inline_available=True) == LANE_INLINE
+    assert planner.lane_for(100, "download") == LANE_BUNDLE
+    assert planner.lane_for(5000, "download", inline_available=True) == LANE_BUNDLE
+    assert planner.lane_for(100000, "download") == LANE_STREAM
+    assert planner.lane_for(1000000, "upload") == LANE_RANGED
+    assert planner.lane_for(None, "download") == LANE_STREAM
+
+
+def test_disabled_only_splits():
+    planner = TransferPlanner(configparser.ConfigParser(), split_thresholds={"download": 1000})
+    assert not planner.enabled()
+    assert planner.lane_for(100, "download", inline_available=True) == LANE_STREAM
+    assert planner.lane_for(1000, "download") == LANE_RANGED
+    # no splitting unless the transferer supports it
+    assert planner.lane_for(1000, "upload") == LANE_STREAM
+    # and the configured threshold is not adjusted
+    planner.record(10 * 1000 * 1000, 10)
+    assert planner.split_threshold("download") == 1000
+
+
+def test_observations_adjust_thresholds(planner):
+    # 1 MB/s single stream throughput and 0.1 s per small file
+    planner.record(10 * 1000 * 1000, 10)
+    planner.record(100, 0.1)
+
+    assert planner.split_threshold("download") == 1000 * 1000 * SPLIT_AFTER_SECONDS
+    # a file that takes as long as the overhead of a request is bundled, up to a limit
+    assert planner.bundle_threshold() == 8 * 10 * 1024
+    assert planner.lane_for(50000, "upload") == LANE_BUNDLE
+
+
+def test_slow_link_keeps_split_threshold(configobj):
+    planner = TransferPlanner(configobj, split_thresholds={"download": 1000000})
+
+    # 2 kB/s, so any file over 120 kB takes longer than a minute
+    planner.record(2 * 1000 * 1000, 1000)
+
+    # but nothing below the configured threshold is split
+    assert planner.split_threshold("download") == 1000000
+    assert planner.lane_for(500000, "download") == LANE_STREAM
+
+
+def test_plan(planner):
+    plan = planner.plan({"a": 100, "b": 200, "c": 100000, "d": 2000000}, "download", inline_files={"a"})
+    assert plan[LANE_INLINE] == ["a"]
+    # a single bundled file is streamed instead
+    assert plan[LANE_BUNDLE] == []
+    assert plan[LANE_STREAM] == ["b", "c"]
+    assert plan[LANE_RANGED] == ["d"]
+    assert plan.summary().startswith("1 inline")
@@ -1,14 +1,18 @@
 
 import os.path
+import hashlib
+import tarfile
+import configparser
 
 import pytest
 
 from rjm.transferers import transferer_base
+from rjm.errors import RemoteJobTransfererError
 
 
 @pytest.fixture
 def transferer(mocker):
-    mocker.patch('rjm.config.load_config', return_value=None)  # no config required
+    mocker.patch('rjm.config.load_config', return_value=configparser.ConfigParser())  # empty config, use defaults
     transferer = transferer_base.TransfererBase()
     return transferer
 
@@ -63,3 +67,86 @@ def test_get_remote_directory(transferer):
     transferer._remote_path = None
     remote_dir_tuple = transferer.get_remote_directory()
     assert remote_dir_tuple is None
+
+
+def _make_bundle(path, files):
+    """Create a gzipped tar archive with the given contents, returning the manifest"""
+    checksums = {}
+    srcdir = path / "src"
+    srcdir.mkdir()
+    with tarfile.open(path / "bundle.tar.gz", "w:gz") as tar:
+        for fn, text in files.items():
+            (srcdir / fn).write_text(text)
+            tar.add(srcdir / fn, arcname=fn)
+            checksums[fn] = hashlib.sha256(text.encode()).hexdigest()
+
+    return str(path / "bundle.tar.gz"), checksums
+
+
+def test_extract_bundle(transferer, tmp_path, mocker):
+    bundle_file, checksums = _make_bundle(tmp_path, {"out1.txt": "first", "out2.txt": "second"})
+    localdir = tmp_path / "local"
+    localdir.mkdir()
+    transferer.set_local_directory(str(localdir))
+    throttle = mocker.patch.object(transferer, '_throttle_download')
+
+    transferer._extract_bundle(bundle_file, checksums)
+
+    # the bundle was already counted against the rate limit when it was downloaded
+    throttle.assert_not_called()
+
+    assert (localdir / "out1.txt").read_text() == "first"
+    assert (localdir / "out2.txt").read_text() == "second"
+    assert not (localdir / "out1.txt.rjm").exists()
+
+
+def test_extract_bundle_bad_checksum_and_missing(transferer, tmp_path):
+    bundle_file, checksums = _make_bundle(tmp_path, {"out1.txt": "first", "out2.txt": "second"})
+    checksums["out2.txt"] = "wrong"
+    checksums["missing.txt"] = "abc"
+    localdir = tmp_path / "local"
+    localdir.mkdir()
+    transferer.set_local_directory(str(localdir))
+
+    with pytest.raises(RemoteJobTransfererError):
+        transferer._extract_bundle(bundle_file, checksums)
+
+    # the verified file is kept but the bad one is not
+    assert (localdir / "out1.txt").read_text() == "first"
+    assert not (localdir / "out2.txt").exists()
+    assert not (localdir / "out2.txt.rjm").exists()
+
+
+def test_upload_bundle(transferer, tmp_path, mocker):
+    uploaded = {}
+
+    def upload_files(filenames):
+        # the archive only exists until upload_bundle returns
+        with tarfile.open(filenames[0]) as tar:
+            uploaded.update({name: tar.extractfile(name).read() for name in tar.getnames()})
+
+    mocker.patch.object(transferer, 'upload_files', side_effect=upload_files)
+    files = []
+    for name in ("a.txt", "b.txt"):
+        (tmp_path / name).write_bytes(name.encode())
+        files.append(str(tmp_path / name))
+
+    bundle_name, checksums = transferer.upload_bundle(files)
+
+    assert bundle_name == transferer_base.UPLOAD_BUNDLE_NAME
+    assert checksums == {name: hashlib.sha256(name.encode()).hexdigest() for name in ("a.txt", "b.txt")}
+    assert uploaded == {"a.txt": b"a.txt", "b.txt": b"b.txt"}
+
+
+def test_write_inline_files(transferer, tmp_path):
+    transferer.set_local_directory(str(tmp_path))
+    manifest = {
+        "good.txt": {"size": 4, "checksum": hashlib.sha256(b"good").hexdigest(), "content": "Z29vZA=="},
+        "bad.txt": {"size": 3, "checksum": "wrong", "content": "YmFk"},
+    }
+
+    with pytest.raises(RemoteJobTransfererError):
+        transferer.write_inline_files(manifest)
+
+    assert (tmp_path / "good.txt").read_bytes() == b"good"
+    assert not (tmp_path / "bad.txt").exists()
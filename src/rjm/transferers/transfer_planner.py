@@ -0,0 +1,178 @@
+
+import logging
+import threading
+
+from rjm import utils
+
+
+LANE_INLINE = "inline"  # contents sent along with a runner call
+LANE_BUNDLE = "bundle"  # packed into one archive with other small files
+LANE_STREAM = "stream"  # one request per file
+LANE_RANGED = "ranged"  # split into byte ranges/parts transferred in parallel
+LANES = (LANE_INLINE, LANE_BUNDLE, LANE_STREAM, LANE_RANGED)
+
+BUNDLE_MAX_KB = 1024
+SPLIT_AFTER_SECONDS = 60  # split files that would take longer than this on a single stream
+THROUGHPUT_SMOOTHING = 0.3  # weight of the newest observation in the moving averages
+THROUGHPUT_MIN_BYTES = 1024 * 1024  # smaller transfers are dominated by latency, not bandwidth
+
+logger = logging.getLogger(__name__)
+
+
+class TransferPlan:
+    """The files of one job, sorted into lanes"""
+    def __init__(self):
+        self.lanes = {lane: [] for lane in LANES}
+        self._sizes = {lane: 0 for lane in LANES}
+
+    def add(self, lane, filename, size):
+        self.lanes[lane].append(filename)
+        self._sizes[lane] += size or 0
+
+    def __getitem__(self, lane):
+        return self.lanes[lane]
+
+    def summary(self):
+        """Return a one line description of the plan, for logging"""
+        parts = []
+        for lane in LANES:
+            if self.lanes[lane]:
+                size, units = utils.pretty_size_from_bytes(self._sizes[lane])
+                parts.append(f"{len(self.lanes[lane])} {lane} ({size:.1f} {units})")
+
+        return ", ".join(parts) if parts else "nothing to transfer"
+
+
+class TransferPlanner:
+    """
+    Decides how each file should be transferred based on its size.
+
+    The thresholds come from the config and, if planning is enabled, are
+    adjusted using the throughput and per-file overhead observed for previous
+    transfers:
+
+    - files whose transfer would be dominated by per-request overhead are
+      bundled
+    - files that would take longer than `SPLIT_AFTER_SECONDS` on a single
+      stream are split into ranges/parts (if the transferer supports it),
+      but never below the configured split threshold
+
+    One planner is shared by all the transferers in a batch.
+
+    """
+    def __init__(self, config, split_thresholds=None, min_split_sizes=None):
+        """
+        :param config: the config object
+        :param split_thresholds: optional, dictionary with the size at which
+            files are split for "upload" and "download", if the transferer
+            supports splitting
+        :param min_split_sizes: optional, dictionary with the sizes below which
+            files are never split for "upload" and "download" (e.g. two parts)
+
+        """
+        self._enabled = config.getboolean("FILES", "plan_transfers", fallback=False)
+        self._inline_max = utils.get_inline_max_size_from_config(config)
+        self._bundle_max = config.getint("FILES", "bundle_max_kb", fallback=BUNDLE_MAX_KB) * 1024
+        self._split_thresholds = split_thresholds or {}
+        self._min_split_sizes = min_split_sizes or {}
+
+        # moving averages of single stream throughput (bytes/s) and per-file overhead (s)
+        self._lock = threading.Lock()
+        self._throughput = None
+        self._overhead = None
+
+    def enabled(self):
+        """Return whether files are sorted into inline and bundle lanes"""
+        return self._enabled
+
+    def record(self, nbytes, elapsed_time):
+        """Record an observed single stream transfer"""
+        if elapsed_time <= 0:
+            return
+
+        with self._lock:
+            if nbytes >= THROUGHPUT_MIN_BYTES:
+                rate = nbytes / elapsed_time
+                self._throughput = rate if self._throughput is None else (
+                    THROUGHPUT_SMOOTHING * rate + (1 - THROUGHPUT_SMOOTHING) * self._throughput)
+            else:
+                self._overhead = elapsed_time if self._overhead is None else (
+                    THROUGHPUT_SMOOTHING * elapsed_time + (1 - THROUGHPUT_SMOOTHING) * self._overhead)
+
+    def bundle_threshold(self):
+        """Files up to this size are bundled"""
+        threshold = self._bundle_max
+        if self._throughput is not None and self._overhead is not None:
+            # the size that takes as long to send as the overhead of a request
+            threshold = min(max(threshold, int(self._throughput * self._overhead)), 8 * self._bundle_max)
+
+        return threshold
+
+    def split_threshold(self, direction):
+        """
+        Files at least this size are split when transferred in the given
+        direction ("upload" or "download"), or None if splitting is not
+        supported
+
+        """
+        threshold = self._split_thresholds.get(direction)
+        if threshold is None:
+            return None
+
+        if self._enabled and self._throughput is not None:
+            # only raised, so fast links don't split files the config says to stream
+            threshold = max(threshold, int(self._throughput * SPLIT_AFTER_SECONDS))
+
+        return max(threshold, self._min_split_sizes.get(direction, 0) + 1)
+
+    def lane_for(self, size, direction, inline_available=False):
+        """
+        Return the lane for a file of the given size.
+
+        :param size: size of the file, or None if unknown
+        :param direction: "upload" or "download"
+        :param inline_available: whether the file's contents are already
+            available (e.g. sent back with the manifest)
+
+        """
+        if size is None:
+            return LANE_STREAM
+
+        if self._enabled:
+            if inline_available and size <= self._inline_max:
+                return LANE_INLINE
+            if size <= self.bundle_threshold():
+                return LANE_BUNDLE
+
+        split_threshold = self.split_threshold(direction)
+        if split_threshold is not None and size >= split_threshold:
+            return LANE_RANGED
+
+        return LANE_STREAM
+
+    def plan(self, file_sizes, direction, inline_files=()):
+        """
+        Sort files into lanes.
+
+        :param file_sizes: dictionary with file names as keys and sizes as values
+        :param direction: "upload" or "download"
+        :param inline_files: optional, files whose contents are already available
+
+        :returns: :class:`TransferPlan`
+
+        """
+        lanes = {
+            filename: self.lane_for(size, direction, inline_available=filename in inline_files)
+            for filename, size in file_sizes.items()
+        }
+
+        # a bundle of one file is no better than streaming it
+        bundled = [filename for filename, lane in lanes.items() if lane == LANE_BUNDLE]
+        if len(bundled) == 1:
+            lanes[bundled[0]] = LANE_STREAM
+
+        plan = TransferPlan()
+        for filename, lane in lanes.items():
+            plan.add(lane, filename, file_sizes[filename])
+
+        return plan
@@ -1,14 +1,24 @@
 
 import os
-import hashlib
+import time
+import base64
 import logging
+import tarfile
+import tempfile
 from typing import List
 
 from rjm import utils
 from rjm import config as config_helper
+from rjm.transferers import local_io
+from rjm.transferers.rate_limiter import RateLimiter
+from rjm.transferers.transfer_planner import TransferPlanner
+from rjm.errors import RemoteJobTransfererError
 
 
 FILE_CHUNK_SIZE = 8000000
+DOWNLOAD_SUFFIX = '.rjm'
+UPLOAD_PART_NAME = ".{name}.rjm-part-{index:04d}"  # large files are uploaded in parts with these names
+UPLOAD_BUNDLE_NAME = ".rjm-uploads.tar.gz"
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +28,10 @@ class TransfererBase:
     Base class for objects that transfer files between local and remote.
 
     """
+    # whether `batch_upload` and `batch_download` transfer the files of
+    # several jobs together
+    BATCH_TRANSFERS = False
+
     def __init__(self, config=None):
         # load config
         if config is None:
@@ -25,11 +39,21 @@ class TransfererBase:
         else:
             self._config = config
 
+        # checksums calculated locally must use the same algorithm as the remote
+        self._checksum_algorithm = utils.get_checksum_algorithm_from_config(self._config)
+
         self._remote_base_path = None
         self._remote_path = None
         self._local_path = None
         self._label = ""
 
+        # files that were uploaded in parts and need joining on the remote
+        self._file_parts = {}
+
+        # bandwidth limits and transfer planning, shared with transferers that are set up from this one
+        self._rate_limiter = None
+        self._planner = None
+
     def _log(self, level, message, *args, **kwargs):
         """Add a label to log messages, identifying this specific RemoteJob"""
         logger.log(level, self._label + message, *args, **kwargs)
@@ -53,6 +77,15 @@ class TransfererBase:
         """Do any setup required by the specific transferer implementation"""
         pass
 
+    def close(self):
+        """
+        Release any connections or threads held by the specific transferer
+        implementation; they are created again if the transferer is used
+        afterwards
+
+        """
+        pass
+
     def get_globus_scopes(self):
         """If any Globus scopes are required, override this method and return them in a list"""
         return []
@@ -82,22 +115,101 @@ class TransfererBase:
         """Do any Globus auth setup here, if required"""
         pass
 
-    def log_transfer_time(self, text: str, local_file: str, elapsed_time: float, log_level: int = logging.DEBUG):
-        """Report the time taken to upload/download a file"""
+    def get_rate_limiter(self):
+        """Return the rate limiter, creating it if required"""
+        if self._rate_limiter is None:
+            self._rate_limiter = RateLimiter(self._config)
+
+        return self._rate_limiter
+
+    def get_planner(self):
+        """Return the transfer planner, creating it if required"""
+        if self._planner is None:
+            self._planner = self._create_planner()
+
+        return self._planner
+
+    def _create_planner(self):
+        """Create the transfer planner, override to pass thresholds for splitting files"""
+        return TransferPlanner(self._config)
+
+    def plan_uploads(self, filenames: List[str]):
+        """
+        Sort the files to upload into lanes (see :class:`TransferPlanner`)
+
+        :returns: :class:`TransferPlan` with local file paths
+
+        """
+        return self.get_planner().plan({fn: os.path.getsize(fn) for fn in filenames}, "upload")
+
+    def plan_downloads(self, manifest: dict):
+        """
+        Sort the files to download into lanes (see :class:`TransferPlanner`)
+
+        :param manifest: dictionary with file names as keys and dictionaries
+            with "size", "checksum" and optionally "content" as values
+
+        :returns: :class:`TransferPlan` with remote file names
+
+        """
+        return self.get_planner().plan(
+            {fn: entry["size"] for fn, entry in manifest.items()},
+            "download",
+            inline_files={fn for fn, entry in manifest.items() if "content" in entry},
+        )
+
+    def _throttle_upload(self, nbytes):
+        """Wait until `nbytes` more bytes can be uploaded within the rate limits"""
+        self.get_rate_limiter().throttle("upload", nbytes)
+
+    def _throttle_download(self, nbytes):
+        """Wait until `nbytes` more bytes can be downloaded within the rate limits"""
+        self.get_rate_limiter().throttle("download", nbytes)
+
+    def log_transfer_time(self, text: str, local_file: str, elapsed_time: float, log_level: int = logging.DEBUG,
+                          single_stream: bool = True):
+        """
+        Report the time taken to upload/download a file, and let the planner
+        know how long single stream transfers are taking
+
+        """
         file_size = os.path.getsize(local_file)
+        if single_stream:
+            self.get_planner().record(file_size, elapsed_time)
         file_size, file_size_units = utils.pretty_size_from_bytes(file_size)
         self._log(log_level, f"{text} {local_file}: {file_size:.1f} {file_size_units} in {elapsed_time:.1f} s "
                              f"({file_size / elapsed_time:.1f} {file_size_units}/s)")
 
+    def _new_checksum(self):
+        """
+        Return a new hash object for calculating checksums, which can be
+        updated incrementally as data is transferred
+
+        """
+        return utils.new_checksum(self._checksum_algorithm)
+
     def _calculate_checksum(self, filename):
         """
         Calculate the checksum of the given file
 
         """
-        with open(filename, 'rb') as fh:
-            checksum = hashlib.sha256()
-            while chunk := fh.read(FILE_CHUNK_SIZE):
-                checksum.update(chunk)
+        return local_io.hash_file(filename, self._new_checksum()).hexdigest()
+
+    def _copy_with_checksum(self, src, dst, throttle=None):
+        """
+        Copy from one file object to another, calculating the checksum of
+        the data as it is copied so the file doesn't need to be read again
+
+        :param src: file object to read from
+        :param dst: file object to write to
+        :param throttle: optional, called with the size of each block copied
+            (e.g. `_throttle_download` when `src` is read from the network)
+
+        :returns: the checksum of the data that was copied
+
+        """
+        checksum = self._new_checksum()
+        local_io.copy_with_checksum(src, dst, checksum, throttle=throttle)
 
         return checksum.hexdigest()
 
@@ -110,9 +222,111 @@ class TransfererBase:
             directory to upload to the remote directory.
         :type filenames: iterable of str
 
+        :returns: dictionary with remote file names as keys and the checksums
+            of the uploaded data as values
+
         """
         raise NotImplementedError
 
+    def batch_upload(self, job_uploads):
+        """
+        Start uploading the files of several jobs together, if supported (see
+        `BATCH_TRANSFERS`); each job's `upload_files` then picks up its results.
+
+        :param job_uploads: list of tuples containing the transferer of each
+            job and the files it will upload
+
+        """
+        pass
+
+    def batch_download(self, job_downloads):
+        """
+        Start downloading the files of several jobs together, if supported
+        (see `BATCH_TRANSFERS`); each job's `download_files` then picks up its
+        results.
+
+        :param job_downloads: list of tuples containing the transferer of each
+            job and the files it will download
+
+        """
+        pass
+
+    def pop_file_parts(self):
+        """
+        Return the files that were uploaded in parts by `upload_files` and
+        still need to be joined on the remote (see `join_file_parts` on the
+        runners), and forget about them. If `upload_files` raised, this
+        includes the files that were not uploaded completely, whose parts
+        should be discarded instead.
+
+        :returns: dictionary with remote file names as keys and ordered lists
+            of the names of their parts as values
+
+        """
+        file_parts = self._file_parts
+        self._file_parts = {}
+
+        return file_parts
+
+    def upload_bundle(self, filenames: List[str]):
+        """
+        Pack the given files into a compressed archive and upload it, to be
+        unpacked on the remote (see `unpack_bundle` on the runners).
+
+        :param filenames: list of local files to pack, they are stored in the
+            archive under their base names
+
+        :returns: tuple containing the name of the archive in the remote
+            directory and a dictionary with the base names of the files as keys
+            and their checksums as values
+
+        """
+        checksums = {}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bundle_file = os.path.join(tmpdir, UPLOAD_BUNDLE_NAME)
+            with tarfile.open(bundle_file, "w:gz", compresslevel=1) as tar:
+                for fn in filenames:
+                    basename = os.path.basename(fn)
+                    tarinfo = tar.gettarinfo(fn, arcname=basename)
+                    with open(fn, 'rb') as fh:
+                        reader = ChecksumFileReader(fh, self._new_checksum())
+                        tar.addfile(tarinfo, fileobj=reader)
+                    checksums[basename] = reader.hexdigest()
+            self._log(logging.DEBUG, f"Packed {len(filenames)} files into {UPLOAD_BUNDLE_NAME}")
+
+            self.upload_files([bundle_file])
+
+        return UPLOAD_BUNDLE_NAME, checksums
+
+    def write_inline_files(self, manifest: dict):
+        """
+        Write files whose contents were sent back with the manifest (see
+        `get_manifests` on the runners), verifying their checksums.
+
+        :param manifest: dictionary with file names as keys and dictionaries
+            with "checksum" and "content" (base64 encoded) as values
+
+        """
+        errors = 0
+        for fn, entry in manifest.items():
+            content = base64.b64decode(entry["content"])
+            checksum = self._new_checksum()
+            checksum.update(content)
+            if checksum.hexdigest() != entry["checksum"]:
+                self._log(logging.ERROR, f"Checksum of inline file \"{fn}\" doesn't match")
+                errors += 1
+                continue
+
+            local_file = os.path.join(self._local_path, fn)
+            os.makedirs(os.path.dirname(local_file), exist_ok=True)
+            with open(local_file + DOWNLOAD_SUFFIX, 'wb') as fh:
+                fh.write(content)
+            os.replace(local_file + DOWNLOAD_SUFFIX, local_file)
+
+        self._log(logging.DEBUG, f"Wrote {len(manifest) - errors} files that were sent inline")
+        if errors > 0:
+            raise RemoteJobTransfererError(f"Failed to download files in '{self._local_path}'")
+
     def download_files(self, filenames: List[str], *args, **kwargs):
         """
         Download the given files (which should be relative to `remote_path`) to
@@ -121,10 +335,91 @@ class TransfererBase:
         :param filenames: List of file names relative to the `remote_path`
             directory to download to the local directory.
         :type filenames: iterable of str
+        :param checksums: dictionary with filenames as keys and checksums as
+            values
+        :param retries: optional, retry downloads if they fail
+        :param remote_files: optional, dictionary of the files that exist on the
+            remote, if known already
 
         """
         raise NotImplementedError
 
+    def download_bundle(self, bundle_name: str, bundle_checksum: str, checksums: dict):
+        """
+        Download an archive of files that was created on the remote (see
+        `bundle_files` on the runners) and extract it into the local directory.
+
+        :param bundle_name: name of the archive, relative to `remote_path`
+        :param bundle_checksum: the expected checksum of the archive
+        :param checksums: manifest of the files in the archive, with file
+            names as keys and expected checksums as values (None for files
+            that were missing on the remote)
+
+        """
+        self.download_files([bundle_name], {bundle_name: bundle_checksum})
+
+        bundle_file = os.path.join(self._local_path, bundle_name)
+        try:
+            self._extract_bundle(bundle_file, checksums)
+        finally:
+            os.remove(bundle_file)
+
+    def _extract_bundle(self, bundle_file: str, checksums: dict):
+        """
+        Extract the files listed in the manifest from the archive, verifying
+        the checksum of each file as it is extracted.
+
+        :param bundle_file: path to the local copy of the archive
+        :param checksums: manifest with file names as keys and expected
+            checksums as values
+
+        """
+        self._log(logging.DEBUG, f"Extracting files from: {bundle_file}")
+        start_time = time.perf_counter()
+        errors = 0
+        extracted_tmp_files = []
+        extracted = set()
+
+        # stream through the archive, so each member is only read once
+        with tarfile.open(bundle_file, "r|gz") as tar:
+            for member in tar:
+                # only extract regular files that we asked for (this also
+                # protects against members with unexpected paths)
+                if not member.isfile() or checksums.get(member.name) is None:
+                    self._log(logging.WARNING, f"Skipping unexpected member of archive: '{member.name}'")
+                    continue
+
+                local_file_tmp = os.path.join(self._local_path, member.name + DOWNLOAD_SUFFIX)
+                os.makedirs(os.path.dirname(local_file_tmp), exist_ok=True)
+                with open(local_file_tmp, 'wb') as fh:
+                    checksum = self._copy_with_checksum(tar.extractfile(member), fh)
+                extracted.add(member.name)
+
+                # verify against the manifest
+                if checksum == checksums[member.name]:
+                    extracted_tmp_files.append(local_file_tmp)
+                else:
+                    self._log(logging.ERROR, f"Checksum of extracted \"{local_file_tmp}\" doesn't match "
+                                             f"({checksum} vs {checksums[member.name]})")
+                    os.remove(local_file_tmp)
+                    errors += 1
+
+        # files that were in the manifest but did not make it into the archive
+        for fn in checksums:
+            if fn not in extracted:
+                self._log(logging.ERROR, f"File to download is missing: '{fn}'")
+                errors += 1
+
+        # now rename the temporary files to the actual files
+        for tmp_file in extracted_tmp_files:
+            os.replace(tmp_file, tmp_file.removesuffix(DOWNLOAD_SUFFIX))
+        extract_time = time.perf_counter() - start_time
+        self._log(logging.DEBUG, f"Extracted {len(extracted_tmp_files)} files in {extract_time:.1f} s")
+
+        # if there were any errors extracting files, raise an exception now
+        if errors > 0:
+            raise RemoteJobTransfererError(f"Failed to download files in '{self._local_path}'")
+
     def list_directory(self, path: str):
         """
         Return a listing of the given directory.
@@ -133,3 +428,45 @@ class TransfererBase:
 
         """
         raise NotImplementedError
+
+
+class ChecksumFileReader:
+    """
+    Wraps a file object that is open for reading and updates a checksum with
+    the data as it is read, e.g. while the file is streamed out by an upload.
+    If `size` is given, only that many bytes are read from the current
+    position, e.g. to upload part of a file. If `throttle` is given it is
+    called with the size of each chunk that is read, to limit the rate.
+
+    """
+    def __init__(self, fh, checksum, size=None, throttle=None):
+        self._fh = fh
+        self._throttle = throttle
+        self._size = os.fstat(fh.fileno()).st_size - fh.tell() if size is None else size
+        self._checksum = checksum
+        self._bytes_read = 0
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        remaining = self._size - self._bytes_read
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        chunk = self._fh.read(size)
+        if self._throttle is not None:
+            self._throttle(len(chunk))
+        self._checksum.update(chunk)
+        self._bytes_read += len(chunk)
+        return chunk
+
+    def hexdigest(self):
+        """
+        Return the checksum of the data that was read
+
+        :raises RemoteJobTransfererError: if the file was not read to the end
+
+        """
+        if self._bytes_read != self._size:
+            raise RemoteJobTransfererError(f"Only {self._bytes_read} of {self._size} bytes were read from the file")
+
+        return self._checksum.hexdigest()
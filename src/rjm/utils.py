@@ -1,6 +1,7 @@
 
 import os
 import math
+import hashlib
 import logging
 import shutil
 from datetime import datetime
@@ -8,6 +9,7 @@ from datetime import datetime
 from fair_research_login import NativeClient, JSONTokenStorage
 
 from rjm import config as config_helper
+from rjm.errors import RemoteJobConfigError
 
 
 # default file locations
@@ -37,6 +39,11 @@ DEFAULT_RETRY_BACKOFF = 2  # factor to increase delay by each time
 DEFAULT_RETRY_DELAY = 5  # initial delay
 DEFAULT_RETRY_MAX_DELAY = 900
 
+# checksums (xxh3 requires the optional xxhash package locally and on the remote)
+DEFAULT_CHECKSUM_ALGORITHM = "sha256"
+CHECKSUM_ALGORITHMS = ["sha256", "blake2b", "xxh3"]
+DEFAULT_INLINE_MAX_KB = 16  # files up to this size can be sent along with runner calls
+
 logger = logging.getLogger(__name__)
 logging.captureWarnings(True)
 
@@ -151,3 +158,46 @@ def get_retry_values_from_config(config):
         logger.debug(f"Using default retry values: tries={retry_tries}, backoff={retry_backoff}, delay={retry_delay}, max_delay={retry_max_delay}")
 
     return retry_tries, retry_backoff, retry_delay, retry_max_delay
+
+
+def get_checksum_algorithm_from_config(config):
+    """
+    Return the algorithm used for calculating checksums of transferred files
+
+    """
+    algorithm = config.get("FILES", "checksum_algorithm", fallback=DEFAULT_CHECKSUM_ALGORITHM)
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise RemoteJobConfigError(f"Unsupported checksum algorithm '{algorithm}' (choose from: {', '.join(CHECKSUM_ALGORITHMS)})")
+
+    return algorithm
+
+
+def get_inline_max_size_from_config(config):
+    """
+    Return the maximum size (bytes) of files whose contents are sent along
+    with runner calls, or 0 if transfers are not planned
+
+    """
+    if not config.getboolean("FILES", "plan_transfers", fallback=False):
+        return 0
+
+    return config.getint("FILES", "inline_max_kb", fallback=DEFAULT_INLINE_MAX_KB) * 1024
+
+
+def new_checksum(algorithm=DEFAULT_CHECKSUM_ALGORITHM):
+    """
+    Return a new hash object for the given checksum algorithm
+
+    """
+    if algorithm == "xxh3":
+        try:
+            import xxhash
+        except ImportError as exc:
+            raise RemoteJobConfigError("xxhash is not installed; install it or choose a different checksum_algorithm") from exc
+        checksum = xxhash.xxh3_128()
+    elif algorithm in CHECKSUM_ALGORITHMS:
+        checksum = hashlib.new(algorithm)
+    else:
+        raise RemoteJobConfigError(f"Unsupported checksum algorithm: {algorithm}")
+
+    return checksum